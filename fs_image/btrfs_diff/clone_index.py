@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+'''
+`extents_to_chunks_with_clones` is a batch computation over every file of
+a `SubvolumeSet`, so asking "what clones what?" after each change to a
+large filesystem would be prohibitively expensive (see ROADMAP, (i)).
+
+`CloneIndex` answers the same question incrementally.  It maps each leaf
+`Extent` (by object identity, as in `extents_to_chunks.py`) to the
+`InodeID`s of the files that contain it, and caches the `Chunk`s that it
+computed for each file.  A mutation only marks its file as dirty, which
+is O(1).  Before answering a query, the index re-reads the trimmed leaves
+of the dirty files, and discards the cached `Chunk`s of the files whose
+clones might have changed -- that is, the dirty files, and the ones that
+share leaves with them, before or after the change.  A query then only
+recomputes the discarded files, together with the files that share their
+leaves.  So, its cost is proportional to the changed part of the
+filesystem, rather than the whole `SubvolumeSet`.
+
+To keep an index current, pass it to `SubvolumeSet.new(clone_index=...)`.
+`Subvolume` marks files dirty as it applies items to them.
+'''
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Mapping, Optional, Sequence, Set
+
+from .extents_to_chunks import extents_to_chunks_with_clones
+from .inode import Chunk
+from .inode_id import InodeID
+
+
+class CloneIndex:
+    # The files we were told about, possibly with un-indexed changes.
+    _id_to_file: Dict[InodeID, 'IncompleteFile']
+    # Files whose leaves may differ from `_id_to_leaves`, or were deleted.
+    _dirty: Set[InodeID]
+    # The trimmed leaves of each file, as of the last `_refresh`.  This
+    # also keeps the leaves alive, so their `id()`s are not reused while
+    # they are keys of `_leaf_id_to_ids`.
+    _id_to_leaves: Dict[InodeID, Sequence]
+    # How many times each file contains each leaf.
+    _leaf_id_to_ids: Dict[int, Counter]
+    # `Chunk`s computed by earlier queries, still valid.
+    _id_to_chunks: Dict[InodeID, Sequence[Chunk]]
+
+    def __init__(self):
+        self._id_to_file = {}
+        self._dirty = set()
+        self._id_to_leaves = {}
+        self._leaf_id_to_ids = defaultdict(Counter)
+        self._id_to_chunks = {}
+
+    def mark_dirty(
+        self, ino_id: InodeID, ino: Optional['IncompleteFile'],
+    ) -> None:
+        'Call after changing the `extent` of a file, or with `None` to remove.'
+        if ino is None:
+            self._id_to_file.pop(ino_id, None)
+        else:
+            self._id_to_file[ino_id] = ino
+        self._dirty.add(ino_id)
+
+    def _invalidate(self, ino_id: InodeID, leaves: Sequence) -> None:
+        self._id_to_chunks.pop(ino_id, None)
+        for _, _, leaf in leaves:
+            for peer_id in self._leaf_id_to_ids[id(leaf)]:
+                self._id_to_chunks.pop(peer_id, None)
+
+    def _refresh(self) -> None:
+        for ino_id in self._dirty:
+            old_leaves = self._id_to_leaves.pop(ino_id, ())
+            self._invalidate(ino_id, old_leaves)
+            for _, _, leaf in old_leaves:
+                ids = self._leaf_id_to_ids[id(leaf)]
+                ids[ino_id] -= 1
+                if not ids[ino_id]:
+                    del ids[ino_id]
+                    if not ids:
+                        del self._leaf_id_to_ids[id(leaf)]
+            ino = self._id_to_file.get(ino_id)
+            if ino is None:
+                continue
+            new_leaves = tuple(ino.extent.gen_trimmed_leaves())
+            self._id_to_leaves[ino_id] = new_leaves
+            for _, _, leaf in new_leaves:
+                self._leaf_id_to_ids[id(leaf)][ino_id] += 1
+            self._invalidate(ino_id, new_leaves)
+        self._dirty.clear()
+
+    def clone_peers(self, ino_id: InodeID) -> Set[InodeID]:
+        'The other files sharing any leaf extents with `ino_id`.'
+        self._refresh()
+        return {
+            peer_id for _, _, leaf in self._id_to_leaves.get(ino_id, ())
+                for peer_id in self._leaf_id_to_ids[id(leaf)]
+                    if peer_id != ino_id
+        }
+
+    def id_to_chunks(
+        self, ino_ids: Iterable[InodeID],
+    ) -> Mapping[InodeID, Sequence[Chunk]]:
+        '''
+        Returns the same `Chunk`s for `ino_ids` as would a batch run of
+        `extents_to_chunks_with_clones` on all the files in the index.
+        This is suitable for the `id_to_chunks` of `Subvolume.freeze`.
+        '''
+        self._refresh()
+        ino_ids = list(ino_ids)
+        missing_ids = {i for i in ino_ids if i not in self._id_to_chunks}
+        if missing_ids:
+            # The `ChunkClone`s of a file only involve the files that share
+            # its leaves, so it is enough to compute those.
+            ids_to_compute = set(missing_ids)
+            for ino_id in missing_ids:
+                ids_to_compute.update(self.clone_peers(ino_id))
+            for ino_id, chunks in extents_to_chunks_with_clones([
+                (i, self._id_to_file[i].extent) for i in ids_to_compute
+            ]):
+                # The peers' own peers may be missing, so their `Chunk`s
+                # might be incomplete.
+                if ino_id in missing_ids:
+                    self._id_to_chunks[ino_id] = chunks
+        return {i: self._id_to_chunks[i] for i in ino_ids}
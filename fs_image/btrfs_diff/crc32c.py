@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''
+CRC32C (Castagnoli), as used to checksum btrfs send-stream commands.
+
+`crc32c` is the "raw" variant that `btrfs send` uses: there is no bit
+inversion on input or output.  To get the textbook CRC32C of `data`, use
+`crc32c(data, 0xffffffff) ^ 0xffffffff`.
+
+The pure-Python implementation is "slice-by-8": it consumes 8 bytes per
+loop iteration via 8 precomputed lookup tables, which is several times
+faster than the classic byte-at-a-time loop.  If the `crc32c` extension
+module from PyPI is importable, we use it instead.
+'''
+import struct
+
+_POLY = 0x82F63B78  # Bit-reversed Castagnoli polynomial
+_MASK = 0xFFFFFFFF
+
+
+def _make_tables():
+    t0 = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ _POLY if crc & 1 else crc >> 1
+        t0.append(crc)
+    tables = [t0]
+    for _ in range(7):
+        prev = tables[-1]
+        tables.append([(c >> 8) ^ t0[c & 0xFF] for c in prev])
+    return tables
+
+
+_TABLES = _make_tables()
+
+
+def _py_crc32c(data, crc: int = 0) -> int:
+    t0, t1, t2, t3, t4, t5, t6, t7 = _TABLES
+    view = memoryview(data).cast('B')
+    num_words = len(view) // 8
+    # A 64-bit little-endian word is 8 consecutive bytes, with the first
+    # byte in the lowest bits -- it goes through the "furthest" table.
+    for w in struct.unpack_from(f'<{num_words}Q', view):
+        w ^= crc
+        crc = (
+            t7[w & 0xFF] ^ t6[(w >> 8) & 0xFF] ^
+            t5[(w >> 16) & 0xFF] ^ t4[(w >> 24) & 0xFF] ^
+            t3[(w >> 32) & 0xFF] ^ t2[(w >> 40) & 0xFF] ^
+            t1[(w >> 48) & 0xFF] ^ t0[w >> 56]
+        )
+    for b in view[num_words * 8:]:
+        crc = t0[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+try:
+    from crc32c import crc32c as _ext_crc32c  # The PyPI module, not us
+except ImportError:
+    _ext_crc32c = None
+
+
+def crc32c(data, crc: int = 0) -> int:
+    '''
+    Returns the raw CRC32C of the bytes-like `data`, continuing from `crc`.
+    Chaining works: `crc32c(b, crc32c(a)) == crc32c(a + b)`.
+    '''
+    if _ext_crc32c is None:
+        return _py_crc32c(data, crc)
+    # The extension computes the inverted variant, so undo the inversion.
+    return _ext_crc32c(data, crc ^ _MASK) ^ _MASK  # pragma: no cover
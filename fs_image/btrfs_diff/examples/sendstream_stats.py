@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+  python3 -m btrfs_diff.examples.sendstream_stats \
+      [--json] [--profile OUT.prof] sendstream1 sendstream2 ...
+
+Applies the send-streams to a `SubvolumeSet` like
+`sendstreams_to_json_subvolumes`, and reports where the time went:
+
+ - For each kind of send-stream item: the count, the bytes of data, and
+   the time spent parsing & applying these items.
+ - For each send-stream, and for the final `freeze`: the wall time, and
+   the peak memory allocated by Python.
+
+`--json` prints the same in a machine-readable form, e.g. to track
+regressions in CI.  `--profile` additionally writes a `cProfile` dump,
+which you can explore via:
+
+  python3 -m pstats OUT.prof
+
+Memory tracing slows things down.  Pass `--no-trace-memory` for more
+representative timings.
+'''
+import argparse
+import cProfile
+import json
+import sys
+
+from ..parse_send_stream import parse_send_stream
+from ..sendstream_stats import apply_sendstreams_with_stats
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Print the statistics as JSON instead of as tables.',
+    )
+    parser.add_argument(
+        '--profile', metavar='OUT',
+        help='Write a `cProfile` dump of the whole run to this file.',
+    )
+    parser.add_argument(
+        '--no-trace-memory', action='store_true',
+        help='Do not measure peak memory, which slows down the run.',
+    )
+    parser.add_argument(
+        '--zero-copy', action='store_true',
+        help='Parse via `parse_send_stream(zero_copy=True)`.',
+    )
+    parser.add_argument(
+        'sendstream', type=argparse.FileType('br'), nargs='+',
+        help='A file containing the output of `btrfs send`. The '
+            'send-streams are applied from left to right.',
+    )
+    args = parser.parse_args(argv[1:])
+
+    profile = cProfile.Profile() if args.profile else None
+    if profile:
+        profile.enable()
+    _frozen, stats = apply_sendstreams_with_stats(
+        args.sendstream,
+        # We only track extent lengths, so don't bother reading the data.
+        parse=lambda infile: parse_send_stream(
+            infile, keep_data=False, zero_copy=args.zero_copy,
+        ),
+        trace_memory=not args.no_trace_memory,
+    )
+    if profile:
+        profile.disable()
+        profile.dump_stats(args.profile)
+
+    if args.json:
+        json.dump(stats.to_json_dict(), sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print(stats.format())
+
+
+if __name__ == '__main__':
+    main(sys.argv)
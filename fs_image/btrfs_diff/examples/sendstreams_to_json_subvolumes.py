@@ -32,7 +32,6 @@ A few things to try:
 # NB This was cribbed from `test_sendstream_to_subvolume_set_integration.py`
 # to encourage interactive play with send-streams.
 import argparse
-import json
 import sys
 
 from ..freeze import freeze
@@ -41,9 +40,10 @@ from ..inode_utils import (
     erase_mode_and_owner, erase_selinux_xattr, erase_utimes_in_range,
     SELinuxXAttrStats,
 )
-from ..parse_send_stream import parse_send_stream
-from ..rendered_tree import emit_non_unique_traversal_ids
+from ..parse_send_stream import parse_send_stream, parse_send_stream_parallel
+from ..rendered_tree_json import write_subvolumes_json
 from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+from ..subvolume_set_cache import SubvolumeSetCache
 
 
 def main(argv):
@@ -99,6 +99,29 @@ def main(argv):
             'if necessary: "@minimally-unambuguous-uuid-prefix". If in '
             'doubt, first look at the output without `--show-only`.'
     )
+    parser.add_argument(
+        '--extent-ids', action='store_true',
+        help='Instead of listing, for each chunk, all the chunks that clone '
+            'it, number the shared extents, and list the references to '
+            'them. The output is then linear, not quadratic, in the number '
+            'of clones, which helps with many snapshots.',
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='If greater than 1, parse each send-stream in this many '
+            'processes. This requires the send-streams to be regular files.',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='Cache the state after each send-stream in this directory, '
+            'so that later runs sharing a prefix of the send-streams only '
+            'parse & apply the ones after it. See `subvolume_set_cache.py`.',
+    )
+    parser.add_argument(
+        '--cache-max-bytes', type=int, default=2 ** 30,
+        help='Evict the least recently used entries of `--cache-dir` once '
+            'they exceed this size.',
+    )
     parser.add_argument(
         'sendstream', type=argparse.FileType('br'), nargs='+',
         help='A file containing the output of `btrfs send`. Note that '
@@ -107,16 +130,33 @@ def main(argv):
     )
     args = parser.parse_args(argv[1:])
 
-    subvols = SubvolumeSet.new()
-    for sendstream_in in args.sendstream:
-        parsed = parse_send_stream(sendstream_in)
-        mutator = SubvolumeSetMutator.new(subvols, next(parsed))
-        for i in parsed:
-            mutator.apply_item(i)
+    def parse(sendstream_in):
+        # We only render extent lengths, so don't bother reading the data.
+        if args.jobs > 1:
+            return parse_send_stream_parallel(
+                sendstream_in.name, max_workers=args.jobs, keep_data=False,
+            )
+        return parse_send_stream(sendstream_in, keep_data=False)
+
+    if args.cache_dir:
+        subvols = SubvolumeSetCache(
+            args.cache_dir, max_bytes=args.cache_max_bytes,
+        ).apply_sendstreams(
+            # Parallel parsing yields the same items as serial parsing.
+            args.sendstream, parse, parse_key='parse_send_stream:no_data',
+        )
+    else:
+        subvols = SubvolumeSet.new()
+        for sendstream_in in args.sendstream:
+            parsed = parse(sendstream_in)
+            mutator = SubvolumeSetMutator.new(subvols, next(parsed))
+            for i in parsed:
+                mutator.apply_item(i)
 
     # Check that our send-streams completely specified the subvolumes.
     if not args.no_check_complete:
-        for ino in freeze(subvols).inodes():
+        # The clone representation is irrelevant, use the cheaper one.
+        for ino in freeze(subvols, extent_ids=True).inodes():
             ino.assert_valid_and_complete()
 
     # Render the demo subvolumes after stripping all the predictable
@@ -143,7 +183,7 @@ def main(argv):
             ))
 
     if args.show_only:
-        result = {}
+        name_to_subvol = {}
         # This hides cross-subvolume clone annotations, see `--show-only`.
         for which_subvol in args.show_only:
             subvol = subvols.get_by_rendered_id(which_subvol)
@@ -151,15 +191,19 @@ def main(argv):
                 raise RuntimeError(
                     f'Unknown subvol {which_subvol}, try without --show-only'
                 )
-            result[which_subvol] = emit_non_unique_traversal_ids(
-                freeze(subvol).render()
-            )
+            name_to_subvol[which_subvol] = \
+                freeze(subvol, extent_ids=args.extent_ids)
     else:
-        result = freeze(subvols).map(
-            lambda sv: emit_non_unique_traversal_ids(sv.render())
+        name_to_subvol = freeze(subvols, extent_ids=args.extent_ids).map(
+            lambda sv: sv
         )
     # Future: is there a `pprint`-style compact & pretty JSON output?
-    print(json.dumps(result, sort_keys=True, indent=2))
+    # Streams the JSON, since the `RenderedTree`s of big images use a lot
+    # of RAM.  The output is the same as from:
+    #   json.dumps({name: emit_non_unique_traversal_ids(sv.render()), ...},
+    #       sort_keys=True, indent=2)
+    write_subvolumes_json(sys.stdout, name_to_subvol, indent=2)
+    sys.stdout.write('\n')
 
 
 if __name__ == '__main__':
@@ -186,6 +186,16 @@ class Extent(NamedTuple):
         *,
         to_offset: int, from_extent: 'Extent', from_offset: int, length: int,
     ):
+        if not isinstance(from_extent, Extent):
+            # A workalike, such as `IntervalExtent`, can only give us its
+            # trimmed leaves.  Wrapping them preserves leaf identity.
+            return self.__put(to_offset, Extent.__new(tuple(
+                Extent.__new(leaf, offset=leaf_offset, length=leaf_length)
+                    for leaf_offset, leaf_length, leaf
+                        in from_extent.gen_trimmed_leaves(
+                            offset=from_offset, length=length,
+                        )
+            )))
         return self.__put(
             to_offset,
             Extent.__new(from_extent, offset=from_offset, length=length),
@@ -95,6 +95,20 @@ the structures of the write forks, respecting `truncate`, `write`, and
       by which the N-1 spanning tree edges are selected.  It's easy to make
       such a process deterministic, but it still adds cognitive load.
 
+      When there are many snapshots sharing data, the quadratic form is
+      too big to be usable, so `extents_to_chunks_with_extent_ids` offers
+      a linear alternative.  Much like `TraversalIDMaker` does for hard-
+      links, it deterministically numbers the leaf `Extent`s that are shared
+      by more than one file location.  Then, instead of `ChunkClone`s, each
+      part of a `Chunk` that comes from a shared extent gets one `ExtentRef`
+      to it.  In the above example, the 10-byte extent gets ID #0, and:
+
+        {'A': {'#0:0+3@0', '#0:6+3@3'},
+         'B': {'#0:1+5@0'},
+         'C': {'#0:3+5@0'}}
+
+      `extent_ids_to_chunk_clones` recovers the quadratic form from this.
+
 [1] The current code tracks clones of HOLEs, because it makes no effort to
     ignore them.  I would guess that btrfs lacks this tracking, since such
     clones would save no space.  Once this is confirmed, it would be very
@@ -114,10 +128,11 @@ the structures of the write forks, respecting `truncate`, `write`, and
 import functools
 
 from collections import defaultdict
+from itertools import count
 from typing import Dict, Iterable, NamedTuple, Sequence, Tuple
 
 from .extent import Extent
-from .inode import Clone, Chunk, ChunkClone
+from .inode import Clone, Chunk, ChunkClone, ExtentRef
 from .inode_id import InodeID
 
 
@@ -403,3 +418,151 @@ def extents_to_chunks_with_clones(
                 chunk_clones=frozenset(c.chunk_clones),
             ) for c in new_chunks
         )
+
+
+def _shared_leaf_positions(ids_and_leaves):
+    '''
+    Yields `(ino_idx, leaf_idx)` for each trimmed leaf that overlaps with
+    some other trimmed leaf of the same leaf `Extent`.  Merely having the
+    same leaf is not enough -- e.g. after a partial overwrite, the disjoint
+    parts of one leaf extent do not clone each other.
+    '''
+    leaf_id_to_intervals = defaultdict(list)
+    for ino_idx, (_, leaves) in enumerate(ids_and_leaves):
+        for leaf_idx, (offset, length, leaf) in enumerate(leaves):
+            leaf_id_to_intervals[id(leaf)].append(
+                (offset, offset + length, ino_idx, leaf_idx)
+            )
+    for intervals in leaf_id_to_intervals.values():
+        if len(intervals) < 2:
+            continue
+        intervals.sort()
+        # Sorted by start, an interval overlaps a predecessor iff it starts
+        # before the max of their ends, and a successor iff the next one
+        # starts before it ends.
+        max_end = 0
+        for i, (start, end, ino_idx, leaf_idx) in enumerate(intervals):
+            if start < max_end or (
+                i + 1 < len(intervals) and intervals[i + 1][0] < end
+            ):
+                yield ino_idx, leaf_idx
+            max_end = max(max_end, end)
+
+
+def extents_to_chunks_with_extent_ids(
+    ids_and_extents: Sequence[Tuple[InodeID, Extent]],
+) -> Iterable[Tuple[InodeID, Sequence[Chunk]]]:
+    '''
+    Like `extents_to_chunks_with_clones`, but the output size is linear in
+    the number of clones -- see the file docblock.  The `Chunk`s have empty
+    `chunk_clones`, and their `extent_refs` refer to shared extents.
+
+    The extents are numbered in the order of their first occurrence, when
+    visiting inodes sorted by their `repr` (i.e. by path), and each file
+    from its start to end.  So, the IDs do not depend on the order of the
+    operations that created the filesystem.
+    '''
+    ids_and_leaves = [
+        (ino_id, list(extent.gen_trimmed_leaves()))
+            for ino_id, extent in ids_and_extents
+    ]
+    shared_positions = set(_shared_leaf_positions(ids_and_leaves))
+
+    leaf_id_to_extent_id = {}
+    extent_ids = count()
+    for ino_idx in sorted(
+        {ino_idx for ino_idx, _ in shared_positions},
+        key=lambda ino_idx: repr(ids_and_leaves[ino_idx][0]),
+    ):
+        for leaf_idx, (_, _, leaf) in enumerate(ids_and_leaves[ino_idx][1]):
+            if (ino_idx, leaf_idx) in shared_positions and \
+                    id(leaf) not in leaf_id_to_extent_id:
+                leaf_id_to_extent_id[id(leaf)] = next(extent_ids)
+
+    for ino_idx, (ino_id, leaves) in enumerate(ids_and_leaves):
+        # Same chunk merging as in `extents_to_chunks_with_clones`.
+        new_chunks = []
+        for leaf_idx, (offset, length, leaf) in enumerate(leaves):
+            assert isinstance(leaf.content, Extent.Kind)
+            if new_chunks and new_chunks[-1][0] == leaf.content:
+                kind, prev_length, extent_refs = new_chunks[-1]
+            else:
+                prev_length = 0
+                extent_refs = []
+                new_chunks.append(None)
+            if (ino_idx, leaf_idx) in shared_positions:
+                extent_refs.append(ExtentRef(
+                    offset=prev_length,
+                    extent_id=leaf_id_to_extent_id[id(leaf)],
+                    extent_offset=offset,
+                    length=length,
+                ))
+            new_chunks[-1] = (leaf.content, prev_length + length, extent_refs)
+        yield ino_id, tuple(
+            Chunk(
+                kind=kind,
+                length=length,
+                chunk_clones=frozenset(),
+                extent_refs=frozenset(extent_refs),
+            ) for kind, length, extent_refs in new_chunks
+        )
+
+
+def extent_ids_to_chunk_clones(
+    ids_and_chunks: Sequence[Tuple[InodeID, Sequence[Chunk]]],
+) -> Iterable[Tuple[InodeID, Sequence[Chunk]]]:
+    '''
+    Converts the output of `extents_to_chunks_with_extent_ids` to that of
+    `extents_to_chunks_with_clones`.  This is quadratic in the number of
+    clones of each extent, since that is the size of the output.
+    '''
+    # Each element is (ino_idx, chunk_idx, file offset, `ExtentRef`)
+    extent_id_to_refs = defaultdict(list)
+    for ino_idx, (_, chunks) in enumerate(ids_and_chunks):
+        file_offset = 0
+        for chunk_idx, chunk in enumerate(chunks):
+            for ref in chunk.extent_refs:
+                extent_id_to_refs[ref.extent_id].append(
+                    (ino_idx, chunk_idx, file_offset + ref.offset, ref)
+                )
+            file_offset += chunk.length
+
+    pos_to_chunk_clones = defaultdict(list)  # (ino_idx, chunk_idx) -> ...
+    for refs in extent_id_to_refs.values():
+        for a_idx, a_pos_ref in enumerate(refs):
+            for b_pos_ref in refs[a_idx + 1:]:
+                # The overlapping part of the shared extent, if any.
+                a_ref, b_ref = a_pos_ref[3], b_pos_ref[3]
+                start = max(a_ref.extent_offset, b_ref.extent_offset)
+                length = min(
+                    a_ref.extent_offset + a_ref.length,
+                    b_ref.extent_offset + b_ref.length,
+                ) - start
+                if length <= 0:
+                    continue
+                # Record the clone symmetrically, in both chunks.
+                for (ino_idx, chunk_idx, _, ref), (
+                    other_ino_idx, _, other_file_offset, other_ref,
+                ) in ((a_pos_ref, b_pos_ref), (b_pos_ref, a_pos_ref)):
+                    pos_to_chunk_clones[ino_idx, chunk_idx].append(ChunkClone(
+                        offset=ref.offset + start - ref.extent_offset,
+                        clone=Clone(
+                            inode_id=ids_and_chunks[other_ino_idx][0],
+                            offset=(
+                                other_file_offset + start
+                                    - other_ref.extent_offset
+                            ),
+                            length=length,
+                        ),
+                    ))
+
+    for ino_idx, (ino_id, chunks) in enumerate(ids_and_chunks):
+        yield ino_id, tuple(
+            Chunk(
+                kind=chunk.kind,
+                length=chunk.length,
+                chunk_clones=frozenset(
+                    pos_to_chunk_clones.get((ino_idx, chunk_idx), ())
+                ),
+            ) for chunk_idx, chunk in enumerate(chunks)
+        )
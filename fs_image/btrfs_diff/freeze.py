@@ -13,48 +13,135 @@ provisions for `freeze`ing self-referential structures, because it is
 impossible to construct a recursively immutable structure that references
 itself.
 
+Since `freeze` runs on every inode of a `SubvolumeSet`, it is optimized:
+ - Nested containers are traversed with an explicit stack, so there is no
+   recursion limit, and no call overhead per item.
+ - We decide how to freeze each type once, and cache that.
+ - Immutable containers whose items are already frozen are returned as-is,
+   so e.g. an `InodeOwner` is never copied.
+
 Future: Once `deepfrozen` is landed, this sort of thing should get nicer.
 '''
+import itertools
+import operator
+
 from enum import Enum
 from types import MappingProxyType
+from typing import Any, Dict, Sequence
 
+# How `freeze` handles each type, cached in `_TYPE_TO_KIND` on first use.
+_PRIMITIVE, _CUSTOM, _NAMEDTUPLE, _SEQUENCE, _DICT, _SET = range(6)
+_TYPE_TO_KIND: Dict[type, int] = {}
+_MISSING = object()
+_EMPTY_MAPPING = MappingProxyType({})
 
-def freeze(obj, *, _memo=None, **kwargs):
+
+def _kind(t: type) -> int:
+    'Call this only on a miss in `_TYPE_TO_KIND`.'
     # Don't bother memoizing primitive types
-    if isinstance(obj, (bytes, Enum, float, int, str, type(None))):
+    if issubclass(t, (bytes, Enum, float, int, str, type(None))):
+        kind = _PRIMITIVE
+    elif hasattr(t, 'freeze'):
+        kind = _CUSTOM
+    # This is a lame-o way of identifying `NamedTuple`s. Using
+    # `deepfrozen` would avoid this kludge.
+    elif (
+        issubclass(t, tuple) and hasattr(t, '_replace') and
+        hasattr(t, '_fields') and hasattr(t, '_make')
+    ):
+        kind = _NAMEDTUPLE
+    elif issubclass(t, (list, tuple)):
+        kind = _SEQUENCE
+    elif issubclass(t, dict):
+        kind = _DICT
+    elif issubclass(t, (set, frozenset)):
+        kind = _SET
+    else:
+        raise NotImplementedError(t)
+    _TYPE_TO_KIND[t] = kind
+    return kind
+
+
+def _items(obj, kind: int) -> Sequence[Any]:
+    if kind == _DICT:  # Keys & values alternate
+        return list(itertools.chain.from_iterable(obj.items()))
+    elif kind == _SET:
+        return list(obj)
+    return obj  # `_NAMEDTUPLE` or `_SEQUENCE`
+
+
+def _make_frozen(obj, kind: int, items, frozen_items) -> Any:
+    if kind == _DICT:
+        return MappingProxyType(
+            dict(zip(frozen_items[::2], frozen_items[1::2]))
+        )
+    # Immutable containers whose items froze to themselves are already
+    # frozen, so we return them as-is, instead of copying them.
+    if kind == _NAMEDTUPLE:
+        return obj if all(map(operator.is_, frozen_items, items)) \
+            else obj._make(frozen_items)
+    elif kind == _SEQUENCE:
+        return obj if type(obj) is tuple \
+            and all(map(operator.is_, frozen_items, items)) \
+            else tuple(frozen_items)
+    return obj if type(obj) is frozenset \
+        and all(map(operator.is_, frozen_items, items)) \
+        else frozenset(frozen_items)
+
+
+def freeze(obj, *, _memo=None, **kwargs):
+    kind = _TYPE_TO_KIND.get(type(obj))
+    if kind is None:
+        kind = _kind(type(obj))
+    if kind == _PRIMITIVE:
         return obj
 
     if _memo is None:
         _memo = {}
 
-    if id(obj) in _memo:  # Already frozen?
-        return _memo[id(obj)]
+    frozen = _memo.get(id(obj), _MISSING)
+    if frozen is not _MISSING:  # Already frozen?
+        return frozen
 
-    if hasattr(obj, 'freeze'):
-        frozen = obj.freeze(_memo=_memo, **kwargs)
-    else:
-        # At the moment, I don't have a need for passing extra data into
-        # items that live inside containers.  If we're relaxing this, just
-        # be sure to add `**kwargs` to each `freeze()` call below.
-        assert kwargs == {}, kwargs
-        # This is a lame-o way of identifying `NamedTuple`s. Using
-        # `deepfrozen` would avoid this kludge.
-        if (
-            isinstance(obj, tuple) and hasattr(obj, '_replace') and
-            hasattr(obj, '_fields') and hasattr(obj, '_make')
-        ):
-            frozen = obj._make(freeze(i, _memo=_memo) for i in obj)
-        elif isinstance(obj, (list, tuple)):
-            frozen = tuple(freeze(i, _memo=_memo) for i in obj)
-        elif isinstance(obj, dict):
-            frozen = MappingProxyType({
-                freeze(k, _memo=_memo): freeze(v, _memo=_memo)
-                    for k, v in obj.items()
-            })
-        elif isinstance(obj, (set, frozenset)):
-            frozen = frozenset(freeze(i, _memo=_memo) for i in obj)
-        else:
-            raise NotImplementedError(type(obj))
-
-    _memo[id(obj)] = frozen
-    return frozen
+    if kind == _CUSTOM:
+        frozen = _memo[id(obj)] = obj.freeze(_memo=_memo, **kwargs)
+        return frozen
+
+    if kind == _DICT and not obj:  # Most inodes have no xattrs
+        frozen = _memo[id(obj)] = _EMPTY_MAPPING
+        return frozen
+
+    # At the moment, I don't have a need for passing extra data into
+    # items that live inside containers.  If we're relaxing this, just
+    # be sure to pass `**kwargs` to the `freeze()` calls below.
+    assert kwargs == {}, kwargs
+
+    # Iterate over nested containers with an explicit stack, instead of
+    # recursing.  Each frame is `(obj, kind, items, frozen items)`.
+    stack = [(obj, kind, _items(obj, kind), [])]
+    while True:
+        obj, kind, items, frozen_items = stack[-1]
+        for i in range(len(frozen_items), len(items)):
+            item = items[i]
+            item_kind = _TYPE_TO_KIND.get(type(item))
+            if item_kind is None:
+                item_kind = _kind(type(item))
+            if item_kind == _PRIMITIVE:
+                frozen_items.append(item)
+                continue
+            frozen = _memo.get(id(item), _MISSING)
+            if frozen is _MISSING:
+                if item_kind != _CUSTOM:  # Descend into the container
+                    stack.append(
+                        (item, item_kind, _items(item, item_kind), []),
+                    )
+                    break
+                frozen = _memo[id(item)] = item.freeze(_memo=_memo)
+            frozen_items.append(frozen)
+        else:  # All the items are frozen
+            stack.pop()
+            frozen = _memo[id(obj)] = \
+                _make_frozen(obj, kind, items, frozen_items)
+            if not stack:
+                return frozen
+            stack[-1][3].append(frozen)
@@ -11,6 +11,7 @@ IMPORTANT: Keep these objects correctly `deepcopy`able. That is the case at
 the time of writing because:
  - `Extent` is recursively immutable and customizes copy operations to
    return the original object -- this lets us correctly track clones.
+   `IntervalExtent` is mutable, but its copies share the leaf `Extent`s.
  - All other attributes store plain-old-data, or POD immutable classes that
    do not care about object identity.
  - We omit InodeID -- i.e. these objects are **just** the inode's data.
@@ -115,14 +116,15 @@ class IncompleteDir(IncompleteInode):
 
 
 class IncompleteFile(IncompleteInode):
+    # Either `Extent`, or a workalike such as `IntervalExtent`.
     extent: Extent
 
     FILE_TYPE = stat.S_IFREG
     INITIAL_ITEM = SendStreamItems.mkfile
 
-    def __init__(self, *, item: SendStreamItem):
+    def __init__(self, *, item: SendStreamItem, extent_class=Extent):
         super().__init__(item=item)
-        self.extent = Extent.empty()
+        self.extent = extent_class.empty()
 
     def _freeze_kwargs(self, *, _memo, chunks: Sequence[Chunk]):
         assert (chunks is None) ^ (self.extent is not None)
@@ -165,9 +165,9 @@ class Inode(NamedTuple):
             yield ''.join(
                 f'{EXTENT_KIND_TO_ABBREV[c.kind]}{c.length}' + (
                     ('(' + '/'.join(sorted(
-                        repr(cc) for cc in c.chunk_clones
+                        repr(cc) for cc in (*c.chunk_clones, *c.extent_refs)
                     )) + ')')
-                        if c.chunk_clones else ''
+                        if c.chunk_clones or c.extent_refs else ''
                 ) for c in self.chunks
             )
         if self.dev is not None:
@@ -203,13 +203,37 @@ class ChunkClone(NamedTuple):
         return f'{repr(self.clone)}@{self.offset}'
 
 
+class ExtentRef(NamedTuple):
+    '''
+    The linear-size alternative to `ChunkClone`s -- see the docblock of
+    `extents_to_chunks.py`.  Says that a part of a `Chunk` is a part of
+    a shared extent, which was numbered `extent_id` when it was frozen.
+    Two `ExtentRef`s with the same `extent_id` are clones of one another
+    wherever their `extent_offset` ranges overlap.
+    '''
+    offset: int  # Offset into the `Chunk`
+    extent_id: int
+    extent_offset: int  # Offset into the shared extent
+    length: int
+
+    def __repr__(self):
+        return (
+            f'#{self.extent_id}:{self.extent_offset}+{self.length}'
+            f'@{self.offset}'
+        )
+
+
 class Chunk(NamedTuple):
     kind: Extent.Kind
     length: int
     chunk_clones: Set[ChunkClone]
+    # Only populated instead of `chunk_clones` when freezing with
+    # `extent_ids=True`.
+    extent_refs: Set[ExtentRef] = frozenset()
 
     def __repr__(self):
         return f'({self.kind.name}/{self.length}' + (
-            (': ' + ', '.join(repr(c) for c in self.chunk_clones))
-                if self.chunk_clones else ''
+            (': ' + ', '.join(
+                repr(c) for c in (*self.chunk_clones, *self.extent_refs)
+            )) if self.chunk_clones or self.extent_refs else ''
         ) + ')'
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+'''
+The `id_to_inode` mapping of an un-frozen `Subvolume` comes in two
+flavors, both keyed by `InodeID`, but storing the inodes by `InodeID.id`:
+
+ - `PersistentInodeStore`, the default, keeps `IncompleteInode` objects in
+   a `PersistentIntMap`, so that `Subvolume.snapshot` is O(1).
+
+ - `ColumnarInodeStore` is for subvolumes with millions of inodes, where
+   the per-object overhead of `IncompleteInode`s (several hundred bytes,
+   mostly for the instance `__dict__` and the `InodeOwner` and
+   `InodeUtimes` tuples) dominates.  It stores the common inode fields in
+   `array` columns indexed by `InodeID.id`, and the rest -- xattrs, and
+   the file extent, device number, or symlink destination -- in side
+   tables.  Lookups return proxy views, which are `IncompleteInode`
+   subclasses that read & write their fields in the store, so all of the
+   `IncompleteInode` API keeps working.  In exchange, `snapshot` copies
+   the whole store, though the copy of the columns is cheap.
+
+Both expect to own their inodes, so only mutate inodes via `Subvolume`.
+'''
+import copy
+import stat
+
+from array import array
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from .incomplete_inode import (
+    IncompleteDevice, IncompleteDir, IncompleteFifo, IncompleteFile,
+    IncompleteInode, IncompleteSocket, IncompleteSymlink,
+)
+from .inode import InodeOwner, InodeUtimes
+from .inode_id import InodeID
+from .persistent_map import PersistentIntMap
+
+
+class _InodeStore(MutableMapping):
+    'Translates the `InodeID` keys to & from the stored integer IDs.'
+
+    def __init__(self, inner_id_map):
+        self._inner_id_map = inner_id_map
+
+    def _int_id(self, ino_id: InodeID) -> int:
+        if not isinstance(ino_id, InodeID) or \
+                ino_id.inner_id_map is not self._inner_id_map:
+            raise KeyError(ino_id)
+        return ino_id.id
+
+    def _ino_id(self, int_id: int) -> InodeID:
+        return InodeID(id=int_id, inner_id_map=self._inner_id_map)
+
+    def items(self) -> Iterator[Tuple[InodeID, IncompleteInode]]:
+        return (
+            (self._ino_id(int_id), ino) for int_id, ino in self._int_items()
+        )
+
+    def values(self) -> Iterator[IncompleteInode]:
+        return (ino for _, ino in self._int_items())
+
+    def __iter__(self) -> Iterator[InodeID]:
+        return (self._ino_id(int_id) for int_id, _ in self._int_items())
+
+    # `Mapping` implements these via `__getitem__`, which raises on misses.
+
+    def get(self, ino_id: InodeID, default: Any=None) -> Any:
+        try:
+            int_id = self._int_id(ino_id)
+        except KeyError:  # Not one of our `InodeID`s
+            return default
+        ino = self._int_get(int_id)
+        return default if ino is None else ino
+
+    def __contains__(self, ino_id: InodeID) -> bool:
+        return self.get(ino_id) is not None  # Inodes are never `None`
+
+
+class PersistentInodeStore(_InodeStore):
+    '''
+    Shares its inodes with its snapshots, and copies them on first write,
+    so use `get_mut` to get an inode you are about to modify.
+    '''
+
+    def __init__(
+        self, inner_id_map, int_map: Optional[PersistentIntMap]=None,
+    ):
+        super().__init__(inner_id_map)
+        self._int_map = PersistentIntMap() if int_map is None else int_map
+
+    def snapshot(self, inner_id_map) -> 'PersistentInodeStore':
+        return type(self)(inner_id_map, self._int_map.snapshot())
+
+    def get_mut(self, ino_id: InodeID, copy_fn: Callable[[Any], Any]):
+        return self._int_map.get_mut(self._int_id(ino_id), copy_fn)
+
+    def diff_int_ids(self, other: 'PersistentInodeStore') -> Iterator[int]:
+        'The `InodeID.id`s whose inodes may differ, see `diff_keys`.'
+        return self._int_map.diff_keys(other._int_map)
+
+    def _int_items(self) -> Iterator[Tuple[int, IncompleteInode]]:
+        return self._int_map.items()
+
+    def _int_get(self, int_id: int) -> Optional[IncompleteInode]:
+        return self._int_map.get(int_id)
+
+    def __getitem__(self, ino_id: InodeID) -> IncompleteInode:
+        return self._int_map[self._int_id(ino_id)]
+
+    def __setitem__(self, ino_id: InodeID, ino: IncompleteInode) -> None:
+        self._int_map[self._int_id(ino_id)] = ino
+
+    def __delitem__(self, ino_id: InodeID) -> None:
+        del self._int_map[self._int_id(ino_id)]
+
+    def __len__(self) -> int:
+        return len(self._int_map)
+
+
+class _NewXattrs(dict):
+    'The empty xattrs of an inode, added to the side table on first write.'
+
+    def __init__(self, int_id_to_xattrs: Dict[int, Dict], int_id: int):
+        super().__init__()
+        self._int_id_to_xattrs = int_id_to_xattrs
+        self._int_id = int_id
+
+    def __setitem__(self, name: bytes, value: bytes) -> None:
+        super().__setitem__(name, value)
+        self._int_id_to_xattrs.setdefault(self._int_id, {})[name] = value
+
+
+class _ColumnarView:
+    '''
+    Mixin for the `IncompleteInode` views of `ColumnarInodeStore`.  Its
+    properties take precedence over the instance attributes that the
+    `IncompleteInode` methods would otherwise use.
+    '''
+    def __init__(self, store: 'ColumnarInodeStore', int_id: int):
+        self._store = store
+        self._int_id = int_id
+
+    @property
+    def file_type(self) -> int:
+        return self._store._file_type[self._int_id]
+
+    @property
+    def mode(self) -> Optional[int]:
+        mode = self._store._mode[self._int_id]
+        return None if mode < 0 else mode
+
+    @mode.setter
+    def mode(self, mode: Optional[int]) -> None:
+        self._store._mode[self._int_id] = -1 if mode is None else mode
+
+    @property
+    def owner(self) -> Optional[InodeOwner]:
+        uid = self._store._uid[self._int_id]
+        return None if uid < 0 else InodeOwner(
+            uid=uid, gid=self._store._gid[self._int_id],
+        )
+
+    @owner.setter
+    def owner(self, owner: Optional[InodeOwner]) -> None:
+        self._store._uid[self._int_id] = -1 if owner is None else owner.uid
+        self._store._gid[self._int_id] = -1 if owner is None else owner.gid
+
+    @property
+    def utimes(self) -> Optional[InodeUtimes]:
+        start = self._int_id * _NUM_TIMES
+        t = self._store._times[start:start + _NUM_TIMES]
+        # `nsec` is never negative, so -1 marks a missing `utimes`.
+        return None if t[1] < 0 else InodeUtimes(
+            ctime=(t[0], t[1]), mtime=(t[2], t[3]), atime=(t[4], t[5]),
+        )
+
+    @utimes.setter
+    def utimes(self, utimes: Optional[InodeUtimes]) -> None:
+        start = self._int_id * _NUM_TIMES
+        self._store._times[start:start + _NUM_TIMES] = \
+            _NO_TIMES if utimes is None else array('q', (
+                t for sec_nsec in utimes for t in sec_nsec
+            ))
+
+    @property
+    def xattrs(self) -> Dict[bytes, bytes]:
+        xattrs = self._store._xattrs.get(self._int_id)
+        # Most inodes have no xattrs, so we only store them once written.
+        return _NewXattrs(self._store._xattrs, self._int_id) \
+            if xattrs is None else xattrs
+
+    @xattrs.setter
+    def xattrs(self, xattrs: Dict[bytes, bytes]) -> None:
+        if xattrs:
+            self._store._xattrs[self._int_id] = xattrs
+        else:
+            self._store._xattrs.pop(self._int_id, None)
+
+    # The field specific to the inode type, if any, is in `_payload`.
+
+    def _get_payload(self) -> Any:
+        return self._store._payload[self._int_id]
+
+    def _set_payload(self, value: Any) -> None:
+        self._store._payload[self._int_id] = value
+
+
+class _FileView(_ColumnarView, IncompleteFile):
+    extent = property(_ColumnarView._get_payload, _ColumnarView._set_payload)
+
+
+class _DeviceView(_ColumnarView, IncompleteDevice):
+    dev = property(_ColumnarView._get_payload, _ColumnarView._set_payload)
+
+
+class _SymlinkView(_ColumnarView, IncompleteSymlink):
+    dest = property(_ColumnarView._get_payload, _ColumnarView._set_payload)
+
+
+class _DirView(_ColumnarView, IncompleteDir):
+    pass
+
+
+class _FifoView(_ColumnarView, IncompleteFifo):
+    pass
+
+
+class _SocketView(_ColumnarView, IncompleteSocket):
+    pass
+
+
+_FILE_TYPE_TO_VIEW = {
+    stat.S_IFBLK: _DeviceView,
+    stat.S_IFCHR: _DeviceView,
+    stat.S_IFDIR: _DirView,
+    stat.S_IFIFO: _FifoView,
+    stat.S_IFLNK: _SymlinkView,
+    stat.S_IFREG: _FileView,
+    stat.S_IFSOCK: _SocketView,
+}
+_VIEW_TO_PAYLOAD_FIELD = {
+    _DeviceView: 'dev', _FileView: 'extent', _SymlinkView: 'dest',
+}
+_NUM_TIMES = 6  # (sec, nsec) for each of ctime, mtime, atime
+_NO_TIMES = array('q', [0, -1] * (_NUM_TIMES // 2))
+_NO_INODE = 0  # The `_file_type` of absent `InodeID`s
+
+
+class ColumnarInodeStore(_InodeStore):
+    '''
+    Stores about 70 bytes of columns per inode, plus the xattrs, if any,
+    and the payload of files, devices & symlinks.  Returns a new view per
+    lookup, so compare inodes by `InodeID`, not by identity.  Views are
+    full-sized objects -- they inherit the `__dict__` of `IncompleteInode`
+    -- so the savings only hold if callers do not keep many of them.
+    '''
+
+    def __init__(self, inner_id_map):
+        super().__init__(inner_id_map)
+        self._len = 0
+        self._file_type = array('H')  # `_NO_INODE` if the inode is absent
+        self._mode = array('i')  # -1 if `None`
+        self._uid = array('q')  # -1 if `owner` is `None`
+        self._gid = array('q')
+        self._times = array('q')  # `_NUM_TIMES` per inode
+        self._xattrs: Dict[int, Dict[bytes, bytes]] = {}  # Only if not empty
+        self._payload: Dict[int, Any] = {}
+
+    def snapshot(self, inner_id_map) -> 'ColumnarInodeStore':
+        other = copy.copy(self)  # Shallow-copies the `__dict__`
+        other._inner_id_map = inner_id_map
+        for name in ('_file_type', '_mode', '_uid', '_gid', '_times'):
+            setattr(other, name, copy.copy(getattr(self, name)))
+        # `deepcopy` shares immutable `Extent`s, and copies the rest.
+        other._xattrs = copy.deepcopy(self._xattrs)
+        other._payload = copy.deepcopy(self._payload)
+        return other
+
+    def get_mut(self, ino_id: InodeID, copy_fn: Callable[[Any], Any]):
+        return self[ino_id]  # Our inodes are never shared
+
+    def _view(self, int_id: int) -> Optional[_ColumnarView]:
+        file_type = self._file_type[int_id] \
+            if 0 <= int_id < len(self._file_type) else _NO_INODE
+        return None if file_type == _NO_INODE \
+            else _FILE_TYPE_TO_VIEW[file_type](self, int_id)
+
+    _int_get = _view
+
+    def _int_items(self) -> Iterator[Tuple[int, _ColumnarView]]:
+        for int_id, file_type in enumerate(self._file_type):
+            if file_type != _NO_INODE:
+                yield int_id, _FILE_TYPE_TO_VIEW[file_type](self, int_id)
+
+    def __getitem__(self, ino_id: InodeID) -> _ColumnarView:
+        view = self._view(self._int_id(ino_id))
+        if view is None:
+            raise KeyError(ino_id)
+        return view
+
+    def __setitem__(self, ino_id: InodeID, ino: IncompleteInode) -> None:
+        int_id = self._int_id(ino_id)
+        # Read all the fields before touching the columns, in case `ino`
+        # is one of our views.
+        view_class = _FILE_TYPE_TO_VIEW[ino.file_type]
+        fields = (ino.mode, ino.owner, ino.utimes, dict(ino.xattrs))
+        payload_field = _VIEW_TO_PAYLOAD_FIELD.get(view_class)
+        if payload_field is not None:
+            payload = getattr(ino, payload_field)
+
+        num_new = int_id + 1 - len(self._file_type)
+        if num_new > 0:
+            self._file_type.extend(array('H', [_NO_INODE]) * num_new)
+            self._mode.extend(array('i', [-1]) * num_new)
+            self._uid.extend(array('q', [-1]) * num_new)
+            self._gid.extend(array('q', [-1]) * num_new)
+            self._times.extend(_NO_TIMES * num_new)
+        if self._file_type[int_id] == _NO_INODE:
+            self._len += 1
+        else:
+            self._payload.pop(int_id, None)
+        self._file_type[int_id] = ino.file_type
+
+        view = view_class(self, int_id)
+        view.mode, view.owner, view.utimes, view.xattrs = fields
+        if payload_field is not None:
+            view._set_payload(payload)
+
+    def __delitem__(self, ino_id: InodeID) -> None:
+        int_id = self._int_id(ino_id)
+        if self._view(int_id) is None:
+            raise KeyError(ino_id)
+        self._file_type[int_id] = _NO_INODE
+        self._xattrs.pop(int_id, None)
+        self._payload.pop(int_id, None)
+        self._len -= 1
+
+    def __len__(self) -> int:
+        return self._len
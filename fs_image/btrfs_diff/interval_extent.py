@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+'''
+`IntervalExtent` is an alternative engine for the file data model of
+`Extent`, with the same `btrfs send` workalike API: `empty()`,
+`truncate()`, `write()`, `clone()`, `.length`, and `gen_trimmed_leaves()`.
+
+`Extent` keeps the full history of the file's mutations as a tree.  That
+tree gets deeper with every mutation, so a file written in 100k small
+chunks makes `gen_trimmed_leaves` slow, and eventually overflows the
+Python stack.  `IntervalExtent` instead eagerly stores just the flattened
+form: a sorted sequence of pieces, each being a trimmed leaf `Extent`
+(i.e. one with `Extent.Kind` content).  Per piece, we keep:
+  - in `array`s: the file offset where it starts, and its offset into
+    its leaf,
+  - in a `list`: a reference to the leaf.
+The length of a piece is the distance to the start of the next one.
+
+`write` and `clone` find the affected pieces by bisection, and splice in
+the new ones.  Flattening is a linear scan.  The splice is a `memmove`
+inside the `array`s, which is linear in principle, but its constant is so
+small that it is irrelevant in comparison to the interpreter overhead.
+
+## The leaf identity invariant
+
+Exactly as with `Extent`, the leaves are never replaced by new objects --
+trimming a leaf just changes the piece's offset and length.  So, clone
+detection via leaf object identity in `extents_to_chunks.py` works the
+same way for both engines.  Moreover, the leaves ARE `Extent` objects, so
+either engine may be the `from_extent` of the other's `clone` -- e.g. a
+subvolume may switch engines, and still clone from its parent snapshot.
+
+## Mutability alert
+
+Unlike `Extent`, this object is mutable.  To be a drop-in replacement for
+code written in the `extent = extent.write(...)` style, mutators update
+`self` in-place, and return it.  Copying an `IntervalExtent` copies its
+pieces, but shares the leaves, just like `deepcopy` of an `Extent` does.
+'''
+import bisect
+
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+from .extent import Extent
+
+
+def _new_leaf(kind: Extent.Kind, length: int) -> Extent:
+    # Equivalent to `Extent.__new(kind, length=length)`
+    return Extent(content=kind, offset=0, length=length)
+
+
+class IntervalExtent:
+    '''
+    See the module docblock.  Start each file with `IntervalExtent.empty()`.
+    '''
+    __slots__ = ('_starts', '_leaf_offsets', '_leaves', '_length')
+
+    _starts: array  # Sorted file offsets of the pieces
+    _leaf_offsets: array  # Where each piece starts within its leaf
+    _leaves: List[Extent]  # Each has `Extent.Kind` content
+    _length: int
+
+    def __init__(self):
+        self._starts = array('Q')
+        self._leaf_offsets = array('Q')
+        self._leaves = []
+        self._length = 0
+
+    @staticmethod
+    def empty() -> 'IntervalExtent':
+        return IntervalExtent()
+
+    @property
+    def length(self) -> int:
+        return self._length
+
+    def _append(self, leaf_offset: int, length: int, leaf: Extent) -> None:
+        self._starts.append(self._length)
+        self._leaf_offsets.append(leaf_offset)
+        self._leaves.append(leaf)
+        self._length += length
+
+    def _put(
+        self, offset: int, pieces: List[Tuple[int, int, Extent]],
+    ) -> 'IntervalExtent':
+        'Overwrites with `pieces` a portion of `self` starting at `offset`.'
+        starts = self._starts
+        leaf_offsets = self._leaf_offsets
+        leaves = self._leaves
+        new_starts = array('Q')
+        new_leaf_offsets = array('Q')
+        new_leaves = []
+        end = offset
+        for leaf_offset, length, leaf in pieces:
+            new_starts.append(end)
+            new_leaf_offsets.append(leaf_offset)
+            new_leaves.append(leaf)
+            end += length
+        # Same as in `Extent`: it is unclear whether this should make a hole.
+        assert end > offset, 'Future: not sure how to hangle length = 0'
+        if offset > self._length:
+            self._append(0, offset - self._length, _new_leaf(
+                Extent.Kind.HOLE, offset - self._length,
+            ))
+        # We splice the new pieces into `[begin_idx, end_idx)`.  The piece
+        # before `begin_idx` gets trimmed implicitly, since its end is the
+        # start of its successor.  A piece that is partially overwritten
+        # at its front gets re-added with a trimmed front.
+        begin_idx = bisect.bisect_left(starts, offset)
+        end_idx = bisect.bisect_left(starts, end)
+        if end < (
+            starts[end_idx] if end_idx < len(starts) else self._length
+        ):
+            new_starts.append(end)
+            new_leaf_offsets.append(
+                leaf_offsets[end_idx - 1] + end - starts[end_idx - 1]
+            )
+            new_leaves.append(leaves[end_idx - 1])
+        # Every splice is a single `memmove`.
+        starts[begin_idx:end_idx] = new_starts
+        leaf_offsets[begin_idx:end_idx] = new_leaf_offsets
+        leaves[begin_idx:end_idx] = new_leaves
+        self._length = max(self._length, end)
+        return self
+
+    def truncate(self, *, length: int) -> 'IntervalExtent':
+        if length > self._length:
+            self._append(0, length - self._length, _new_leaf(
+                Extent.Kind.HOLE, length - self._length,
+            ))
+        elif length < self._length:
+            # Like in `_put`, the last remaining piece is trimmed implicitly.
+            idx = bisect.bisect_left(self._starts, length)
+            del self._starts[idx:]
+            del self._leaf_offsets[idx:]
+            del self._leaves[idx:]
+            self._length = length
+        return self
+
+    def write(self, *, offset: int, length: int) -> 'IntervalExtent':
+        return self._put(
+            offset, [(0, length, _new_leaf(Extent.Kind.DATA, length))],
+        )
+
+    def clone(
+        self,
+        *,
+        to_offset: int, from_extent, from_offset: int, length: int,
+    ) -> 'IntervalExtent':
+        # Materialize the pieces before `_put`, since `from_extent` may be
+        # `self`.
+        return self._put(to_offset, list(from_extent.gen_trimmed_leaves(
+            offset=from_offset, length=length,
+        )))
+
+    def gen_trimmed_leaves(
+        self, *, offset: int=0, length: Optional[int]=None,
+    ) -> Iterator[Tuple[int, int, Extent]]:
+        'Same as `Extent.gen_trimmed_leaves`.'
+        max_length = self._length - offset
+        if length is None:
+            length = max_length
+        assert length <= max_length, f'len {length}, offset {offset}, {self}'
+        assert offset >= 0 and length >= 0, f'offset {offset}, length {length}'
+        if length == 0:
+            return
+        end = offset + length
+        starts = self._starts
+        num_pieces = len(starts)
+        idx = bisect.bisect_right(starts, offset) - 1
+        while idx < num_pieces:
+            start = starts[idx]
+            if start >= end:
+                break
+            piece_end = starts[idx + 1] if idx + 1 < num_pieces \
+                else self._length
+            trim = max(0, offset - start)
+            yield (
+                self._leaf_offsets[idx] + trim,
+                min(piece_end, end) - start - trim,
+                self._leaves[idx],
+            )
+            idx += 1
+
+    # The `repr` format matches `Extent`, e.g. 'h3d4'.  Those methods only
+    # depend on `gen_trimmed_leaves`.
+    _gen_leaf_reprs = Extent._gen_leaf_reprs
+    __repr__ = Extent.__repr__
+
+    def __copy__(self):
+        'Copies the pieces, but shares the leaves -- see the docblock.'
+        new = IntervalExtent()
+        new._starts = array('Q', self._starts)
+        new._leaf_offsets = array('Q', self._leaf_offsets)
+        new._leaves = list(self._leaves)
+        new._length = self._length
+        return new
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()  # The leaves are immutable, see the docblock.
@@ -53,11 +53,12 @@ Limitations of `btrfs receive --dump` (filed as T25376790):
    unravel the source of a clone when more than one source is in use.
 '''
 import datetime
+import functools
 import os
 import re
 
 from collections import OrderedDict
-from typing import Any, BinaryIO, Dict, Iterable, Optional, Pattern
+from typing import Any, BinaryIO, Dict, Iterable, Optional, Pattern, Tuple
 
 from .send_stream import SendStreamItem, SendStreamItems
 
@@ -102,6 +103,8 @@ def unquote_btrfs_progs_path(s):
     custom un-quoting function.  Future: fix `btrfs-progs` so that other
     fields (paths & data) are quoted too.
     '''
+    if b'\\' not in s:  # Most paths need no unquoting, skip the regex.
+        return s
     return _ESCAPED_REGEX.sub(lambda m: _ESCAPED_TO_UNESCAPED[m.group(0)], s)
 
 
@@ -110,35 +113,63 @@ class RegexItemParser:
 
     regex: Pattern = re.compile(b'')
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Handle `conv_FIELD_NAME` class methods for converting fields.
+        # These take a single positional argument, and handle most cases.
+        #
+        # We currently only use `context_conv_FIELD_NAME` when a detail
+        # field needs to know the subvolume name, see e.g. `clone`.
+        #
+        # These are looked up once per class, not once per parsed line.
+        cls._field_convs = tuple(
+            (k, getattr(cls, f'conv_{k}', None),
+                getattr(cls, f'context_conv_{k}', None))
+                for k in cls.regex.groupindex
+                    if hasattr(cls, f'conv_{k}') or
+                        hasattr(cls, f'context_conv_{k}')
+        )
+
     @classmethod
     def parse_details(
         cls, subvol_name: bytes, details: bytes,
     ) -> Optional[Dict[str, Any]]:
         m = cls.regex.fullmatch(details)
-        return {
-            # Handle `conv_FIELD_NAME` class methods for converting fields.
-            # These take a single positional argument, and handle most
-            # cases.
-            #
-            # We currently only use `context_conv_FIELD_NAME` when a detail
-            # field needs to know the subvolume name, see e.g. `clone`.
-            k: getattr(
-                cls, f'context_conv_{k}', lambda value, subvol_name: value
-            )(
-                getattr(cls, f'conv_{k}', lambda x: x)(v),
-                subvol_name=subvol_name,
-            )
-                for k, v in m.groupdict().items()
-        } if m else None
+        if not m:
+            return None
+        # Building the dict in C beats zipping up the positional groups.
+        fields = m.groupdict()
+        for k, conv, context_conv in cls._field_convs:
+            v = fields[k]
+            if conv is not None:
+                v = conv(v)
+            if context_conv is not None:
+                v = context_conv(v, subvol_name=subvol_name)
+            fields[k] = v
+        return fields
 
 
 def _normalize_subvolume_path(s: bytes, *, subvol_name: bytes) -> bytes:
     # `normpath` is needed since `btrfs receive --dump` is inconsistent
-    # about trailing slashes on directory paths.
-    stripped = os.path.relpath(s, subvol_name)
-    if len(stripped) >= len(s) or stripped.startswith(b'..'):
+    # about trailing slashes on directory paths.  NB: Unlike `relpath`,
+    # this does not make a `getcwd` syscall for every path.
+    path = os.path.normpath(s)
+    if path == subvol_name:
+        return b'.'
+    if not path.startswith(subvol_name + b'/'):
         raise RuntimeError(f'{s} did not start with {subvol_name}')
-    return stripped
+    return path[len(subvol_name) + 1:]
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def _parse_dump_time(t: bytes) -> Tuple[int, int]:
+    '''
+    `strptime` is slow, but timestamps repeat massively in image builds,
+    since many files are written within the same second.
+    '''
+    return (int(datetime.datetime.strptime(
+        t.decode(), '%Y-%m-%dT%H:%M:%S%z'
+    ).timestamp()), 0)  # --dump discards nanoseconds
 
 
 def _from_octal(s: bytes) -> int:
@@ -306,12 +337,7 @@ class SendStreamItemParsers:
             br'ctime=(?P<ctime>[^ ]+)'
         )
 
-        @classmethod
-        def conv_atime(cls, t: bytes) -> float:
-            return (int(datetime.datetime.strptime(
-                t.decode(), '%Y-%m-%dT%H:%M:%S%z'
-            ).timestamp()), 0)  # --dump discards nanoseconds
-
+        conv_atime = staticmethod(_parse_dump_time)
         conv_mtime = conv_atime
         conv_ctime = conv_atime
 
@@ -334,28 +360,31 @@ NAME_TO_ITEM_TYPE = {
             if k[0] != '_' and k != 'write'
 }
 assert set(NAME_TO_PARSER_TYPE.keys()) == set(NAME_TO_ITEM_TYPE.keys())
+# Lets `parse_btrfs_dump` dispatch on the item name with one lookup.
+_NAME_TO_ITEM_AND_PARSER_TYPE = {
+    k: (v, NAME_TO_PARSER_TYPE[k]) for k, v in NAME_TO_ITEM_TYPE.items()
+}
+# This parser maps `write` to `update_extent` regardless of whether the
+# send-stream used `--no-data` or not.  The reason is that `btrfs receive
+# --dump` never displays the `data` field (because it can be huge, and not
+# very illuminating to the user).
+_NAME_TO_ITEM_AND_PARSER_TYPE[b'write'] = \
+    _NAME_TO_ITEM_AND_PARSER_TYPE[b'update_extent']
+_LINE_REGEX = re.compile(br'([^ ]+) +((\\ |[^ ])+) *(.*)\n')
 
 
 def parse_btrfs_dump(binary_infile: BinaryIO) -> Iterable[SendStreamItem]:
-    reg = re.compile(br'([^ ]+) +((\\ |[^ ])+) *(.*)\n')
     subvol_name = None
     for l in binary_infile:
-        m = reg.fullmatch(l)
+        m = _LINE_REGEX.fullmatch(l)
         if not m:
             raise RuntimeError(f'line has unexpected format: {repr(l)}')
         item_name, path, _, details = m.groups()
 
-        # This parser maps `write` to `update_extent` regardless of whether
-        # the send-stream used `--no-data` or not.  The reason is that
-        # `btrfs receive --dump` never displays the `data` field (because it
-        # can be huge, and not very illuminating to the user).
-        if item_name == b'write':
-            item_name = b'update_extent'
-
-        item_class = NAME_TO_ITEM_TYPE.get(item_name)
-        if not item_class:
+        item_and_parser = _NAME_TO_ITEM_AND_PARSER_TYPE.get(item_name)
+        if not item_and_parser:
             raise RuntimeError(f'unknown item type {item_name} in {repr(l)}')
-        item_parser = NAME_TO_PARSER_TYPE[item_name]
+        item_class, item_parser = item_and_parser
 
         # We MUST unquote here, or paths in field 1 will not be comparable
         # with as-of-now unquoted paths in the other fields.  For example,
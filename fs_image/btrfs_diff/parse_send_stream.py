@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 'Parses the btrfs send-stream binary format. Only version 1 is supported.'
+import collections
+import concurrent.futures
 import enum
+import mmap
 import os
+import stat
 import struct
 import uuid
 
 from io import BytesIO
-from typing import NamedTuple, Iterable
+from typing import Container, Iterable, List, NamedTuple, Optional, Union
 
-from .send_stream import SendStreamItem, SendStreamItems
+from .crc32c import crc32c
+from .send_stream import ItemBatch, SendStreamItem, SendStreamItems
 
 BTRFS_SEND_STREAM_MAGIC = b'btrfs-stream\0'
 
@@ -123,17 +128,70 @@ class AttributeHeader(NamedTuple):
         return AttributeHeader(kind=AttributeKind(kind), length=length)
 
 
+# Precompiled to avoid re-parsing the format string for every command.
+_COMMAND_HEADER = struct.Struct('<IHI')
+_ATTRIBUTE_HEADER = struct.Struct('<HH')
+_UINT64 = struct.Struct('<Q')
+_TIME = struct.Struct('<QI')
+
+
 def conv_uuid(s: bytes) -> str:
-    return str(uuid.UUID(bytes=s)).encode()  # All our other strings are bytes
+    # All our other strings are bytes.  `bytes()` also accepts `memoryview`.
+    return str(uuid.UUID(bytes=bytes(s))).encode()
 
 
 def conv_uint64(s: bytes) -> int:
-    i, = struct.unpack('<Q', s)
+    i, = _UINT64.unpack(s)
     return i
 
 
 def conv_time(s: bytes) -> float:
-    return struct.unpack('<QI', s)
+    return _TIME.unpack(s)
+
+
+def conv_path(s: bytes) -> bytes:
+    return os.path.normpath(bytes(s))
+
+
+# Lets us decode attributes via one lookup instead of an `if` chain.  The
+# `DATA` converter makes a copy, see `_ZERO_COPY_ATTRIBUTE_KIND_TO_CONV`.
+_ATTRIBUTE_KIND_TO_CONV = {
+    AttributeKind.UUID: conv_uuid,
+    AttributeKind.CTRANSID: conv_uint64,
+    AttributeKind.INO: conv_uint64,
+    AttributeKind.SIZE: conv_uint64,
+    AttributeKind.MODE: conv_uint64,
+    AttributeKind.UID: conv_uint64,
+    AttributeKind.GID: conv_uint64,
+    AttributeKind.RDEV: conv_uint64,
+    AttributeKind.CTIME: conv_time,
+    AttributeKind.MTIME: conv_time,
+    AttributeKind.ATIME: conv_time,
+    AttributeKind.XATTR_NAME: bytes,
+    AttributeKind.XATTR_DATA: bytes,
+    AttributeKind.PATH: conv_path,
+    AttributeKind.PATH_TO: conv_path,
+    # NB This is NOT normalized since we don't want to normalize symlinks
+    AttributeKind.PATH_LINK: bytes,
+    AttributeKind.FILE_OFFSET: conv_uint64,
+    AttributeKind.DATA: bytes,
+    AttributeKind.CLONE_UUID: conv_uuid,
+    AttributeKind.CLONE_CTRANSID: conv_uint64,
+    AttributeKind.CLONE_PATH: conv_path,
+    AttributeKind.CLONE_OFFSET: conv_uint64,
+    AttributeKind.CLONE_LEN: conv_uint64,
+}
+assert set(_ATTRIBUTE_KIND_TO_CONV) == set(AttributeKind)
+# With `zero_copy=True`, `write` data is a `memoryview` into the input.
+_ZERO_COPY_ATTRIBUTE_KIND_TO_CONV = {
+    **_ATTRIBUTE_KIND_TO_CONV,
+    AttributeKind.DATA: lambda s: s,
+}
+# `keep_data=False` bounds memory use by skipping `DATA` in pieces this big.
+_SKIP_CHUNK_SIZE = 2 ** 16
+# Avoids constructing an `enum` from each on-disk integer.
+_INT_TO_ATTRIBUTE_KIND = {k.value: k for k in AttributeKind}
+_INT_TO_COMMAND_KIND = {k.value: k for k in CommandKind}
 
 
 def read_attribute(infile):
@@ -141,65 +199,101 @@ def read_attribute(infile):
     attr_data = infile.read(attr_header.length)
     if len(attr_data) != attr_header.length:
         raise RuntimeError(f'{attr_header} got {len(attr_data)} bytes')
-
-    if attr_header.kind == AttributeKind.UUID:
-        return attr_header.kind, conv_uuid(attr_data)
-    elif attr_header.kind == AttributeKind.CTRANSID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.INO:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.SIZE:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.MODE:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.UID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.GID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.RDEV:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CTIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.MTIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.ATIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.XATTR_NAME:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.XATTR_DATA:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.PATH:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.PATH_TO:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.PATH_LINK:
-        # NB This is NOT normalized since we don't want to normalize symlinks
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.FILE_OFFSET:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.DATA:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.CLONE_UUID:
-        return attr_header.kind, conv_uuid(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_CTRANSID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_PATH:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_OFFSET:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_LEN:
-        return attr_header.kind, conv_uint64(attr_data)
-
-    raise RuntimeError(f'Fix me: unhandled {attr_header}')  # pragma: no cover
-
-
-def read_command(infile):
+    return (
+        attr_header.kind,
+        _ATTRIBUTE_KIND_TO_CONV[attr_header.kind](attr_data),
+    )
+
+
+def verify_command_crc(cmd_header: CommandHeader, body: bytes) -> None:
+    'The CRC covers the header (with the CRC zeroed out) and the body.'
+    crc = crc32c(body, crc32c(_COMMAND_HEADER.pack(
+        cmd_header.length, cmd_header.kind.value, 0,
+    )))
+    if crc != cmd_header.crc:
+        raise RuntimeError(f'{cmd_header} has bad CRC {crc}')
+
+
+def _skip_bytes(infile, length: int, crc: Optional[int]) -> Optional[int]:
+    '''
+    Advances `infile` by `length` bytes, without holding them in memory.
+    If `crc` is not None, the skipped bytes are checksummed in chunks, and
+    the updated CRC is returned.
+    '''
+    if crc is None and infile.seekable():
+        # NB: A truncated stream is detected when reading the next command.
+        infile.seek(length, os.SEEK_CUR)
+        return None
+    while length:
+        chunk = infile.read(min(length, _SKIP_CHUNK_SIZE))
+        if not chunk:
+            raise RuntimeError(f'Stream ended with {length} bytes to skip')
+        if crc is not None:
+            crc = crc32c(chunk, crc)
+        length -= len(chunk)
+    return crc
+
+
+def _read_write_command_without_data(
+    infile, cmd_header: CommandHeader, check_crc: bool,
+):
+    '''
+    The `keep_data=False` analog of `read_command` for `WRITE`: reads the
+    attributes one at a time, skips `DATA`, and returns `update_extent`.
+    '''
+    crc = crc32c(_COMMAND_HEADER.pack(
+        cmd_header.length, cmd_header.kind.value, 0,
+    )) if check_crc else None
+    kind_to_attr = {}
+    remaining = cmd_header.length
+    while remaining:
+        attr_header_bytes = infile.read(_ATTRIBUTE_HEADER.size)
+        if len(attr_header_bytes) != _ATTRIBUTE_HEADER.size:
+            raise RuntimeError(f'{cmd_header} has a truncated attribute')
+        kind, length = _ATTRIBUTE_HEADER.unpack(attr_header_bytes)
+        kind = AttributeKind(kind)
+        remaining -= _ATTRIBUTE_HEADER.size + length
+        if remaining < 0:
+            raise RuntimeError(f'{kind} overruns the end of {cmd_header}')
+        if kind in kind_to_attr:
+            raise RuntimeError(f'{kind} occurred twice in {cmd_header}')
+        if crc is not None:
+            crc = crc32c(attr_header_bytes, crc)
+        if kind == AttributeKind.DATA:
+            crc = _skip_bytes(infile, length, crc)
+            kind_to_attr[kind] = length
+            continue
+        attr_data = infile.read(length)
+        if len(attr_data) != length:
+            raise RuntimeError(f'{kind} in {cmd_header} got {len(attr_data)}')
+        if crc is not None:
+            crc = crc32c(attr_data, crc)
+        kind_to_attr[kind] = _ATTRIBUTE_KIND_TO_CONV[kind](attr_data)
+    if crc is not None and crc != cmd_header.crc:
+        raise RuntimeError(f'{cmd_header} has bad CRC {crc}')
+    return SendStreamItems.update_extent(
+        path=kind_to_attr[AttributeKind.PATH],
+        offset=kind_to_attr[AttributeKind.FILE_OFFSET],
+        len=kind_to_attr[AttributeKind.DATA],
+    )
+
+
+def read_command(
+    infile, *,
+    check_crc_kinds: Container[CommandKind] = (),
+    keep_data: bool = True,
+):
     cmd_header = CommandHeader.from_file(infile)
+    if not keep_data and cmd_header.kind == CommandKind.WRITE:
+        return _read_write_command_without_data(
+            infile, cmd_header, cmd_header.kind in check_crc_kinds,
+        )
 
     s = infile.read(cmd_header.length)
     if len(s) != cmd_header.length:
         raise RuntimeError(f'{cmd_header} got {len(s)} bytes')
-    # Future: pull in the `crc32c` module and check the CRC.
+    if check_crc_kinds and cmd_header.kind in check_crc_kinds:
+        verify_command_crc(cmd_header, s)
 
     attr_bytes = BytesIO(s)
     kind_to_attr = {}
@@ -209,6 +303,12 @@ def read_command(infile):
             raise RuntimeError(f'{kind} occurred twice in {cmd_header}')
         kind_to_attr[kind] = attr
 
+    return _item_from_attributes(cmd_header, kind_to_attr)
+
+
+def _item_from_attributes(
+    cmd_header: CommandHeader, kind_to_attr, keep_data: bool = True,
+):
     if cmd_header.kind == CommandKind.SUBVOL:
         return SendStreamItems.subvol(
             path=kind_to_attr[AttributeKind.PATH],
@@ -258,6 +358,12 @@ def read_command(infile):
     elif cmd_header.kind == CommandKind.RMDIR:
         return SendStreamItems.rmdir(path=kind_to_attr[AttributeKind.PATH])
     elif cmd_header.kind == CommandKind.WRITE:
+        if not keep_data:
+            return SendStreamItems.update_extent(
+                path=kind_to_attr[AttributeKind.PATH],
+                offset=kind_to_attr[AttributeKind.FILE_OFFSET],
+                len=len(kind_to_attr[AttributeKind.DATA]),
+            )
         return SendStreamItems.write(
             path=kind_to_attr[AttributeKind.PATH],
             offset=kind_to_attr[AttributeKind.FILE_OFFSET],
@@ -319,11 +425,387 @@ def read_command(infile):
     raise AssertionError(f'Fix me: unhandled {cmd_header}')  # pragma: no cover
 
 
-def parse_send_stream(infile) -> Iterable[SendStreamItem]:
+def _decode_attributes(
+    cmd_header: CommandHeader, body: memoryview,
+    kind_to_conv=_ZERO_COPY_ATTRIBUTE_KIND_TO_CONV,
+):
+    '''
+    The `zero_copy` analog of the attribute loop in `read_command`: decodes
+    straight from the command's `memoryview` without any intermediate copies.
+    '''
+    unpack_attr_header = _ATTRIBUTE_HEADER.unpack_from
+    kind_to_attr = {}
+    pos = 0
+    end = len(body)
+    while pos != end:
+        if end - pos < _ATTRIBUTE_HEADER.size:
+            raise RuntimeError(f'{cmd_header} has a truncated attribute')
+        kind, length = unpack_attr_header(body, pos)
+        pos += _ATTRIBUTE_HEADER.size
+        attr_data = body[pos:pos + length]
+        if len(attr_data) != length:
+            raise RuntimeError(
+                f'Attribute {kind} of length {length} in {cmd_header} got '
+                f'{len(attr_data)} bytes'
+            )
+        pos += length
+        attr_kind = _INT_TO_ATTRIBUTE_KIND.get(kind)
+        if attr_kind is None:
+            raise RuntimeError(f'Unknown attribute {kind} in {cmd_header}')
+        if attr_kind in kind_to_attr:
+            raise RuntimeError(f'{attr_kind} occurred twice in {cmd_header}')
+        kind_to_attr[attr_kind] = kind_to_conv[attr_kind](attr_data)
+    return kind_to_attr
+
+
+def _gen_view_commands(view: memoryview, pos: int, end: int):
+    '''
+    Yields `(CommandHeader, memoryview of the command body, offset just
+    past the command)` for the commands in `view[pos:end]`.
+    '''
+    unpack_cmd_header = _COMMAND_HEADER.unpack_from
+    while pos != end:
+        if end - pos < _COMMAND_HEADER.size:
+            raise RuntimeError(
+                f'Not enough bytes {bytes(view[pos:end])} for command header'
+            )
+        length, kind, crc = unpack_cmd_header(view, pos)
+        pos += _COMMAND_HEADER.size
+        cmd_header = CommandHeader(
+            kind=_INT_TO_COMMAND_KIND.get(kind) or CommandKind(kind),
+            length=length,
+            crc=crc,
+        )
+        body = view[pos:min(pos + length, end)]
+        if len(body) != length:
+            raise RuntimeError(f'{cmd_header} got {len(body)} bytes')
+        pos += length
+        yield cmd_header, body, pos
+
+
+def _gen_mmap_commands(infile):
+    '''
+    Yields `(CommandHeader, memoryview of the command body)` for a
+    send-stream in a regular file, without reading it into memory.  On
+    return, `infile` is positioned just past the `END` command.
+    '''
+    view = memoryview(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ))
+    for cmd_header, body, pos in _gen_view_commands(
+        view, infile.tell(), len(view),
+    ):
+        if cmd_header.kind == CommandKind.END:
+            infile.seek(pos)
+        yield cmd_header, body
+    raise RuntimeError("Not enough bytes b'' for command header")
+
+
+def _gen_block_commands(infile, block_size: int):
+    '''
+    Like `_gen_mmap_commands`, but for pipes & other unmappable inputs.
+    Reads `block_size` bytes at a time, and slices commands out of each
+    block.  Every refill makes a new `bytes` object, so previously yielded
+    `memoryview`s stay valid.  If `infile` is not seekable, bytes past the
+    `END` command may be consumed.
+    '''
+    buf = memoryview(b'')
+    pos = 0
+    unpack_cmd_header = _COMMAND_HEADER.unpack_from
+
+    def ensure(needed):  # Returns True iff `buf` has `needed` bytes at `pos`
+        nonlocal buf, pos
+        if len(buf) - pos >= needed:
+            return True
+        tail = buf[pos:]
+        chunk = infile.read(max(block_size, needed - len(tail)))
+        buf = memoryview(bytes(tail) + chunk if tail else chunk)
+        pos = 0
+        return len(buf) >= needed
+
+    while True:
+        if not ensure(_COMMAND_HEADER.size):
+            raise RuntimeError(
+                f'Not enough bytes {bytes(buf[pos:])} for command header'
+            )
+        length, kind, crc = unpack_cmd_header(buf, pos)
+        pos += _COMMAND_HEADER.size
+        cmd_header = CommandHeader(
+            kind=_INT_TO_COMMAND_KIND.get(kind) or CommandKind(kind),
+            length=length,
+            crc=crc,
+        )
+        if not ensure(length):
+            raise RuntimeError(f'{cmd_header} got {len(buf) - pos} bytes')
+        body = buf[pos:pos + length]
+        pos += length
+        if cmd_header.kind == CommandKind.END and infile.seekable():
+            infile.seek(pos - len(buf), os.SEEK_CUR)
+        yield cmd_header, body
+
+
+def _is_mmappable(infile) -> bool:
+    try:
+        return stat.S_ISREG(os.fstat(infile.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):  # e.g. `BytesIO`
+        return False
+
+
+def parse_send_stream(
+    infile, *,
+    zero_copy: bool = False,
+    block_size: int = 2 ** 20,
+    check_crc: bool = False,
+    crc_skip_kinds: Container[CommandKind] = (),
+    keep_data: bool = True,
+) -> Iterable[SendStreamItem]:
+    '''
+    By default, `infile` is read one command at a time, and `write` items
+    own their `data` as `bytes`.
+
+    `zero_copy=True` is much faster on large send-streams. It `mmap`s
+    regular files, and reads other inputs in blocks of `block_size`.  Then,
+    `write` items get `memoryview` slices of the input as their `data`.
+    These are fine for `len()`, comparisons, and writing to files, but
+    call `bytes()` if you need to pickle or hash them.
+
+    `check_crc=True` verifies the CRC32C of every command, except those
+    whose kind is in `crc_skip_kinds`.  Checksumming is much slower than
+    parsing, so on data-heavy streams, consider skipping `WRITE`.
+
+    `keep_data=False` turns each `write` into an `update_extent` with the
+    same offset and length -- just like `btrfs send --no-data`.  This is
+    all that `IncompleteFile` needs.  By default, the data is then skipped
+    without being read into memory, so peak memory no longer depends on
+    the size of the largest write.  With `zero_copy=True`, the same holds
+    for `mmap`ed files, but block reads still load each whole command.
+    '''
+    # Resolving the kinds up-front keeps the per-command check cheap.
+    check_crc_kinds = frozenset(
+        k for k in CommandKind if k not in crc_skip_kinds
+    ) if check_crc else frozenset()
     check_magic(infile)
     check_version(infile)
-    while True:
-        cmd = read_command(infile)
+    if not zero_copy:
+        while True:
+            cmd = read_command(
+                infile, check_crc_kinds=check_crc_kinds, keep_data=keep_data,
+            )
+            if cmd is None:
+                return
+            yield cmd
+    if _is_mmappable(infile):
+        commands = _gen_mmap_commands(infile)
+    else:
+        commands = _gen_block_commands(infile, block_size)
+    for cmd in _gen_items_from_commands(
+        commands, _ZERO_COPY_ATTRIBUTE_KIND_TO_CONV, check_crc_kinds, keep_data,
+    ):
         if cmd is None:
             return
         yield cmd
+
+
+def _gen_items_from_commands(
+    commands, kind_to_conv, check_crc_kinds, keep_data: bool,
+):
+    'Yields an item (or None for `END`) per `(CommandHeader, body)`.'
+    for cmd_header, body in commands:
+        if check_crc_kinds and cmd_header.kind in check_crc_kinds:
+            verify_command_crc(cmd_header, body)
+        yield _item_from_attributes(
+            cmd_header,
+            _decode_attributes(cmd_header, body, kind_to_conv),
+            keep_data,
+        )
+
+
+_COMMAND_KIND_TO_BATCH_ITEM_TYPE = {
+    CommandKind.CHMOD: SendStreamItems.chmod,
+    CommandKind.CHOWN: SendStreamItems.chown,
+    CommandKind.UTIMES: SendStreamItems.utimes,
+}
+# Keeps `PATH` as a `memoryview`, since `ItemBatch.append` copies it.
+_BATCH_ATTRIBUTE_KIND_TO_CONV = {
+    **_ZERO_COPY_ATTRIBUTE_KIND_TO_CONV,
+    AttributeKind.PATH: lambda s: s,
+}
+
+
+def _append_batch_row(
+    batch: ItemBatch, cmd_header: CommandHeader, body: memoryview,
+) -> None:
+    kind_to_attr = _decode_attributes(
+        cmd_header, body, _BATCH_ATTRIBUTE_KIND_TO_CONV,
+    )
+    path = kind_to_attr[AttributeKind.PATH]
+    if cmd_header.kind == CommandKind.CHMOD:
+        batch.append(path, (kind_to_attr[AttributeKind.MODE],))
+    elif cmd_header.kind == CommandKind.CHOWN:
+        batch.append(path, (
+            kind_to_attr[AttributeKind.UID], kind_to_attr[AttributeKind.GID],
+        ))
+    else:
+        batch.append(path, (
+            *kind_to_attr[AttributeKind.CTIME],
+            *kind_to_attr[AttributeKind.MTIME],
+            *kind_to_attr[AttributeKind.ATIME],
+        ))
+
+
+def parse_send_stream_batches(
+    infile, *,
+    min_batch_size: int = 16,
+    max_batch_size: int = 2 ** 16,
+    block_size: int = 2 ** 20,
+    check_crc: bool = False,
+    crc_skip_kinds: Container[CommandKind] = (),
+    keep_data: bool = True,
+) -> Iterable[Union[SendStreamItem, ItemBatch]]:
+    '''
+    Like `parse_send_stream(zero_copy=True)`, except that runs of at least
+    `min_batch_size` consecutive `chmod`, `chown` & `utimes` commands are
+    yielded as `ItemBatch`es of at most `max_batch_size` rows, one per
+    command kind.  Apply these via `Subvolume.apply_batch`.
+
+    Within such a run, no path changes, and each command sets a different
+    field of its inode, so the batches are yielded kind by kind, but the
+    commands of each kind stay in stream order.  Shorter runs, like the
+    `chown`, `chmod`, `utimes` that `btrfs send` emits after creating
+    each inode, are yielded as items, since a batch would not pay off.
+    '''
+    assert 0 < min_batch_size <= max_batch_size
+    check_crc_kinds = frozenset(
+        k for k in CommandKind if k not in crc_skip_kinds
+    ) if check_crc else frozenset()
+    check_magic(infile)
+    check_version(infile)
+    if _is_mmappable(infile):
+        commands = _gen_mmap_commands(infile)
+    else:
+        commands = _gen_block_commands(infile, block_size)
+
+    # Until the current run is `min_batch_size` long, we hold its commands.
+    # After that, the rest of the run goes straight into the batches.
+    run = []
+    type_to_batch = {}
+    batching = False
+    for cmd_header, body in commands:
+        if check_crc_kinds and cmd_header.kind in check_crc_kinds:
+            verify_command_crc(cmd_header, body)
+        item_type = _COMMAND_KIND_TO_BATCH_ITEM_TYPE.get(cmd_header.kind)
+        if item_type is not None:
+            run.append((cmd_header, body, item_type))
+            if not batching and len(run) < min_batch_size:
+                continue
+            batching = True
+            for run_header, run_body, run_type in run:
+                batch = type_to_batch.get(run_type)
+                if batch is None:
+                    batch = type_to_batch[run_type] = ItemBatch(run_type)
+                _append_batch_row(batch, run_header, run_body)
+                if len(batch) == max_batch_size:
+                    yield type_to_batch.pop(run_type)
+            run.clear()
+            continue
+
+        for run_header, run_body, _ in run:
+            yield _item_from_attributes(
+                run_header,
+                _decode_attributes(run_header, run_body),
+                keep_data,
+            )
+        run.clear()
+        yield from type_to_batch.values()
+        type_to_batch.clear()
+        batching = False
+        item = _item_from_attributes(
+            cmd_header, _decode_attributes(cmd_header, body), keep_data,
+        )
+        if item is None:  # `END`
+            return
+        yield item
+
+
+def index_send_stream(infile) -> List[int]:
+    '''
+    Reads just the command headers of a seekable send-stream, and returns
+    the offset of each command.  The last offset is that of `END`.
+    '''
+    check_magic(infile)
+    check_version(infile)
+    offsets = []
+    while True:
+        offsets.append(infile.tell())
+        cmd_header = CommandHeader.from_file(infile)
+        if cmd_header.kind == CommandKind.END:
+            return offsets
+        infile.seek(cmd_header.length, os.SEEK_CUR)
+
+
+def _parse_send_stream_chunk(
+    path, start: int, end: int, check_crc_kinds, keep_data: bool,
+) -> List[SendStreamItem]:
+    'Runs in a `parse_send_stream_parallel` worker process.'
+    with open(path, 'rb') as infile:
+        infile.seek(start)
+        view = memoryview(infile.read(end - start))
+    return list(_gen_items_from_commands(
+        ((h, b) for h, b, _ in _gen_view_commands(view, 0, len(view))),
+        # Results are pickled, so copy `DATA` out of `view`.
+        _ATTRIBUTE_KIND_TO_CONV,
+        check_crc_kinds,
+        keep_data,
+    ))
+
+
+def parse_send_stream_parallel(
+    path, *,
+    max_workers: Optional[int] = None,
+    chunk_size: int = 2 ** 23,
+    check_crc: bool = False,
+    crc_skip_kinds: Container[CommandKind] = (),
+    keep_data: bool = True,
+) -> Iterable[SendStreamItem]:
+    '''
+    Yields the same items as `parse_send_stream`, in the same order, for
+    the send-stream file at `path` -- but it decodes them in a pool of
+    `max_workers` processes (default: one per CPU).
+
+    First, `index_send_stream` finds the command boundaries, so that the
+    workers can each parse a range of commands totalling about
+    `chunk_size` bytes.  At most 2 chunks per worker are in flight, and
+    their results are yielded strictly in stream order.
+
+    The parse is only worth it when items are expensive to construct
+    compared to pickling them, so `keep_data=False` helps a lot.
+    '''
+    check_crc_kinds = frozenset(
+        k for k in CommandKind if k not in crc_skip_kinds
+    ) if check_crc else frozenset()
+    with open(path, 'rb') as infile:
+        offsets = index_send_stream(infile)
+
+    chunks = []
+    chunk_start = offsets[0]
+    for offset in offsets[1:]:
+        if offset - chunk_start >= chunk_size:
+            chunks.append((chunk_start, offset))
+            chunk_start = offset
+    if chunk_start != offsets[-1]:
+        chunks.append((chunk_start, offsets[-1]))
+
+    max_workers = max_workers or os.cpu_count()
+    futures = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        try:
+            for start, end in chunks:
+                futures.append(executor.submit(
+                    _parse_send_stream_chunk,
+                    path, start, end, check_crc_kinds, keep_data,
+                ))
+                if len(futures) >= 2 * max_workers:
+                    yield from futures.popleft().result()
+            while futures:
+                yield from futures.popleft().result()
+        finally:  # Don't wait on unneeded work if our consumer bails.
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+'''
+`PersistentIntMap` is a mutable mapping from non-negative integers (inode
+IDs, in practice) with an O(1) `snapshot` operation.  A snapshot shares all
+its storage with the original, and each side copies the parts it modifies,
+on first write.  This lets a chain of `Subvolume` snapshots use memory
+proportional to the changes between them, rather than to their size.
+
+The storage is a radix tree with 32-way nodes, as in Clojure's vectors,
+which suits our densely allocated keys.  Each node records the "owner"
+token of the map that may modify it in-place.  `snapshot` gives new tokens
+to both maps, so that neither owns any of the shared nodes.  A write to a
+non-owned node first copies it, along with its ancestors -- that is O(log
+N) extra memory per modified key.
+
+The values are frequently mutable too (e.g. `IncompleteInode`s), so each
+leaf also tracks which of its values were stored by its owner.  Use
+`get_mut` instead of `[]` to get a value you are about to modify, which
+copies it if it may be shared with another map.
+'''
+import copy
+
+from collections.abc import MutableMapping
+from types import MappingProxyType
+from typing import Any, Callable, Iterator, Mapping, Tuple
+
+from .freeze import freeze
+
+_BITS = 5
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+
+
+class _Missing:
+    '''
+    Marks empty slots in `_Node.slots`.  Unpickles as the module's
+    singleton, so pickled maps keep their shared nodes & their owners.
+    '''
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_MISSING'
+
+
+_MISSING = _Missing()
+
+
+class _Node:
+    __slots__ = ('owner', 'slots', 'owned_values')
+
+    def __init__(self, owner, slots):
+        self.owner = owner
+        # Children for inner nodes, values for leaves, or `_MISSING`.
+        self.slots = slots
+        # Leaves only: bit `i` is set if `slots[i]` belongs to `owner`.
+        self.owned_values = 0
+
+
+_NO_SLOTS = (_MISSING,) * _WIDTH
+
+
+def _diff_nodes(a, b, shift: int, base: int) -> Iterator[int]:
+    'Implements `PersistentIntMap.diff_keys`, `a` or `b` may be `_MISSING`.'
+    if a is b:
+        return
+    a_slots = _NO_SLOTS if a is _MISSING else a.slots
+    b_slots = _NO_SLOTS if b is _MISSING else b.slots
+    for idx in range(_WIDTH):
+        a_child = a_slots[idx]
+        b_child = b_slots[idx]
+        if a_child is not b_child:
+            key = base | (idx << shift)
+            if shift:
+                yield from _diff_nodes(a_child, b_child, shift - _BITS, key)
+            else:
+                yield key
+
+
+class PersistentIntMap(MutableMapping):
+    __slots__ = ('_owner', '_root', '_shift', '_len')
+
+    def __init__(self, items=()):
+        self._owner = object()
+        self._root = _Node(self._owner, [_MISSING] * _WIDTH)  # A leaf
+        self._shift = 0  # The key bit offset of the `_root` node's slots
+        self._len = 0
+        for k, v in (items.items() if hasattr(items, 'items') else items):
+            self[k] = v
+
+    def snapshot(self) -> 'PersistentIntMap':
+        '''
+        Returns an O(1) copy of `self`.  The copy is independent, so long
+        as the values are modified only via `get_mut`.
+        '''
+        other = PersistentIntMap.__new__(PersistentIntMap)
+        other._root = self._root
+        other._shift = self._shift
+        other._len = self._len
+        other._owner = object()
+        # Neither map may now modify the shared nodes in-place.
+        self._owner = object()
+        return other
+
+    def _find_leaf(self, key: int) -> Any:
+        'Returns the leaf that would contain `key`, or `_MISSING`.'
+        if not isinstance(key, int) or key < 0 or \
+                key >> (self._shift + _BITS):
+            return _MISSING
+        node = self._root
+        for shift in range(self._shift, 0, -_BITS):
+            node = node.slots[(key >> shift) & _MASK]
+            if node is _MISSING:
+                break
+        return node
+
+    def _own(self, node: _Node) -> _Node:
+        if node.owner is self._owner:
+            return node
+        return _Node(self._owner, list(node.slots))
+
+    def _writable_leaf(self, key: int) -> _Node:
+        'Copies the nodes on the path to `key` unless we own them.'
+        assert isinstance(key, int) and key >= 0, key
+        while key >> (self._shift + _BITS):  # Grow the tree upwards
+            self._root = _Node(
+                self._owner, [self._root] + [_MISSING] * (_WIDTH - 1),
+            )
+            self._shift += _BITS
+        node = self._root = self._own(self._root)
+        for shift in range(self._shift, 0, -_BITS):
+            idx = (key >> shift) & _MASK
+            child = node.slots[idx]
+            child = _Node(self._owner, [_MISSING] * _WIDTH) \
+                if child is _MISSING else self._own(child)
+            node.slots[idx] = child
+            node = child
+        return node
+
+    def __getitem__(self, key: int) -> Any:
+        leaf = self._find_leaf(key)
+        value = _MISSING if leaf is _MISSING else leaf.slots[key & _MASK]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    # `Mapping` implements these via `__getitem__`, which raises on misses.
+
+    def get(self, key: int, default: Any=None) -> Any:
+        leaf = self._find_leaf(key)
+        value = _MISSING if leaf is _MISSING else leaf.slots[key & _MASK]
+        return default if value is _MISSING else value
+
+    def __contains__(self, key: int) -> bool:
+        leaf = self._find_leaf(key)
+        return leaf is not _MISSING and leaf.slots[key & _MASK] is not _MISSING
+
+    def __setitem__(self, key: int, value: Any) -> None:
+        leaf = self._find_leaf(key)
+        # We own all the ancestors of the leaves that we own.
+        if leaf is _MISSING or leaf.owner is not self._owner:
+            leaf = self._writable_leaf(key)
+        idx = key & _MASK
+        if leaf.slots[idx] is _MISSING:
+            self._len += 1
+        leaf.slots[idx] = value
+        leaf.owned_values |= 1 << idx
+
+    def __delitem__(self, key: int) -> None:
+        self[key]  # Raise `KeyError` before modifying anything
+        leaf = self._writable_leaf(key)
+        idx = key & _MASK
+        leaf.slots[idx] = _MISSING
+        leaf.owned_values &= ~(1 << idx)
+        self._len -= 1
+        # Future: release empty nodes.  Deletions are rare in our use.
+
+    def get_mut(self, key: int, copy_fn: Callable[[Any], Any]) -> Any:
+        'Returns `self[key]`, replaced by `copy_fn` of it if not owned.'
+        leaf = self._find_leaf(key)
+        idx = key & _MASK
+        if leaf is _MISSING or leaf.slots[idx] is _MISSING:
+            raise KeyError(key)
+        if leaf.owner is not self._owner:
+            leaf = self._writable_leaf(key)
+        elif leaf.owned_values & (1 << idx):
+            return leaf.slots[idx]  # Fast path, nothing to copy
+        if not leaf.owned_values & (1 << idx):
+            leaf.slots[idx] = copy_fn(leaf.slots[idx])
+            leaf.owned_values |= 1 << idx
+        return leaf.slots[idx]
+
+    def _gen_items(self, node, shift, base) -> Iterator[Tuple[int, Any]]:
+        for idx, child in enumerate(node.slots):
+            if child is not _MISSING:
+                key = base | (idx << shift)
+                if shift:
+                    yield from self._gen_items(child, shift - _BITS, key)
+                else:
+                    yield key, child
+
+    # Iterate in key order.  `items()` and `values()` are generators
+    # since the `Mapping` views would do a lookup per key.
+    def items(self) -> Iterator[Tuple[int, Any]]:
+        return self._gen_items(self._root, self._shift, 0)
+
+    def values(self) -> Iterator[Any]:
+        return (v for _, v in self.items())
+
+    def __iter__(self) -> Iterator[int]:
+        return (k for k, _ in self.items())
+
+    def __len__(self) -> int:
+        return self._len
+
+    def diff_keys(self, other: 'PersistentIntMap') -> Iterator[int]:
+        '''
+        Yields, in key order, the keys that are in only one of the maps, or
+        whose values differ by identity.  Skips the subtrees that the maps
+        still share since a `snapshot`, so this is fast for maps with few
+        changes since their common ancestor.
+        '''
+        a, b = self._root, other._root
+        shift = max(self._shift, other._shift)
+        # Bring the shallower root to the height of the other one.
+        for _ in range(self._shift, shift, _BITS):
+            a = _Node(None, [a] + [_MISSING] * (_WIDTH - 1))
+        for _ in range(other._shift, shift, _BITS):
+            b = _Node(None, [b] + [_MISSING] * (_WIDTH - 1))
+        return _diff_nodes(a, b, shift, 0)
+
+    def __deepcopy__(self, memo) -> 'PersistentIntMap':
+        return PersistentIntMap(
+            (k, copy.deepcopy(v, memo)) for k, v in self.items()
+        )
+
+    def freeze(self, *, _memo) -> Mapping[int, Any]:
+        return MappingProxyType({
+            k: freeze(v, _memo=_memo) for k, v in self.items()
+        })
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self.items())})'
+
+
+def get_mut(mapping: Mapping, key: Any, copy_fn: Callable[[Any], Any]) -> Any:
+    '''
+    `mapping.get_mut`, as on `PersistentIntMap`, if available, or else
+    `mapping[key]`.  For frozen mappings, this defers the error to the
+    attempted mutation.
+    '''
+    mapping_get_mut = getattr(mapping, 'get_mut', None)
+    if mapping_get_mut is None:
+        return mapping[key]
+    return mapping_get_mut(key, copy_fn)
@@ -65,10 +65,9 @@ wraps only objects that occur more than once. For example, (ii) becomes:
  (ii) if 'a' and 'b' are the same inode:
       `['(Dir)': {'a': [['(File)', 0]], 'a': [['(File)', 0]]]`
 '''
-import os
-
 from typing import (
-    Any, Coroutine, Hashable, Mapping, NamedTuple, Optional, Tuple, Union,
+    Any, Callable, Coroutine, Hashable, Iterable, Mapping, NamedTuple,
+    Optional, Tuple, Union,
 )
 from itertools import count
 
@@ -77,20 +76,92 @@ from .coroutine_utils import while_not_exited
 RenderedTree = Union[Tuple[Any], Tuple[Any, Mapping[bytes, 'RenderedTree']]]
 
 
-def gather_bottom_up(
-    ser: RenderedTree,
-    *,
-    # Private, and NOT like the public `top_path` arg of `gather_bottom_up`.
-    # Not `bytes` since we `surrogateescape` everything at render time to
-    # let us produce JSON-friendly `utf-8`.
-    _path: str='.',
+def gather_tree_bottom_up(
+    top_path: Any,
+    top_node: Any,
+    list_children: Callable[
+        [Any, Any],  # path, node
+        # None for files.  For directories, the `(name, path, node)` of
+        # each child, in the order of traversal.
+        Optional[Iterable[Tuple[Any, Any, Any]]],
+    ],
+    get_inode: Callable[[Any], Any],  # node -> the inode to yield
 ) -> Coroutine[
+    Tuple[Any, Any, Optional[Mapping[Any, Any]]],  # yield
+    Any,  # send
+    Any,  # return
+]:
+    '''
+    The traversal engine shared by `gather_bottom_up` and
+    `Subvolume.gather_bottom_up`, see their docblocks for the protocol.
+    Uses an explicit stack instead of recursing via `yield from`, so deep
+    trees do not hit the recursion limit, and each `send` costs O(1)
+    instead of O(depth).  `list_children` is called once per node, when
+    the traversal first reaches it.
+    '''
+    # The directories on the path to the current node, each as
+    # `(name, path, node, iterator over children, child results)`.
+    stack = []
+    name, path, node = None, top_path, top_node
+    while True:
+        # Descend into the current node.
+        children = list_children(path, node)
+        if children is None:
+            result = yield (path, get_inode(node), None)
+        else:
+            children = iter(children)
+            child = next(children, None)
+            if child is not None:
+                stack.append((name, path, node, children, {}))
+                name, path, node = child
+                continue
+            result = yield (path, get_inode(node), {})
+        # Ascend until we reach a directory with children left to visit.
+        while True:
+            if not stack:
+                return result
+            parent_name, path, node, children, child_results = stack[-1]
+            child_results[name] = result
+            child = next(children, None)
+            if child is not None:
+                name, path, node = child
+                break
+            stack.pop()
+            name = parent_name
+            result = yield (path, get_inode(node), child_results)
+
+
+def _list_rendered_children(path: str, ser: RenderedTree):
+    if not isinstance(ser, list):
+        raise RuntimeError(f'Unknown type in rendered subvolume: {ser}')
+    elif len(ser) == 1:
+        return None
+    elif len(ser) != 2:
+        raise RuntimeError(f'Rendered inode list length != 1, 2: {ser}')
+    # Normally, we'd just get a 1-element list for files, but this is OK.
+    if ser[1] is None:
+        return None
+    # Traverse children in the same order as `Subvolume.gather_bottom_up`,
+    # ensuring that in tests actual & expected traversal IDs agree.
+    # Child names never contain `/`, so skip `os.path.join`.  No leading
+    # `./` for children of the root.
+    prefix = '' if path == '.' else path + '/'
+    return (
+        (name, prefix + name, child_ser)
+            for name, child_ser in sorted(ser[1].items())
+    )
+
+
+def gather_bottom_up(ser: RenderedTree) -> Coroutine[
     Tuple[
-        bytes,  # full path to current inode
+        # Full path to current inode.  Not `bytes` since we
+        # `surrogateescape` everything at render time to let us produce
+        # JSON-friendly `utf-8`.
+        str,
         Any,  # the current inode
         # None for files. For directories, maps the names of the child
         # inodes to whatever result type they had sent us.
-        Optional[Mapping[bytes, Any]],
+        Optional[Mapping[str, Any]],
     ],  # yield
     Any,  # send -- whatever result type we are aggregating.
     Any,  # return -- the final result, whatever you sent for `top_path`
@@ -101,28 +172,9 @@ def gather_bottom_up(
     `Subvolume.gather_bottom_up`.  See that docblock for a discussion of the
     merits of traversal coroutines.
     '''
-    if not isinstance(ser, list):
-        raise RuntimeError(f'Unknown type in rendered subvolume: {ser}')
-    elif len(ser) == 1:
-        return (yield _path, ser[0], None)
-    elif len(ser) != 2:
-        raise RuntimeError(f'Rendered inode list length != 1, 2: {ser}')
-
-    ino, children = ser
-    # Normally, we'd just get a 1-element list, but this is OK too.
-    if children is None:
-        child_results = None
-    else:
-        child_results = {}
-        # Traverse children in the same order as `gather_bottom_up`,
-        # ensuring that in tests actual & expected traversal IDs agree.
-        for name, child_ser in sorted(children.items()):
-            child_results[name] = (yield from gather_bottom_up(
-                child_ser,
-                # normpath to remove the leading ./
-                _path=os.path.normpath(os.path.join(_path, name)),
-            ))
-    return (yield (_path, ino, child_results))  # noqa: B901
+    return gather_tree_bottom_up(
+        '.', ser, _list_rendered_children, lambda ser: ser[0],
+    )
 
 
 def map_bottom_up(ser: RenderedTree, fn) -> RenderedTree:
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+'''
+Writes the same JSON as
+
+    json.dump(
+        emit_non_unique_traversal_ids(subvol.render()), out,
+        sort_keys=True, indent=2,
+    )
+
+but without building the `RenderedTree`.  The above holds the whole tree
+in RAM several times over -- once from `render`, once more for each
+`emit_*` pass, and again as the `json` output string -- which does not
+scale to images with millions of files.
+
+Instead, we stream each directory top-down, with its children in the
+sorted-key order of `json`.  Besides the output, this needs memory
+proportional to the entries of the directories on the current path, plus
+the IDs of the hardlinked inodes.
+
+Non-unique traversal IDs normally take two passes: `render` counts the
+references to each inode, and `emit_non_unique_traversal_ids` then numbers
+those with 2+ references in its bottom-up traversal order.  We replace
+both passes with a lookup and a counter:
+  - The `InodeIDMap` knows how many paths each inode has, so we only need
+    to look at the paths of hardlinked inodes, and only when `top_path`
+    is not the root.
+  - Directories cannot be hardlinked, so only files ever get IDs.  Files
+    come in the same relative order in our top-down traversal as in the
+    bottom-up one, so we can number them as we write them.
+'''
+import json
+import os
+
+from typing import Mapping, TextIO
+
+from .inode_id import InodeID
+from .rendered_tree import TraversalIDMaker
+from .subvolume import Subvolume
+
+
+def _refcount(subvol: Subvolume, ino_id: InodeID, norm_top: bytes) -> int:
+    'How many times `render(top_path)` would include this inode.'
+    num_paths = subvol.id_map.get_num_paths(ino_id)
+    if num_paths < 2 or norm_top == b'.':
+        return num_paths
+    prefix = norm_top + b'/'
+    return sum(
+        path == norm_top or path.startswith(prefix)
+            for path in subvol.id_map.get_paths(ino_id)
+    )
+
+
+def write_subvolume_json(
+    out: TextIO,
+    subvol: Subvolume,
+    *,
+    top_path: bytes=b'.',
+    indent: int=2,
+    # Private: the nesting level of the output, for `write_subvolumes_json`
+    _level: int=0,
+) -> None:
+    'See the module docblock.  Does not end the output with a newline.'
+    norm_top = os.path.normpath(top_path)
+    id_maker = TraversalIDMaker()
+
+    def newline(level: int) -> str:
+        return '\n' + ' ' * (indent * level)
+
+    def inode_json(ino_id: InodeID, level: int) -> str:
+        ino = repr(subvol.id_to_inode[ino_id])
+        if _refcount(subvol, ino_id, norm_top) > 1:
+            ino = [ino, id_maker.next_with_nonce(ino_id.id).id]
+        return json.dumps(ino, indent=indent).replace('\n', newline(level))
+
+    # Each item is either a string to write, or an `(InodeID, level)` to
+    # expand.  We expand the items in place of the list `[ino, {...}]` or
+    # `[ino]`, at the given nesting level.
+    stack = [(subvol.id_map.get_id(top_path), _level)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.write(item)
+            continue
+        ino_id, level = item
+        out.write('[' + newline(level + 1) + inode_json(ino_id, level + 1))
+        children = subvol.id_map.get_sorted_children(ino_id)
+        if children is None:
+            out.write(newline(level) + ']')
+            continue
+        out.write(',' + newline(level + 1))
+        if not children:
+            out.write('{}' + newline(level) + ']')
+            continue
+        # The order of `sort_keys`, which differs from that of `bytes`.
+        children = sorted(
+            (name.decode(errors='surrogateescape'), child_id)
+                for name, child_id in children
+        )
+        stack.append(newline(level + 1) + '}' + newline(level) + ']')
+        for i in range(len(children) - 1, -1, -1):
+            name, child_id = children[i]
+            stack.append((child_id, level + 2))
+            stack.append(
+                ('{' if i == 0 else ',') + newline(level + 2)
+                    + json.dumps(name) + ': '
+            )
+
+
+def write_subvolumes_json(
+    out: TextIO, name_to_subvol: Mapping[str, Subvolume], *, indent: int=2,
+) -> None:
+    'Writes a JSON object mapping each name to its `write_subvolume_json`.'
+    if not name_to_subvol:
+        out.write('{}')
+        return
+    for i, name in enumerate(sorted(name_to_subvol)):
+        out.write(('{' if i == 0 else ',') + '\n' + ' ' * indent)
+        out.write(json.dumps(name) + ': ')
+        write_subvolume_json(
+            out, name_to_subvol[name], indent=indent, _level=1,
+        )
+    out.write('\n}')
@@ -7,8 +7,11 @@ output of `btrfs receive --dump`.  The latter parse is imperfect and has a
 number of limitations, but we find it useful for testing -- refer to the
 `parse_dump.py` docblock.
 '''
+import os
+
+from array import array
 from collections import Counter
-from typing import Callable, Iterable
+from typing import Callable, Iterable, Iterator, Optional, Tuple
 
 from compiler.enriched_namedtuple import metaclass_new_enriched_namedtuple
 
@@ -135,6 +138,71 @@ class SendStreamItems:
         fields = ['offset', 'len']
 
 
+# The integer columns of each kind of `ItemBatch` row.  Times are stored
+# as `sec, nsec`, in the order ctime, mtime, atime.
+_BATCH_ITEM_TYPE_TO_WIDTH = {
+    SendStreamItems.chmod: 1,  # mode
+    SendStreamItems.chown: 2,  # uid, gid
+    SendStreamItems.utimes: 6,
+}
+
+
+class ItemBatch:
+    '''
+    A columnar block of `chmod`, `chown`, or `utimes` items, all of the
+    same `item_type`.  Metadata-heavy send-streams have millions of these,
+    and constructing a `SendStreamItem` for each dominates parsing, so
+    `parse_send_stream_batches` makes these instead, and
+    `Subvolume.apply_batch` applies them without any per-item objects.
+
+    The paths are concatenated in `path_arena`, with the `i`th path ending
+    at `path_ends[i]`.  The integer fields are in `values`, `width` per
+    row, as documented in `_BATCH_ITEM_TYPE_TO_WIDTH`.  Iterating yields
+    the equivalent items.
+    '''
+    __slots__ = ('item_type', 'width', 'path_arena', 'path_ends', 'values')
+
+    def __init__(self, item_type: SendStreamItem):
+        self.item_type = item_type
+        self.width = _BATCH_ITEM_TYPE_TO_WIDTH[item_type]
+        self.path_arena = bytearray()
+        self.path_ends = array('Q')
+        self.values = array('q')
+
+    def append(self, path: bytes, values: Iterable[int]) -> None:
+        'Accepts any bytes-like `path`, e.g. a `memoryview`.'
+        self.path_arena += path
+        self.path_ends.append(len(self.path_arena))
+        self.values.extend(values)
+        assert len(self.values) == self.width * len(self.path_ends)
+
+    def __len__(self) -> int:
+        return len(self.path_ends)
+
+    def path(self, i: int) -> bytes:
+        return bytes(self.path_arena[
+            self.path_ends[i - 1] if i else 0:self.path_ends[i]
+        ])
+
+    def row(self, i: int) -> array:
+        return self.values[i * self.width:(i + 1) * self.width]
+
+    def item(self, i: int) -> SendStreamItem:
+        path = os.path.normpath(self.path(i))
+        v = self.row(i)
+        if self.item_type is SendStreamItems.chmod:
+            return SendStreamItems.chmod(path=path, mode=v[0])
+        elif self.item_type is SendStreamItems.chown:
+            return SendStreamItems.chown(path=path, uid=v[0], gid=v[1])
+        return SendStreamItems.utimes(
+            path=path, ctime=(v[0], v[1]), mtime=(v[2], v[3]),
+            atime=(v[4], v[5]),
+        )
+
+    def __iter__(self) -> Iterator[SendStreamItem]:
+        return (self.item(i) for i in range(len(self)))
+
+
 def get_frequency_of_selinux_xattrs(items):
     'Returns {"xattr_value": <count>}. Useful for ItemFilters.selinux_xattr.'
     counter = Counter()
@@ -194,3 +262,109 @@ class ItemFilters:
                 )
             else:
                 yield item
+
+
+class FusedItemFilters:
+    '''
+    Applies the `ItemFilters` in a single pass, which looks up the handler
+    for each item's class once, and also computes the
+    `get_frequency_of_selinux_xattrs` of the items it sees.  Use it as:
+
+        filters = FusedItemFilters(...)
+        for item in filters(items):
+            ...
+        # Now, `filters.selinux_freqs` is populated.
+
+    Either discard SELinux xattrs via `selinux_discard_fn`, like with
+    `ItemFilters.selinux_xattr`, or make that function from the final
+    frequencies via `make_selinux_discard_fn(freqs)`.  The latter decision
+    is deferred to the end of the input, so from the first SELinux
+    `set_xattr` onwards, the output is buffered.  Buffering keeps the
+    order of the items, since later ones may rename or remove the path.
+    The old way needed the frequencies up-front, and so had to hold all
+    the items anyway, and to make a separate pass over them.
+
+    `utimes_range=(start_time, end_time)` is as in
+    `ItemFilters.normalize_utimes`.
+    '''
+
+    def __init__(
+        self,
+        *,
+        selinux_discard_fn: Optional[Callable[[bytes, bytes], bool]]=None,
+        make_selinux_discard_fn: Optional[
+            Callable[[Counter], Callable[[bytes, bytes], bool]]
+        ]=None,
+        utimes_range: Optional[Tuple[float, float]]=None,
+    ):
+        assert selinux_discard_fn is None or make_selinux_discard_fn is None
+        self._selinux_discard_fn = selinux_discard_fn
+        self._make_selinux_discard_fn = make_selinux_discard_fn
+        self._utimes_range = utimes_range
+        self.selinux_freqs = Counter()
+        self._type_to_handler = {SendStreamItems.set_xattr: self._set_xattr}
+        if utimes_range is not None:
+            self._type_to_handler[SendStreamItems.utimes] = self._utimes
+
+    def _set_xattr(self, item):
+        'Returns the item, `None` to discard it, or `...` to defer that.'
+        if item.name != _SELINUX_XATTR:
+            return item
+        self.selinux_freqs[item.data] += 1
+        if self._make_selinux_discard_fn is not None:
+            return ...
+        if self._selinux_discard_fn is not None and \
+                self._selinux_discard_fn(item.path, item.data):
+            return None
+        return item
+
+    def _utimes(self, item):
+        start_time, end_time = self._utimes_range
+        atime, mtime, ctime = item.atime, item.mtime, item.ctime
+        if not (
+            start_time <= atime <= end_time
+            or start_time <= mtime <= end_time
+            or start_time <= ctime <= end_time
+        ):
+            return item
+        # `_replace` skips the field validation of `__new__`, which would
+        # take most of our time.
+        return item._replace(
+            atime=start_time if start_time <= atime <= end_time else atime,
+            mtime=start_time if start_time <= mtime <= end_time else mtime,
+            ctime=start_time if start_time <= ctime <= end_time else ctime,
+        )
+
+    def __call__(
+        self, items: Iterable[SendStreamItem],
+    ) -> Iterator[SendStreamItem]:
+        type_to_handler = self._type_to_handler
+        held = None  # Once a decision is deferred, holds the output
+        deferred_idxs = []  # Indexes into `held`
+        for item in items:
+            handler = type_to_handler.get(type(item))
+            if handler is not None:
+                filtered = handler(item)
+                if filtered is not item:
+                    if filtered is None:
+                        continue
+                    if filtered is ...:
+                        if held is None:
+                            held = []
+                        deferred_idxs.append(len(held))
+                        held.append(item)
+                        continue
+                    item = filtered
+            if held is None:
+                yield item
+            else:
+                held.append(item)
+        if held is not None:
+            discard_fn = self._make_selinux_discard_fn(self.selinux_freqs)
+            start = 0
+            for idx in deferred_idxs:
+                item = held[idx]
+                if discard_fn(item.path, item.data):
+                    yield from held[start:idx]
+                    start = idx + 1
+            yield from held[start:]
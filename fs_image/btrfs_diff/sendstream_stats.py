@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+'''
+Measures where the time goes when applying send-streams to a
+`SubvolumeSet`, see `examples/sendstream_stats.py` for the CLI.
+
+For each kind of `SendStreamItem`, we count the items & their payload
+bytes, and time both parsing them, and applying them via
+`SubvolumeSetMutator`.  Separately, each send-stream, and the final
+`freeze` (where `extents_to_chunks` runs), is a "stage", for which we
+record the wall time, and with `trace_memory=True`, the peak of the
+memory allocated by Python.  Note that `tracemalloc` roughly doubles the
+run time, so compare timings only between runs with the same setting.
+'''
+import time
+import tracemalloc
+
+from typing import (
+    BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional,
+    Sequence, Tuple,
+)
+
+from .freeze import freeze
+from .parse_dump import SendStreamItem, SendStreamItems
+from .parse_send_stream import parse_send_stream
+from .subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+
+def item_bytes(item: SendStreamItem) -> int:
+    'The bytes of file data or xattr value that the item carries.'
+    if isinstance(item, (SendStreamItems.write, SendStreamItems.set_xattr)):
+        return len(item.data)
+    if isinstance(item, (
+        SendStreamItems.clone, SendStreamItems.update_extent,
+    )):
+        return item.len
+    return 0
+
+
+class KindStats:
+    __slots__ = ('count', 'bytes', 'parse_sec', 'apply_sec')
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.parse_sec = 0.0
+        self.apply_sec = 0.0
+
+
+class StageStats(NamedTuple):
+    name: str
+    sec: float
+    # Only set with `trace_memory=True`
+    peak_bytes: Optional[int]
+
+
+class SendStreamStats(NamedTuple):
+    kind_to_stats: Dict[str, KindStats]
+    stages: List[StageStats]
+
+    def to_json_dict(self):
+        return {
+            'kinds': {
+                kind: {s: getattr(ks, s) for s in KindStats.__slots__}
+                    for kind, ks in sorted(self.kind_to_stats.items())
+            },
+            'stages': [s._asdict() for s in self.stages],
+        }
+
+    def format(self) -> str:
+        lines = [
+            f'{"kind":<16}{"count":>10}{"bytes":>14}'
+            f'{"parse_sec":>12}{"apply_sec":>12}',
+        ]
+        for kind, ks in sorted(
+            self.kind_to_stats.items(),
+            key=lambda kv: -(kv[1].parse_sec + kv[1].apply_sec),
+        ):
+            lines.append(
+                f'{kind:<16}{ks.count:>10}{ks.bytes:>14}'
+                f'{ks.parse_sec:>12.3f}{ks.apply_sec:>12.3f}'
+            )
+        lines.append('')
+        lines.append(f'{"stage":<30}{"sec":>10}{"peak_MiB":>12}')
+        for stage in self.stages:
+            peak = '' if stage.peak_bytes is None \
+                else f'{stage.peak_bytes / 2 ** 20:.1f}'
+            lines.append(f'{stage.name:<30}{stage.sec:>10.3f}{peak:>12}')
+        return '\n'.join(lines)
+
+
+def _timed_items(
+    items: Iterator[SendStreamItem], kind_to_stats: Dict[str, KindStats],
+) -> Iterator[Tuple[SendStreamItem, KindStats]]:
+    'Yields each item with its `KindStats`, counting it & its parse time.'
+    while True:
+        start = time.perf_counter()
+        item = next(items, None)
+        if item is None:
+            return
+        ks = kind_to_stats.get(type(item).__name__)
+        if ks is None:
+            ks = kind_to_stats[type(item).__name__] = KindStats()
+        ks.parse_sec += time.perf_counter() - start
+        ks.count += 1
+        ks.bytes += item_bytes(item)
+        yield item, ks
+
+
+def apply_sendstreams_with_stats(
+    infiles: Sequence[BinaryIO],
+    *,
+    parse: Callable[[BinaryIO], Iterator[SendStreamItem]]=parse_send_stream,
+    trace_memory: bool=False,
+) -> Tuple[SubvolumeSet, SendStreamStats]:
+    '''
+    Applies the send-streams to a new `SubvolumeSet` from left to right,
+    then freezes it.  Returns the frozen set, and the stats.
+    '''
+    stats = SendStreamStats(kind_to_stats={}, stages=[])
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    def run_stage(name, fn):
+        if trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = fn()
+        sec = time.perf_counter() - start
+        stats.stages.append(StageStats(
+            name=name,
+            sec=sec,
+            peak_bytes=tracemalloc.get_traced_memory()[1]
+                if trace_memory else None,
+        ))
+        return result
+
+    def apply_sendstream(infile):
+        items = _timed_items(iter(parse(infile)), stats.kind_to_stats)
+        item, ks = next(items)
+        start = time.perf_counter()
+        mutator = SubvolumeSetMutator.new(subvols, item)
+        ks.apply_sec += time.perf_counter() - start
+        for item, ks in items:
+            start = time.perf_counter()
+            mutator.apply_item(item)
+            ks.apply_sec += time.perf_counter() - start
+
+    try:
+        subvols = SubvolumeSet.new()
+        for i, infile in enumerate(infiles):
+            name = getattr(infile, 'name', f'#{i}')
+            run_stage(f'apply {name}', lambda: apply_sendstream(infile))
+        frozen = run_stage('freeze', lambda: freeze(subvols))
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return frozen, stats
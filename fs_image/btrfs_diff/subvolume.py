@@ -22,24 +22,38 @@ mutate its state.
 
 - Maximum path lengths are not checked.
 '''
+import concurrent.futures
+import copy
+import multiprocessing
 import os
+import stat
 
+from collections.abc import MutableMapping
 from types import MappingProxyType
 from typing import (
-    Any, Coroutine, Iterator, Mapping, NamedTuple, Optional, Sequence,
-    Tuple, Union,
+    Any, Coroutine, Hashable, Iterator, Mapping, NamedTuple, Optional,
+    Sequence, Tuple, Union,
 )
 
+from .clone_index import CloneIndex
 from .coroutine_utils import while_not_exited
-from .extents_to_chunks import extents_to_chunks_with_clones
+from .extent import Extent
+from .extents_to_chunks import (
+    extents_to_chunks_with_clones, extents_to_chunks_with_extent_ids,
+)
 from .freeze import freeze
+from .inode import InodeOwner, InodeUtimes
 from .inode_id import InodeID, InodeIDMap
+from .inode_store import PersistentInodeStore
 from .incomplete_inode import (
     IncompleteDevice, IncompleteDir, IncompleteFifo, IncompleteFile,
     IncompleteInode, IncompleteSocket, IncompleteSymlink,
 )
-from .send_stream import SendStreamItem, SendStreamItems
-from .rendered_tree import RenderedTree, TraversalIDMaker
+from .persistent_map import get_mut
+from .send_stream import ItemBatch, SendStreamItem, SendStreamItems
+from .rendered_tree import (
+    gather_tree_bottom_up, RenderedTree, TraversalIDMaker,
+)
 
 _DUMP_ITEM_TO_INCOMPLETE_INODE = {
     SendStreamItems.mkdir: IncompleteDir,
@@ -51,21 +65,22 @@ _DUMP_ITEM_TO_INCOMPLETE_INODE = {
 }
 
 
-# Future: `deepfrozen` would let us lose the `new` methods on NamedTuples,
-# and avoid `deepcopy`.
+# Future: `deepfrozen` would let us lose the `new` methods on NamedTuples.
 class Subvolume(NamedTuple):
     '''
     Models a btrfs subvolume, knows how to apply SendStreamItem mutations
     to itself.
 
-    IMPORTANT: Keep this object correctly `deepcopy`able, we need that
-    for snapshotting. Notes:
+    To snapshot a subvolume, use `snapshot`, which shares the directory
+    entries & inodes of the parent.  Either side copies these on first
+    write, so mutate inodes only via `apply_item` and `apply_clone`.
+
+    IMPORTANT: Keep this object correctly `deepcopy`able, tests rely on
+    that. Notes:
 
       - `InodeIDMap` opaquely holds a `description`, which in practice
         is a `SubvolumeDescription` that is **NOT** safely `deepcopy`able
-        unless the whole `Volume` is being copied in one call.  For
-        single-volume snapshots, `SubvolumeSetMutator` has an icky
-        workaround :)
+        unless the whole `Volume` is being copied in one call.
 
       - The tests for `InodeIDMap` try to ensure that it is safely
         `deepcopy`able.  Changes to its members should be validated there.
@@ -77,6 +92,9 @@ class Subvolume(NamedTuple):
       - `IncompleteInode` descendants are correctly deepcopy-able despite
         the fact that `Extent` relies on object identity for clone-tracking.
         This is explained in the submodule docblock.
+
+      - `clone_index` is shared by all the `Subvolume`s of a `SubvolumeSet`,
+        so snapshots must not copy it.  `SubvolumeSetMutator` handles this.
     '''
     # Inodes & inode maps are per-subvolume because btrfs treats subvolumes
     # as independent entities -- we cannot `rename` or hard-link data across
@@ -87,34 +105,77 @@ class Subvolume(NamedTuple):
     # where a subvolume is mounted within a volume, but this does not
     # require us to share inodes across subvolumes.
     id_map: InodeIDMap
+    # Unless frozen, this is a `PersistentInodeStore`, or for subvolumes
+    # with millions of inodes, a `ColumnarInodeStore` passed to `new`.
     id_to_inode: Mapping[InodeID, Union[IncompleteInode, 'Inode']]
+    # The data model for new files: `Extent`, or `IntervalExtent` for
+    # files with very many extents.  Irrelevant once frozen.
+    extent_class: type = Extent
+    # If set, we mark files dirty in this index as we mutate them.
+    # Irrelevant once frozen.
+    clone_index: Optional[CloneIndex] = None
 
     @classmethod
     def new(cls, *, id_map, **kwargs) -> 'Subvolume':
-        kwargs.setdefault('id_to_inode', {})
+        kwargs.setdefault('id_to_inode', PersistentInodeStore(id_map.inner))
         kwargs['id_to_inode'][id_map.get_id(b'.')] = IncompleteDir(
             item=SendStreamItems.mkdir(path=b'.'),
         )
         return cls(id_map=id_map, **kwargs)
 
+    def snapshot(self, *, description: Any) -> 'Subvolume':
+        '''
+        Returns a copy of `self` with a new `id_map.inner.description`, in
+        O(1) time and memory with the default `PersistentInodeStore`.
+        Either `Subvolume` then copies a directory entry or an inode when
+        it first modifies it.  Note that `deepcopy` would be wrong here,
+        since it would also copy `description`.
+        '''
+        id_map = self.id_map.snapshot(description=description)
+        return self._replace(
+            id_map=id_map,
+            id_to_inode=self.id_to_inode.snapshot(id_map.inner),
+        )
+
     def inode_at_path(self, path: bytes) -> Optional[IncompleteInode]:
         id = self.id_map.get_id(path)
         # Using `[]` instead of `.get()` to assert that `id_to_inode`
         # remains a superset of `id_map`.  The converse is harder to check.
         return None if id is None else self.id_to_inode[id]
 
+    def inode_nonce(self, path: bytes) -> Hashable:
+        '''
+        A key that is the same for all the paths of an inode, e.g. for
+        `TraversalIDMaker.next_with_nonce`.  Only meaningful within this
+        `Subvolume` -- unlike `InodeID`, it hides our internals.
+        '''
+        ino_id = self.id_map.get_id(path)
+        if ino_id is None:
+            raise RuntimeError(f'{path} does not exist')
+        return (ino_id.id, id(ino_id.inner_id_map))
+
     def _require_inode_at_path(
-        self, item: SendStreamItem, path: bytes,
+        self, item: SendStreamItem, path: bytes, *, for_write: bool=False,
     ) -> IncompleteInode:
-        ino = self.inode_at_path(path)
-        if ino is None:
+        id = self.id_map.get_id(path)
+        if id is None:
             raise RuntimeError(f'Cannot apply {item}, {path} does not exist')
-        return ino
+        if for_write:
+            # Copies the inode if it may be shared with a snapshot.
+            return get_mut(self.id_to_inode, id, copy.deepcopy)
+        return self.id_to_inode[id]
+
+    def _mark_clone_index_dirty(self, ino_id: InodeID) -> None:
+        if self.clone_index is not None:
+            ino = self.id_to_inode.get(ino_id)
+            if ino is None or isinstance(ino, IncompleteFile):
+                self.clone_index.mark_dirty(ino_id, ino)
 
     def _delete(self, path):
         ino_id = self.id_map.remove_path(path)
         if not self.id_map.get_paths(ino_id):
             del self.id_to_inode[ino_id]
+            self._mark_clone_index_dirty(ino_id)
 
     def apply_item(self, item: SendStreamItem) -> None:
         for item_type, inode_class in _DUMP_ITEM_TO_INCOMPLETE_INODE.items():
@@ -125,7 +186,10 @@ class Subvolume(NamedTuple):
                 else:
                     self.id_map.add_file(ino_id, item.path)
                 assert ino_id not in self.id_to_inode
-                self.id_to_inode[ino_id] = inode_class(item=item)
+                self.id_to_inode[ino_id] = inode_class(
+                    item=item, extent_class=self.extent_class,
+                ) if inode_class is IncompleteFile else inode_class(item=item)
+                self._mark_clone_index_dirty(ino_id)
                 return  # Done applying item
 
         if isinstance(item, SendStreamItems.rename):
@@ -181,18 +245,60 @@ class Subvolume(NamedTuple):
                 raise RuntimeError(f'Cannot {item} a directory')
             self.id_map.add_file(old_id, item.path)
         else:  # Any other operation must be handled at inode scope.
-            ino = self.inode_at_path(item.path)
-            if ino is None:
+            # The most common items, so resolve the path just once.
+            ino_id = self.id_map.get_id(item.path)
+            if ino_id is None:
                 raise RuntimeError(f'Cannot apply {item}, path does not exist')
-            self._require_inode_at_path(item, item.path).apply_item(item=item)
+            # Copies the inode if it may be shared with a snapshot.
+            get_mut(
+                self.id_to_inode, ino_id, copy.deepcopy,
+            ).apply_item(item=item)
+            self._mark_clone_index_dirty(ino_id)
+
+    def apply_batch(self, batch: ItemBatch) -> None:
+        '''
+        Same as `apply_item` on each item of the batch, but sets the inode
+        fields straight from its columns.  Rows that `apply_item` would
+        reject are passed to it as items, so the errors are unchanged.
+        '''
+        item_type = batch.item_type
+        values = batch.values
+        width = batch.width
+        start = 0
+        for i, end in enumerate(batch.path_ends):
+            path = bytes(batch.path_arena[start:end])
+            start = end
+            ino_id = self.id_map.get_id(path)
+            if ino_id is None:
+                self.apply_item(batch.item(i))  # Raises the usual error
+            # Copies the inode if it may be shared with a snapshot.
+            ino = get_mut(self.id_to_inode, ino_id, copy.deepcopy)
+            v = values[i * width:(i + 1) * width]
+            if item_type is SendStreamItems.chmod:
+                if stat.S_IFMT(v[0]) != 0 or \
+                        isinstance(ino, IncompleteSymlink):
+                    self.apply_item(batch.item(i))  # Raises the usual error
+                ino.mode = v[0]
+            elif item_type is SendStreamItems.chown:
+                ino.owner = InodeOwner(uid=v[0], gid=v[1])
+            else:
+                ino.utimes = InodeUtimes(
+                    ctime=(v[0], v[1]), mtime=(v[2], v[3]),
+                    atime=(v[4], v[5]),
+                )
+            self._mark_clone_index_dirty(ino_id)
 
     def apply_clone(
         self, item: SendStreamItems.clone, from_subvol: 'Subvolume',
     ):
         assert isinstance(item, SendStreamItems.clone)
-        return self._require_inode_at_path(item, item.path).apply_clone(
+        ret = self._require_inode_at_path(
+            item, item.path, for_write=True,
+        ).apply_clone(
             item, from_subvol._require_inode_at_path(item, item.from_path),
         )
+        self._mark_clone_index_dirty(self.id_map.get_id(item.path))
+        return ret
 
     # Exposed as a method for the benefit of `SubvolumeSet`.
     def _inode_ids_and_extents(self):
@@ -205,6 +311,7 @@ class Subvolume(NamedTuple):
         *,
         _memo,
         id_to_chunks: Optional[Mapping[InodeID, Sequence['Chunk']]]=None,
+        extent_ids: bool=False,
     ):
         '''
         Returns a recursively immutable copy of `self`, replacing
@@ -212,19 +319,27 @@ class Subvolume(NamedTuple):
         populate them with `Chunk`s instead of `Extent`s.
 
         If `id_to_chunks` is omitted, we'll detect clones only within `self`.
+        Clones are then represented via `Chunk.extent_refs` if `extent_ids`
+        is set, see `extents_to_chunks_with_extent_ids`.
 
         IMPORTANT: Our lookups assume that the `id_to_chunks` has the
         pre-`freeze` variants of the `InodeID`s.
         '''
         if id_to_chunks is None:
-            id_to_chunks = dict(extents_to_chunks_with_clones(
-                list(self._inode_ids_and_extents()),
-            ))
+            id_to_chunks = dict((
+                extents_to_chunks_with_extent_ids if extent_ids
+                    else extents_to_chunks_with_clones
+            )(list(self._inode_ids_and_extents())))
+        id_map = freeze(self.id_map, _memo=_memo)
         return type(self)(
-            id_map=freeze(self.id_map, _memo=_memo),
+            id_map=id_map,
+            # `freeze` memoizes on `id()`, so we bypass it twice here:
+            #  - Our `InodeID`s are made on demand, so their `id()`s get
+            #    reused.
+            #  - Snapshots share inodes, but their `Chunk`s differ.
             id_to_inode=MappingProxyType({
-                freeze(id, _memo=_memo):
-                        freeze(ino, _memo=_memo, chunks=id_to_chunks.get(id))
+                InodeID(id=id.id, inner_id_map=id_map.inner):
+                        ino.freeze(_memo=_memo, chunks=id_to_chunks.get(id))
                     for id, ino in self.id_to_inode.items()
             }),
         )
@@ -252,14 +367,17 @@ class Subvolume(NamedTuple):
         correspondingly get the `Inode` or the `IncompleteInode`.
 
         Hardlinked files will get visited multiple times. The client can
-        alway keep a map keyed on `id(ino)` to handle this.  We purposely do
-        not expose `InodeID`.  A big reason to hide it is that `InodeID`s
-        depend on the sequence of send-stream items that constructed the
-        filesystem.  This is a problem, because one would expect a
-        deterministic traversal to produce the same IDs whenever the
-        underlying filesystem is the same, no matter how it was created.
-        Call `.next_with_nonce(id(ino))` on a `TraversalIDMaker` to
-        synthesize some filesystem-deterministic IDs for your inodes.
+        alway keep a map keyed on `inode_nonce(path)` to handle this.  Do
+        not key on `id(ino)`: `ColumnarInodeStore` makes a new view of the
+        inode on each lookup, so its `id()` differs per visit, and may be
+        reused.  We purposely do not expose `InodeID`.  A big reason to
+        hide it is that `InodeID`s depend on the sequence of send-stream
+        items that constructed the filesystem.  This is a problem, because
+        one would expect a deterministic traversal to produce the same IDs
+        whenever the underlying filesystem is the same, no matter how it
+        was created.  Call `.next_with_nonce(subvol.inode_nonce(path))` on
+        a `TraversalIDMaker` to synthesize some filesystem-deterministic
+        IDs for your inodes.
 
         Advantages over each client implementing the recursive traversal:
          - Iterative client code has simpler data flow.
@@ -285,21 +403,24 @@ class Subvolume(NamedTuple):
 
         See also: `rendered_tree.gather_bottom_up()`
         '''
-        ino_id = self.id_map.get_id(top_path)
-        child_paths = self.id_map.get_children(ino_id)
-        # While I'd love the next code to be a single expression using a
-        # dictionary comprehension, Python does not allow `yield` inside
-        # comprehensions.  See https://stackoverflow.com/questions/32139885
-        if child_paths is None:
-            child_results = None
-        else:
-            child_results = {}
-            for child_path in sorted(child_paths):
-                child_results[os.path.relpath(child_path, top_path)] = (
-                    yield from self.gather_bottom_up(child_path)
-                )
-        return (  # noqa: B901
-            yield (top_path, self.id_to_inode[ino_id], child_results)
+        def list_children(_path, node):
+            norm_path, ino_id = node
+            children = self.id_map.get_sorted_children(ino_id)
+            if children is None:
+                return None
+            prefix = b'' if norm_path == b'.' else norm_path + b'/'
+            return (
+                (name, prefix + name, (prefix + name, child_id))
+                    for name, child_id in children
+            )
+
+        # The nodes are `(normalized path, InodeID)`, since we yield
+        # `top_path` as given.
+        return gather_tree_bottom_up(
+            top_path,
+            (os.path.normpath(top_path), self.id_map.get_id(top_path)),
+            list_children,
+            lambda node: self.id_to_inode[node[1]],
         )
 
     def map_bottom_up(self, fn, top_path=b'.') -> RenderedTree:
@@ -308,11 +429,17 @@ class Subvolume(NamedTuple):
         deterministic order of `gather_bottom_up`.  Returns the results
         assembled into `RenderedTree`.
         '''
+        return self._map_paths_bottom_up(
+            lambda _path, ino: fn(ino), top_path=top_path,
+        )
+
+    def _map_paths_bottom_up(self, fn, top_path=b'.') -> RenderedTree:
+        'Like `map_bottom_up`, but `fn` also takes the path of the inode.'
         with while_not_exited(self.gather_bottom_up(top_path)) as ctx:
             result = None
             while True:
                 path, ino, child_results = ctx.send(result)
-                ret = fn(ino)
+                ret = fn(path, ino)
                 # Observe that this emits `[ret, {}]` for empty dirs to
                 # structurally distinguish them from files.
                 result = [ret] if child_results is None else [ret, {
@@ -321,6 +448,55 @@ class Subvolume(NamedTuple):
                 }]
         return ctx.result
 
+    def map_bottom_up_parallel(
+        self, fn, top_path=b'.', *, max_workers: Optional[int]=None,
+    ) -> RenderedTree:
+        '''
+        Returns the same as `map_bottom_up`, but maps each subtree of
+        `top_path` in a pool of `max_workers` processes (default: one per
+        CPU).  Only for frozen `Subvolume`s, which the workers inherit via
+        `fork`, so `fn` need not be picklable, but its results must be.
+        `fn` should be a pure function of the inode, since the workers do
+        not see each other's side effects.
+
+        Worth it when `fn` is expensive compared to pickling its result,
+        e.g. content hashing.  The subtrees are not split further, so a
+        tree with one huge top-level directory will not speed up.
+        '''
+        return self._map_paths_bottom_up_parallel(
+            lambda _path, ino: fn(ino), top_path, max_workers,
+        )
+
+    def _map_paths_bottom_up_parallel(
+        self, fn, top_path: bytes, max_workers: Optional[int],
+    ) -> RenderedTree:
+        if isinstance(self.id_to_inode, MutableMapping):
+            raise RuntimeError(
+                'map_bottom_up_parallel requires a frozen Subvolume'
+            )
+        top_id = self.id_map.get_id(top_path)
+        children = self.id_map.get_sorted_children(top_id)
+        if children is None:  # Nothing to parallelize for a file
+            return self._map_paths_bottom_up(fn, top_path)
+        norm_path = os.path.normpath(top_path)
+        prefix = b'' if norm_path == b'.' else norm_path + b'/'
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_map_bottom_up_worker,
+            initargs=(self, fn),
+        ) as executor:
+            # `map` returns results in order, so this matches the order of
+            # `gather_bottom_up`, and thus of `_map_paths_bottom_up`.
+            child_results = {
+                name.decode(errors='surrogateescape'): child_result
+                    for (name, _), child_result in zip(children, executor.map(
+                        _map_subtree_in_worker,
+                        [prefix + name for name, _ in children],
+                    ))
+            }
+        return [fn(top_path, self.id_to_inode[top_id]), child_results]
+
     def render(self, top_path=b'.') -> RenderedTree:
         '''
         Produces a JSON-friendly plain-old-data view of the Subvolume.
@@ -329,7 +505,58 @@ class Subvolume(NamedTuple):
         `rendered_tree.py` for more details.
         '''
         id_maker = TraversalIDMaker()
-        return self.map_bottom_up(
-            lambda ino: id_maker.next_with_nonce(id(ino)).wrap(repr(ino)),
-            top_path=top_path,
+
+        def wrap(path, ino):
+            return id_maker.next_with_nonce(
+                self.inode_nonce(path),
+            ).wrap(repr(ino))
+
+        return self._map_paths_bottom_up(wrap, top_path=top_path)
+
+    def render_parallel(
+        self, top_path=b'.', *, max_workers: Optional[int]=None,
+    ) -> RenderedTree:
+        '''
+        Returns the same as `render`, including the traversal IDs, but
+        computes the inode `repr`s via `map_bottom_up_parallel`.
+        '''
+        ser = self._map_paths_bottom_up_parallel(
+            lambda path, ino: (self.id_map.get_id(path).id, repr(ino)),
+            top_path, max_workers,
         )
+        # Make the traversal IDs in the parent process, so they are the
+        # same as from `render`.  The dicts of `ser` are in the order of
+        # `gather_bottom_up` -- we must not re-sort the decoded names.
+        id_maker = TraversalIDMaker()
+        with while_not_exited(gather_tree_bottom_up(
+            None, ser,
+            lambda _path, ser: None if len(ser) == 1 else (
+                (name, None, child_ser)
+                    for name, child_ser in ser[1].items()
+            ),
+            lambda ser: ser[0],
+        )) as ctx:
+            result = None
+            while True:
+                _path, (int_id, ino_repr), child_results = ctx.send(result)
+                ret = id_maker.next_with_nonce(
+                    (int_id, id(self.id_map.inner)),
+                ).wrap(ino_repr)
+                result = [ret] if child_results is None \
+                    else [ret, child_results]
+        return ctx.result
+
+
+# The `Subvolume` & function of a `map_bottom_up_parallel` worker process.
+_worker_subvol_and_fn = None
+
+
+def _init_map_bottom_up_worker(subvol: Subvolume, fn) -> None:
+    global _worker_subvol_and_fn
+    _worker_subvol_and_fn = (subvol, fn)
+
+
+def _map_subtree_in_worker(path: bytes) -> RenderedTree:
+    'Runs in a `map_bottom_up_parallel` worker process.'
+    subvol, fn = _worker_subvol_and_fn
+    return subvol._map_paths_bottom_up(fn, top_path=path)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+'''
+`diff_subvolumes` compares two `Subvolume`s path by path, without rendering
+them.  It walks both directory trees together via their `InodeIDMap`s, and
+yields a `PathDiff` for each path that was added, removed, or whose inode
+changed.
+
+Inodes are compared by their metadata, and by their data, which we only
+model as a sequence of extents:
+  - Un-frozen files have the same data if they consist of the same
+    `Extent` objects, like `extents_to_chunks` assumes for clones.  Thus,
+    any write is a change, but files from different `SubvolumeSet`s never
+    have the same data, so compare those frozen.
+  - Frozen files only keep the kinds & lengths of their `Chunk`s, so a
+    write that keeps those is not detected.  We ignore the clone
+    annotations, since those name inodes in specific subvolumes, and so
+    differ between subvolumes even for unchanged files.
+
+For a snapshot and its parent, or two snapshots of a common ancestor,
+we skip the unchanged subtrees altogether.  Un-frozen snapshots share the
+nodes of their `PersistentIntMap`s until they modify them, so
+`PersistentIntMap.diff_keys` finds the few inodes & directories that
+changed in time proportional to the changes.  Only their ancestors need
+to be visited.  Freezing flattens those maps, so frozen subvolumes (or
+ones with a `ColumnarInodeStore`) get a full walk, comparing each inode.
+'''
+import enum
+import itertools
+import os
+
+from typing import Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+from .extent import Extent
+from .incomplete_inode import IncompleteInode
+from .inode import Chunk, Inode
+from .inode_store import PersistentInodeStore
+from .persistent_map import PersistentIntMap
+from .subvolume import Subvolume
+
+
+class DiffKind(enum.Enum):
+    ADDED = 'added'
+    REMOVED = 'removed'
+    CHANGED = 'changed'
+
+
+class PathDiff(NamedTuple):
+    kind: DiffKind
+    path: bytes
+    # `None` if the path is `ADDED` or `REMOVED`, respectively.
+    old: Optional[Union[Inode, IncompleteInode]]
+    new: Optional[Union[Inode, IncompleteInode]]
+
+
+def _content_repr(ino: Union[Inode, IncompleteInode]) -> str:
+    'The `repr` of the inode, without the clone annotations of `Chunk`s.'
+    if isinstance(ino, Inode) and ino.chunks:
+        # Clones also split chunks, so merge them back like
+        # `IncompleteFile.__repr__` does.
+        ino = ino._replace(chunks=tuple(
+            Chunk(
+                kind=kind,
+                length=sum(c.length for c in chunks),
+                chunk_clones=(),
+            ) for kind, chunks in itertools.groupby(
+                ino.chunks, lambda c: c.kind,
+            )
+        ))
+    return repr(ino)
+
+
+def _leaves(extent: Extent) -> List[Tuple[int, int, int]]:
+    return [
+        (offset, length, id(leaf))
+            for offset, length, leaf in extent.gen_trimmed_leaves()
+    ]
+
+
+def _same_inode(
+    old_ino: Union[Inode, IncompleteInode],
+    new_ino: Union[Inode, IncompleteInode],
+) -> bool:
+    if old_ino is new_ino:
+        return True
+    if _content_repr(old_ino) != _content_repr(new_ino):
+        return False
+    # Only un-frozen files still have their `Extent`s.
+    old_extent = getattr(old_ino, 'extent', None)
+    new_extent = getattr(new_ino, 'extent', None)
+    if old_extent is None or new_extent is None or old_extent is new_extent:
+        return True
+    return _leaves(old_extent) == _leaves(new_extent)
+
+
+def _changed_int_ids(old: Subvolume, new: Subvolume) -> Optional[Set[int]]:
+    '''
+    Returns the `InodeID.id`s whose inodes, directory entries, or
+    descendants may differ between the subvolumes.  Since snapshots keep
+    their parent's int IDs, the others are identical in both.  Returns
+    `None` unless both subvolumes use persistent maps.
+    '''
+    if not all(
+        isinstance(sv.id_map.id_to_children, PersistentIntMap)
+            and isinstance(sv.id_to_inode, PersistentInodeStore)
+                for sv in (old, new)
+    ):
+        return None
+    differing = list(itertools.chain(
+        old.id_map.id_to_children.diff_keys(new.id_map.id_to_children),
+        old.id_to_inode.diff_int_ids(new.id_to_inode),
+    ))
+    changed = set()
+    for id_map in (old.id_map, new.id_map):
+        id_to_reverse_entries = id_map.inner.id_to_reverse_entries
+        visited = set()
+        todo = list(differing)
+        # Also mark the ancestors in this map.  Hardlinks have several.
+        while todo:
+            int_id = todo.pop()
+            if int_id in visited:
+                continue
+            visited.add(int_id)
+            todo.extend(
+                rev_entry.parent_int_id
+                    for rev_entry in id_to_reverse_entries.get(int_id, ())
+                        if rev_entry.parent_int_id is not None
+            )
+        changed |= visited
+    return changed
+
+
+def diff_subvolumes(
+    old: Subvolume, new: Subvolume, top_path: bytes=b'.',
+) -> Iterator[PathDiff]:
+    '''
+    Yields the differences under `top_path`, in the pre-order of a walk
+    visiting directory entries in sorted order.  When a directory is added
+    or removed, so is each path under it.  When a path changes type, it
+    is `CHANGED`, and its directory entries are added or removed.
+    '''
+    changed_int_ids = _changed_int_ids(old, new)
+    stack = [(
+        os.path.normpath(top_path),
+        old.id_map.get_id(top_path),
+        new.id_map.get_id(top_path),
+    )]
+    while stack:
+        path, old_id, new_id = stack.pop()
+        if old_id is None and new_id is None:
+            continue  # Only happens for a missing `top_path`
+        if (
+            changed_int_ids is not None and old_id is not None
+            and new_id is not None and old_id.id == new_id.id
+            and old_id.id not in changed_int_ids
+        ):
+            continue  # The whole subtree is unchanged.
+
+        old_ino = None if old_id is None else old.id_to_inode[old_id]
+        new_ino = None if new_id is None else new.id_to_inode[new_id]
+        if old_ino is None:
+            yield PathDiff(
+                kind=DiffKind.ADDED, path=path, old=None, new=new_ino,
+            )
+        elif new_ino is None:
+            yield PathDiff(
+                kind=DiffKind.REMOVED, path=path, old=old_ino, new=None,
+            )
+        elif not _same_inode(old_ino, new_ino):
+            yield PathDiff(
+                kind=DiffKind.CHANGED, path=path, old=old_ino, new=new_ino,
+            )
+
+        old_children = {} if old_id is None \
+            else dict(old.id_map.get_sorted_children(old_id) or ())
+        new_children = {} if new_id is None \
+            else dict(new.id_map.get_sorted_children(new_id) or ())
+        prefix = b'' if path == b'.' else path + b'/'
+        names = sorted(old_children.keys() | new_children.keys())
+        for name in reversed(names):
+            stack.append((
+                prefix + name, old_children.get(name), new_children.get(name),
+            ))
@@ -9,7 +9,6 @@ directory tree the way they would be in a real btrfs filesystem.  This is
 not done here simply because we don't have a need to model it, but you can
 easily imagine a path-aware `Volume` abstraction on top of this.
 '''
-import copy
 import itertools
 
 from collections import Counter
@@ -18,10 +17,15 @@ from types import MappingProxyType
 # and avoid `deepcopy`.
 from typing import Iterator, Mapping, NamedTuple, Optional, Union
 
-from .extents_to_chunks import extents_to_chunks_with_clones
+from .clone_index import CloneIndex
+from .extent import Extent
+from .extents_to_chunks import (
+    extents_to_chunks_with_clones, extents_to_chunks_with_extent_ids,
+)
 from .freeze import freeze
+from .incomplete_inode import IncompleteFile
 from .inode_id import InodeIDMap
-from .send_stream import SendStreamItem, SendStreamItems
+from .send_stream import ItemBatch, SendStreamItem, SendStreamItems
 from .subvolume import Subvolume
 from .rendered_tree import RenderedTree
 
@@ -62,9 +66,9 @@ class SubvolumeDescription(NamedTuple):
     IMPORTANT: Because of our `.name_uuid_prefix_counts` member, which is
     owned by a `SubvolumeSet`, this object would ONLY be safely
     `deepcopy`able if we were to copy the `SubvolumeSet` in one call -- but
-    we never do that.  When we make snapshots in `SubvolumeSetMutator`, we
-    have to work around this problem, since a naive implementation would
-    `deepcopy` this object via `Subvolume.id_map.description`.
+    we never do that.  This is why `SubvolumeSetMutator` makes snapshots
+    via `Subvolume.snapshot`, which replaces the description, rather than
+    via `deepcopy`.
     '''
     name: bytes
     id: SubvolumeID
@@ -95,6 +99,10 @@ class SubvolumeSet(NamedTuple):
     # each possible length of prefix (from 0 to `len(uuid)`).  When the name
     # is unique, `@uuid_prefix` is omitted (aka prefix length 0).
     name_uuid_prefix_counts: Mapping[str, int]
+    # If set, this index tracks the clones among the files of all our
+    # `Subvolume`s as they are mutated, making `freeze` incremental.
+    # Irrelevant once frozen.
+    clone_index: Optional[CloneIndex] = None
 
     @classmethod
     def new(cls, **kwargs) -> 'SubvolumeSet':
@@ -108,19 +116,33 @@ class SubvolumeSet(NamedTuple):
                 return subvol
         return None
 
-    def freeze(self, *, _memo) -> 'SubvolumeSet':
+    def freeze(self, *, _memo, extent_ids: bool=False) -> 'SubvolumeSet':
         '''
         Return a recursively immutable copy of `self`, replacing all
         `IncompleteInode`s by `Inode`s, and checking that all inode metadata
         are populated.  Correctly resolving cloned extents has to happen at
         the level of the `SubvolumeSet`.
+
+        With many snapshots sharing data, set `extent_ids` to get linear-
+        size `Chunk.extent_refs` instead of quadratic `Chunk.chunk_clones`.
+        `extent_ids_to_chunk_clones` can convert these back.
+
+        With a `clone_index`, `Chunk.chunk_clones` are only recomputed for
+        the files that changed since the last `freeze`, and their peers.
         '''
-        id_to_chunks = dict(extents_to_chunks_with_clones(
-            list(itertools.chain.from_iterable(
-                subvol._inode_ids_and_extents()
-                    for subvol in self.uuid_to_subvolume.values()
-            ))
+        ids_and_extents = list(itertools.chain.from_iterable(
+            subvol._inode_ids_and_extents()
+                for subvol in self.uuid_to_subvolume.values()
         ))
+        if self.clone_index is not None and not extent_ids:
+            id_to_chunks = self.clone_index.id_to_chunks(
+                id for id, _ in ids_and_extents
+            )
+        else:
+            id_to_chunks = dict((
+                extents_to_chunks_with_extent_ids if extent_ids
+                    else extents_to_chunks_with_clones
+            )(ids_and_extents))
         return type(self)(
             uuid_to_subvolume=MappingProxyType({
                 uuid: freeze(subvol, _memo=_memo, id_to_chunks=id_to_chunks)
@@ -168,7 +190,12 @@ class SubvolumeSetMutator(NamedTuple):
     @classmethod
     def new(
         cls, subvol_set: SubvolumeSet, subvol_item: SendStreamItem,
+        *, extent_class: Optional[type]=None,
     ) -> 'SubvolumeSetMutator':
+        '''
+        `extent_class` sets `Subvolume.extent_class` for a new subvolume.
+        Snapshots inherit it from their parent, unless it is specified.
+        '''
         if not isinstance(subvol_item, (
             SendStreamItems.subvol, SendStreamItems.snapshot,
         )):
@@ -187,21 +214,16 @@ class SubvolumeSetMutator(NamedTuple):
         )
         if isinstance(subvol_item, SendStreamItems.snapshot):
             parent_subvol = subvol_set.uuid_to_subvolume[parent_id.uuid]
-            # `SubvolumeDescription` references a part `SubvolumeSet`, so it
-            # is not correctly `deepcopy`able as part of a `Subvolume`.  And
-            # we want to modify the `InodeIDMap`'s `description` in any
-            # case, so let's just bulk-replace the old description instance.
-            # This would not be sane if the old instance were of a type that
-            # may be interned by the runtime, like `int`, hence the assert.
-            assert isinstance(
-                parent_subvol.id_map.inner.description, SubvolumeDescription
-            )
-            subvol = copy.deepcopy(parent_subvol, memo={
-                id(parent_subvol.id_map.inner.description): description,
-            })
+            # O(1), the snapshot shares its data with the parent.  It also
+            # shares the `clone_index`, but its files must be added to it.
+            subvol = parent_subvol.snapshot(description=description)
+            if extent_class is not None:
+                subvol = subvol._replace(extent_class=extent_class)
         else:
             subvol = Subvolume.new(
                 id_map=InodeIDMap.new(description=description),
+                extent_class=extent_class or Extent,
+                clone_index=subvol_set.clone_index,
             )
 
         dup_subvol = subvol_set.uuid_to_subvolume.get(my_id.uuid)
@@ -209,7 +231,12 @@ class SubvolumeSetMutator(NamedTuple):
             raise RuntimeError(f'{my_id} is already in use: {dup_subvol}')
         subvol_set.uuid_to_subvolume[my_id.uuid] = subvol
 
-        # insertion can fail, so update the description disambiguator last.
+        # insertion can fail, so update the `clone_index` and the
+        # description disambiguator last.
+        if parent_id is not None and subvol_set.clone_index is not None:
+            for ino_id, ino in subvol.id_to_inode.items():
+                if isinstance(ino, IncompleteFile):
+                    subvol_set.clone_index.mark_dirty(ino_id, ino)
         subvol_set.name_uuid_prefix_counts.update(
             description.name_uuid_prefixes()
         )
@@ -225,3 +252,6 @@ class SubvolumeSetMutator(NamedTuple):
                 raise RuntimeError(f'Unknown from_uuid for {item}')
             return self.subvolume.apply_clone(item, from_subvol)
         return self.subvolume.apply_item(item)
+
+    def apply_batch(self, batch: ItemBatch):
+        return self.subvolume.apply_batch(batch)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+'''
+Applying a chain of send-streams to a `SubvolumeSet` is slow, and we keep
+doing it for the same parent layers while only the last, child send-stream
+changes.  `SubvolumeSetCache` stores the `SubvolumeSet` state after each
+send-stream in a directory, so that the next run only parses & applies
+the send-streams after the longest cached prefix of the chain.  The
+snapshot item of the next send-stream then finds its parent in the loaded
+`SubvolumeSet`, like it would in a fresh one.
+
+A state depends on every send-stream applied so far, so the key of the
+state after send-stream `i` hashes the key of state `i - 1` together with
+the content hash of send-stream `i`.  It also depends on how the
+send-streams were parsed -- e.g. `parse_send_stream(keep_data=False)`
+yields `update_extent` where a full parse yields `write` -- so the first
+key hashes the caller's `parse_key`, which must name the `parse` function
+and any of its options that change the items.
+
+Entries are `pickle`s of the unfrozen `SubvolumeSet`, in the highest
+protocol.  Those keep the structure that snapshots share, and are fast to
+load straight from an `mmap` of the file.  The cache evicts the least
+recently used entries, by mtime, once their total size exceeds
+`max_bytes`.  Writes are atomic, so concurrent users of the same directory
+may redo some work, but they never read partial entries.
+
+SECURITY: Loading an entry unpickles it, which can run arbitrary code.
+Anyone who can write to the cache directory can therefore run code as
+its users, so we refuse directories that are not owned by the current
+user, or that are writable by the group or others.  Only share a cache
+directory between processes of the same user.
+
+Entries are only valid for the code that wrote them, so bump
+`_FORMAT_VERSION` whenever the layout of the pickled classes changes.  An
+entry that fails to load is deleted & treated as a miss.
+'''
+import hashlib
+import io
+import mmap
+import os
+import pickle
+import stat
+import tempfile
+
+from typing import BinaryIO, Callable, Iterator, Optional, Sequence, Tuple
+
+from .parse_dump import SendStreamItem
+from .subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+_FORMAT_VERSION = 'v2'
+_SUFFIX = '.subvolume_set'
+
+
+def _hash_and_rewind(infile: BinaryIO) -> Tuple[str, BinaryIO]:
+    '''
+    Returns the content hash of the send-stream, and a file to parse it
+    from.  Non-seekable inputs, like pipes, get buffered in RAM.
+    '''
+    if not infile.seekable():
+        data = infile.read()
+        return hashlib.sha256(data).hexdigest(), io.BytesIO(data)
+    infile.seek(0)
+    h = hashlib.sha256()
+    for chunk in iter(lambda: infile.read(2 ** 20), b''):
+        h.update(chunk)
+    infile.seek(0)
+    return h.hexdigest(), infile
+
+
+class SubvolumeSetCache:
+    'See the module docblock.'
+
+    def __init__(self, cache_dir: str, *, max_bytes: int):
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        st = os.stat(cache_dir)
+        if st.st_uid != os.geteuid() or \
+                st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise RuntimeError(
+                f'Cache directory {cache_dir} must be owned by UID '
+                f'{os.geteuid()}, and not writable by others: {st}'
+            )
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + _SUFFIX)
+
+    def get(self, key: str) -> Optional[SubvolumeSet]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ,
+            ) as m:
+                subvols = pickle.loads(m)
+            # Mark the entry as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:  # A corrupt or stale entry
+            self._remove(path)
+            return None
+        assert isinstance(subvols, SubvolumeSet), (path, type(subvols))
+        return subvols
+
+    def put(self, key: str, subvols: SubvolumeSet) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(subvols, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        self._evict()
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:  # Another user of the cache removed it.
+            pass
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(_SUFFIX):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:  # Another user of the cache removed it.
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    def apply_sendstreams(
+        self,
+        infiles: Sequence[BinaryIO],
+        parse: Callable[[BinaryIO], Iterator[SendStreamItem]],
+        *, parse_key: str,
+    ) -> SubvolumeSet:
+        '''
+        Returns a `SubvolumeSet` with the send-streams in `infiles` applied
+        from left to right, caching the state after each one.  `parse`
+        turns a file, positioned at its start, into send-stream items.  We
+        only call it for the send-streams after the longest cached prefix.
+
+        `parse_key` must differ between `parse` functions that may yield
+        different items for the same send-stream, see the module docblock.
+        '''
+        keys = []
+        key = hashlib.sha256(
+            f'{_FORMAT_VERSION}:{parse_key}'.encode()
+        ).hexdigest()
+        to_parse = []
+        for infile in infiles:
+            sendstream_hash, infile = _hash_and_rewind(infile)
+            key = hashlib.sha256(
+                f'{key}:{sendstream_hash}'.encode()
+            ).hexdigest()
+            keys.append(key)
+            to_parse.append(infile)
+
+        subvols = None
+        num_cached = len(keys)
+        while subvols is None and num_cached > 0:
+            subvols = self.get(keys[num_cached - 1])
+            if subvols is None:
+                num_cached -= 1
+        if subvols is None:
+            subvols = SubvolumeSet.new()
+
+        for infile, key in zip(to_parse[num_cached:], keys[num_cached:]):
+            parsed = parse(infile)
+            mutator = SubvolumeSetMutator.new(subvols, next(parsed))
+            for item in parsed:
+                mutator.apply_item(item)
+            self.put(key, subvols)
+        return subvols
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+    python3 -m btrfs_diff.tests.benchmark_extent [--writes N]
+
+Times `Extent` against `IntervalExtent` on a file made of `--writes` small
+writes, as `btrfs send` emits for a large file.  We time the writes, and
+one flattening via `gen_trimmed_leaves`.  The writes either append, or go
+to random offsets within the file.
+
+Every write deepens the history tree of `Extent`, so its flattening runs
+out of stack at around 1000 writes -- we report that as a failure.
+'''
+import argparse
+import random
+import time
+
+from ..extent import Extent
+from ..interval_extent import IntervalExtent
+
+_WRITE_SIZE = 4096
+
+
+def _time_writes_and_flatten(extent_class, offsets):
+    start = time.monotonic()
+    extent = extent_class.empty()
+    for offset in offsets:
+        extent = extent.write(offset=offset, length=_WRITE_SIZE)
+    mid = time.monotonic()
+    try:
+        num_leaves = sum(1 for _ in extent.gen_trimmed_leaves())
+    except RecursionError:
+        return mid - start, None, None
+    return mid - start, time.monotonic() - mid, num_leaves
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument('--writes', type=int, default=10 ** 5)
+    args = p.parse_args(argv)
+
+    rnd = random.Random(0)
+    for desc, offsets in [
+        ('append', [i * _WRITE_SIZE for i in range(args.writes)]),
+        ('random', [
+            rnd.randrange(args.writes) * _WRITE_SIZE // 2
+                for _ in range(args.writes)
+        ]),
+    ]:
+        print(f'{args.writes} writes, {desc}:')
+        for extent_class in (Extent, IntervalExtent):
+            write_s, flatten_s, num_leaves = \
+                _time_writes_and_flatten(extent_class, offsets)
+            flatten = 'RecursionError' if flatten_s is None \
+                else f'{flatten_s:.3f}s to flatten {num_leaves} leaves'
+            print(f'  {extent_class.__name__:<15} {write_s:.3f}s to write, '
+                  f'{flatten}')
+
+
+if __name__ == '__main__':
+    main()
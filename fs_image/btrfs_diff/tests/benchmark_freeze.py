@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+    python3 -m btrfs_diff.tests.benchmark_freeze \\
+        [--files N] [--snapshots N] [--repeat N]
+
+Builds a `SubvolumeSet` holding a subvolume of `--files` files, each with
+an xattr and some data, every tenth of which is cloned into a new file,
+plus a chain of `--snapshots` snapshots, each changing 1% of the files.
+Reports the best time of `--repeat` runs of `SubvolumeSet.freeze`, with
+each clone representation.
+'''
+import argparse
+import time
+
+from ..freeze import freeze
+from ..parse_dump import SendStreamItems
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+si = SendStreamItems
+
+
+def _path(i: int) -> bytes:
+    return b'd%d/f%d' % (i // 100, i)
+
+
+def _make_subvols(num_files: int, num_snapshots: int) -> SubvolumeSet:
+    subvols = SubvolumeSet.new()
+    mutator = SubvolumeSetMutator.new(
+        subvols, si.subvol(path=b'base', uuid=b'u0', transid=1),
+    )
+    for d in range(num_files // 100 + 1):
+        mutator.apply_item(si.mkdir(path=b'd%d' % d))
+    for i in range(num_files):
+        mutator.apply_item(si.mkfile(path=_path(i)))
+        mutator.apply_item(si.write(path=_path(i), offset=0, data=b'x' * 9))
+        mutator.apply_item(
+            si.set_xattr(path=_path(i), name=b'user.i', data=b'%d' % i),
+        )
+        if i % 10 == 9:
+            mutator.apply_item(si.mkfile(path=_path(i) + b'c'))
+            mutator.apply_item(si.clone(
+                path=_path(i) + b'c', offset=0, len=5, from_uuid=b'u0',
+                from_transid=1, from_path=_path(i), clone_offset=2,
+            ))
+    for s in range(1, num_snapshots + 1):
+        mutator = SubvolumeSetMutator.new(subvols, si.snapshot(
+            path=b'snap%d' % s, uuid=b'u%d' % s, transid=1,
+            parent_uuid=b'u%d' % (s - 1), parent_transid=1,
+        ))
+        for i in range(s % 100, num_files, 100):
+            mutator.apply_item(si.write(path=_path(i), offset=3, data=b'y'))
+    return subvols
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument('--files', type=int, default=10000)
+    p.add_argument('--snapshots', type=int, default=5)
+    p.add_argument('--repeat', type=int, default=3)
+    args = p.parse_args(argv)
+
+    subvols = _make_subvols(args.files, args.snapshots)
+    print(f'{args.snapshots} snapshots of {args.files} files:')
+    for extent_ids in [False, True]:
+        durations = []
+        for _ in range(args.repeat):
+            start = time.monotonic()
+            freeze(subvols, extent_ids=extent_ids)
+            durations.append(time.monotonic() - start)
+        print(f'  extent_ids={extent_ids!s:<5} {min(durations):.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+    python3 -m btrfs_diff.tests.benchmark_gather_bottom_up \\
+        [--entries N] [--levels N]
+
+Builds a synthetic tree of about `--entries` files, each at depth
+`--levels`, both as a `Subvolume` and as a `RenderedTree`.  Reports the
+time to traverse each with its `gather_bottom_up`, and to traverse the
+`RenderedTree` with the recursive `yield from` traversal that
+`gather_tree_bottom_up` replaced.
+
+At the default 10 levels, the two `RenderedTree` traversals are about as
+fast.  Each `send` to the recursive one costs O(depth), so it falls behind
+on deep trees, e.g. `--entries 1 --levels 900` makes a single chain, and
+it fails outright past the recursion limit.
+'''
+import argparse
+import time
+
+from ..coroutine_utils import while_not_exited
+from ..inode_id import InodeIDMap
+from ..parse_dump import SendStreamItems
+from ..rendered_tree import gather_bottom_up
+from ..subvolume import Subvolume
+
+si = SendStreamItems
+
+
+def _recursive_gather_bottom_up(ser, path='.'):
+    '''
+    The traversal that `rendered_tree.gather_bottom_up` used to do, minus
+    the input checks, and with the same path concatenation as the current
+    one, so that only the cost of the `yield from` chain differs.
+    '''
+    if len(ser) == 1:
+        return (yield path, ser[0], None)
+    child_results = {}
+    prefix = '' if path == '.' else path + '/'
+    for name, child_ser in sorted(ser[1].items()):
+        child_results[name] = yield from _recursive_gather_bottom_up(
+            child_ser, prefix + name,
+        )
+    return (yield (path, ser[0], child_results))  # noqa: B901
+
+
+def _make_trees(fanout: int, levels: int):
+    subvol = Subvolume.new(id_map=InodeIDMap.new(description='bench'))
+    ser = ['(Dir)', {}]
+
+    def add(path, parent_ser, level):
+        for i in range(fanout):
+            name = b'%d' % i
+            child_path = name if path == b'.' else path + b'/' + name
+            if level == levels:
+                subvol.apply_item(si.mkfile(path=child_path))
+                parent_ser[1][name.decode()] = ['(File)']
+            else:
+                subvol.apply_item(si.mkdir(path=child_path))
+                child_ser = parent_ser[1][name.decode()] = ['(Dir)', {}]
+                add(child_path, child_ser, level + 1)
+
+    add(b'.', ser, 1)
+    return subvol, ser
+
+
+def _time_traversal(coroutine):
+    start = time.monotonic()
+    with while_not_exited(coroutine) as ctx:
+        result = None
+        while True:
+            _path, _ino, child_results = ctx.send(result)
+            result = 1 if child_results is None \
+                else 1 + sum(child_results.values())
+    return time.monotonic() - start, ctx.result
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument('--entries', type=int, default=10 ** 6)
+    p.add_argument('--levels', type=int, default=10)
+    args = p.parse_args(argv)
+
+    fanout = max(1, round(args.entries ** (1 / args.levels)))
+    subvol, ser = _make_trees(fanout, args.levels)
+    for desc, coroutine in [
+        ('Subvolume', subvol.gather_bottom_up()),
+        ('RenderedTree', gather_bottom_up(ser)),
+        ('RenderedTree, recursive', _recursive_gather_bottom_up(ser)),
+    ]:
+        duration, num_entries = _time_traversal(coroutine)
+        print(f'{desc:<24} {num_entries} entries: {duration:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
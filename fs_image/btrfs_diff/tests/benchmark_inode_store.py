@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+    python3 -m btrfs_diff.tests.benchmark_inode_store [--inodes N] [--memory]
+
+Applies a synthetic send-stream that makes `--inodes` files, 1000 per
+directory, and sets their owner, mode & times, as `btrfs send` does.
+Reports the time taken with each kind of `id_to_inode` store.
+
+With `--memory`, also reports the memory taken by the resulting
+`Subvolume`.  The `InodeIDMap` is the same for both, so the difference in
+memory is due to the store.  This runs under `tracemalloc`, which is
+several times slower, so use fewer `--inodes`.
+'''
+import argparse
+import gc
+import time
+import tracemalloc
+
+from ..inode_id import InodeIDMap
+from ..inode_store import ColumnarInodeStore, PersistentInodeStore
+from ..parse_dump import SendStreamItems
+from ..subvolume import Subvolume
+
+si = SendStreamItems
+_FILES_PER_DIR = 1000
+
+
+def _gen_items(num_inodes: int):
+    for i in range(num_inodes):
+        if i % _FILES_PER_DIR == 0:
+            dir_path = b'd%d' % (i // _FILES_PER_DIR)
+            yield si.mkdir(path=dir_path)
+        path = b'%s/f%d' % (dir_path, i)
+        yield si.mkfile(path=path)
+        yield si.chown(path=path, uid=0, gid=0)
+        yield si.chmod(path=path, mode=0o644)
+        yield si.utimes(
+            path=path, ctime=(i, 0), mtime=(i, 1), atime=(i, 2),
+        )
+
+
+def _measure(store_class, num_inodes: int, trace_memory: bool):
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.monotonic()
+    id_map = InodeIDMap.new(description='bench')
+    subvol = Subvolume.new(
+        id_map=id_map, id_to_inode=store_class(id_map.inner),
+    )
+    for item in _gen_items(num_inodes):
+        subvol.apply_item(item)
+    duration = time.monotonic() - start
+    if not trace_memory:
+        return duration, None
+    cur, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, cur
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument('--inodes', type=int, default=10 ** 5)
+    p.add_argument('--memory', action='store_true')
+    args = p.parse_args(argv)
+
+    print(f'{args.inodes} inodes:')
+    for store_class in (PersistentInodeStore, ColumnarInodeStore):
+        duration, mem = _measure(store_class, args.inodes, args.memory)
+        print(
+            f'  {store_class.__name__:<22} {duration:.3f}s' +
+            ('' if mem is None else f', {mem / 2 ** 20:.1f} MiB')
+        )
+
+
+if __name__ == '__main__':
+    main()
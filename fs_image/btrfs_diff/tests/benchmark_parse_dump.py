@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+    python3 -m btrfs_diff.tests.benchmark_parse_dump [--lines N]
+
+Times `parse_btrfs_dump` on a synthetic `btrfs receive --dump` output of
+about `--lines` lines.  It is made by repeating the body of the gold
+`create_ops` dump, so, like in real image builds, the same few timestamps
+occur over and over.
+
+For comparison, it also times a variant of that dump in which every
+timestamp is distinct.  Those all miss the `strptime` cache, whatever ran
+before, so the difference between the two runs is what the cache saves.
+'''
+import argparse
+import datetime
+import io
+import itertools
+import re
+import time
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+from ..parse_dump import parse_btrfs_dump
+
+_TIMESTAMP_RE = re.compile(rb'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d[-+]\d{4}')
+
+
+def make_synthetic_dump(num_lines: int, distinct_times: bool=False) -> bytes:
+    subvol_line, *body = gold_demo_sendstreams()['create_ops']['dump']
+    repeat = max(1, num_lines // len(body))
+    dump = b'\n'.join(body * repeat) + b'\n'
+    if distinct_times:
+        seconds = itertools.count()
+        epoch = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc)
+        dump = _TIMESTAMP_RE.sub(lambda _m: (
+            epoch + datetime.timedelta(seconds=next(seconds))
+        ).strftime('%Y-%m-%dT%H:%M:%S%z').encode(), dump)
+    return subvol_line + b'\n' + dump
+
+
+def _time_parse(dump: bytes) -> float:
+    start = time.monotonic()
+    for _ in parse_btrfs_dump(io.BytesIO(dump)):
+        pass
+    return time.monotonic() - start
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument('--lines', type=int, default=10 ** 6)
+    args = p.parse_args(argv)
+
+    for desc, distinct_times in [
+        ('repeated timestamps', False),
+        ('distinct timestamps', True),
+    ]:
+        dump = make_synthetic_dump(args.lines, distinct_times)
+        num_lines = dump.count(b'\n')
+        seconds = _time_parse(dump)
+        print(
+            f'{desc}: {num_lines} lines in {seconds:.2f}s, '
+            f'{num_lines / seconds:.0f} lines/s'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+    python3 -m btrfs_diff.tests.benchmark_parse_send_stream [--repeat N]
+
+Compares the default send-stream parser with `zero_copy=True` on the gold
+demo send-streams.  Since those are small, the commands of each stream
+(other than the leading `subvol` / `snapshot`, and `END`) are repeated
+`--repeat` times to make a larger, still-parseable stream.  The zero-copy
+parser is timed both on an in-memory `BytesIO` (block reads), and on a
+regular file (`mmap`).
+
+To help decide whether to enable `check_crc=True`, we also time parses
+with CRC verification (with and without `WRITE` commands), as well as the
+raw throughput of our `crc32c`.
+
+Lastly, `parse_send_stream_parallel` is timed with `--jobs` processes.
+'''
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+from ..crc32c import crc32c
+from ..parse_send_stream import (
+    BTRFS_SEND_STREAM_MAGIC, CommandHeader, CommandKind, parse_send_stream,
+    parse_send_stream_parallel,
+)
+
+
+def repeat_sendstream_commands(sendstream: bytes, repeat: int) -> bytes:
+    '''
+    Returns a send-stream whose body commands are those of `sendstream`,
+    repeated `repeat` times.  The result is not a valid filesystem, but it
+    is a valid input for the parser.
+    '''
+    infile = io.BytesIO(sendstream)
+    header = infile.read(len(BTRFS_SEND_STREAM_MAGIC) + 4)  # magic, version
+    commands = []
+    while True:
+        start = infile.tell()
+        cmd_header = CommandHeader.from_file(infile)
+        infile.seek(cmd_header.length, io.SEEK_CUR)
+        commands.append(sendstream[start:infile.tell()])
+        if cmd_header.kind == CommandKind.END:
+            break
+    first, *body, end = commands
+    return header + first + b''.join(body) * repeat + end
+
+
+def _time_parse(sendstream: bytes, **kwargs) -> float:
+    start = time.monotonic()
+    for _ in parse_send_stream(io.BytesIO(sendstream), **kwargs):
+        pass
+    return time.monotonic() - start
+
+
+def _time_parse_file(sendstream: bytes, **kwargs) -> float:
+    with tempfile.TemporaryFile() as f:
+        f.write(sendstream)
+        f.seek(0)
+        start = time.monotonic()
+        for _ in parse_send_stream(f, **kwargs):
+            pass
+        return time.monotonic() - start
+
+
+def _time_parse_parallel(sendstream: bytes, **kwargs) -> float:
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(sendstream)
+        f.flush()
+        start = time.monotonic()
+        for _ in parse_send_stream_parallel(f.name, **kwargs):
+            pass
+        return time.monotonic() - start
+
+
+def _time_crc32c(sendstream: bytes) -> float:
+    start = time.monotonic()
+    crc32c(sendstream)
+    return time.monotonic() - start
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument('--repeat', type=int, default=200)
+    p.add_argument('--jobs', type=int, default=os.cpu_count())
+    args = p.parse_args(argv)
+
+    for name, d in sorted(gold_demo_sendstreams().items()):
+        sendstream = repeat_sendstream_commands(d['sendstream'], args.repeat)
+        mb = len(sendstream) / 2 ** 20
+        print(f'{name}: {mb:.1f} MiB')
+        for desc, seconds in [
+            ('default', _time_parse(sendstream)),
+            ('zero_copy, BytesIO', _time_parse(sendstream, zero_copy=True)),
+            ('zero_copy, mmap', _time_parse_file(sendstream, zero_copy=True)),
+            ('zero_copy, CRC', _time_parse(
+                sendstream, zero_copy=True, check_crc=True,
+            )),
+            ('zero_copy, CRC-WRITE', _time_parse(
+                sendstream, zero_copy=True, check_crc=True,
+                crc_skip_kinds={CommandKind.WRITE},
+            )),
+            ('crc32c only', _time_crc32c(sendstream)),
+            (f'parallel, {args.jobs} jobs', _time_parse_parallel(
+                sendstream, max_workers=args.jobs,
+            )),
+        ]:
+            print(f'  {desc:<20} {seconds:8.3f}s {mb / seconds:10.1f} MiB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''
+Usage:
+
+    python3 -m btrfs_diff.tests.benchmark_snapshot_chain \\
+        [--files N] [--snapshots N] [--changes N]
+
+Builds a subvolume of `--files` files, followed by a chain of `--snapshots`
+snapshots, each modifying `--changes` files of its parent, as a chain of
+incremental send-streams would.  Reports the time & memory taken by the
+chain with `Subvolume.snapshot`, and with the `deepcopy` it replaced.
+The former should be proportional to the changes, not to the file count.
+'''
+import argparse
+import copy
+import random
+import time
+import tracemalloc
+
+from ..inode_id import InodeIDMap
+from ..parse_dump import SendStreamItems
+from ..subvolume import Subvolume
+
+si = SendStreamItems
+
+
+def _make_base(num_files: int) -> Subvolume:
+    subvol = Subvolume.new(id_map=InodeIDMap.new(description='base'))
+    for d in range(num_files // 100 + 1):
+        subvol.apply_item(si.mkdir(path=b'd%d' % d))
+    for i in range(num_files):
+        path = b'd%d/f%d' % (i // 100, i)
+        subvol.apply_item(si.mkfile(path=path))
+        subvol.apply_item(si.write(path=path, offset=0, data=b'x'))
+    return subvol
+
+
+def _measure_chain(base, snapshot_fn, args):
+    rnd = random.Random(0)
+    tracemalloc.start()
+    start = time.monotonic()
+    subvol = base
+    chain = []
+    for i in range(args.snapshots):
+        subvol = snapshot_fn(subvol, f'snap{i}')
+        chain.append(subvol)  # Keep the whole chain alive
+        for _ in range(args.changes):
+            f = rnd.randrange(args.files)
+            subvol.apply_item(si.chmod(
+                path=b'd%d/f%d' % (f // 100, f), mode=rnd.randrange(0o777),
+            ))
+    duration = time.monotonic() - start
+    _cur, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument('--files', type=int, default=2000)
+    p.add_argument('--snapshots', type=int, default=50)
+    p.add_argument('--changes', type=int, default=10)
+    args = p.parse_args(argv)
+
+    base = _make_base(args.files)
+    print(
+        f'{args.snapshots} snapshots of {args.files} files, '
+        f'{args.changes} changes each:'
+    )
+    for desc, snapshot_fn in [
+        ('snapshot', lambda sv, desc: sv.snapshot(description=desc)),
+        ('deepcopy', lambda sv, desc: copy.deepcopy(sv, memo={
+            id(sv.id_map.inner.description): desc,
+        })),
+    ]:
+        duration, peak = _measure_chain(base, snapshot_fn, args)
+        print(f'  {desc:<10} {duration:.3f}s, {peak / 2 ** 20:.1f} MiB peak')
+
+
+if __name__ == '__main__':
+    main()
@@ -104,10 +104,13 @@ def get_filtered_and_expected_items(
         if utimes_parent:  # Rarely, `btrfs send` breaks the pattern.
             yield utimes(os.path.dirname(bytes(renamed_item.dest)))
 
+    # Not mutating the global, so that we can be called more than once.
+    temp_path_counter = TEMP_PATH_COUNTER
+
     def temp_path(prefix):
-        global TEMP_PATH_COUNTER
-        TEMP_PATH_COUNTER += 1
-        return p(f'o{TEMP_PATH_COUNTER}-{TEMP_PATH_MIDDLES[prefix]}-0')
+        nonlocal temp_path_counter
+        temp_path_counter += 1
+        return p(f'o{temp_path_counter}-{TEMP_PATH_MIDDLES[prefix]}-0')
 
     def write(path, *, offset: int, data: bytes):
         if dump_mode:
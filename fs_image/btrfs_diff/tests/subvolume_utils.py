@@ -7,7 +7,10 @@ instance (i.e. hardlinks).  Refer to `test_subvolume.py` for usage examples.
 '''
 from typing import NamedTuple
 
+from ..inode_id import InodeIDMap
 from ..rendered_tree import map_bottom_up, RenderedTree, TraversalIDMaker
+from ..send_stream import SendStreamItems
+from ..subvolume import Subvolume
 
 
 class InodeRepr(NamedTuple):
@@ -25,3 +28,25 @@ def expected_subvol_add_traversal_ids(ser: RenderedTree):
             if isinstance(ino_repr, InodeRepr)
                 else id_maker.next_unique().wrap(ino_repr)
     ))
+
+
+def make_hardlinked_subvol(*, description: str='') -> Subvolume:
+    '''
+    Returns an unfrozen `Subvolume` with hardlinks, including one across
+    directories and one to the top-level file, and with directory names
+    that sort differently as `bytes` and as decoded `str`s.
+    '''
+    si = SendStreamItems
+    subvol = Subvolume.new(id_map=InodeIDMap.new(description=description))
+    for d in [b'\xef\xbf\xbd', b'\xff', b'd']:
+        subvol.apply_item(si.mkdir(path=d))
+        subvol.apply_item(si.mkfile(path=d + b'/f'))
+        subvol.apply_item(si.write(path=d + b'/f', offset=0, data=d))
+    subvol.apply_item(si.mkdir(path=b'd/e'))
+    subvol.apply_item(si.mkdir(path=b'd/empty'))
+    subvol.apply_item(si.link(path=b'\xff/h', dest=b'd/f'))
+    subvol.apply_item(si.link(path=b'd/e/h', dest=b'\xef\xbf\xbd/f'))
+    subvol.apply_item(si.link(path=b'd/e/i', dest=b'\xef\xbf\xbd/f'))
+    subvol.apply_item(si.mkfile(path=b'top'))
+    subvol.apply_item(si.link(path=b'd/top', dest=b'top'))
+    return subvol
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from ..clone_index import CloneIndex
+from ..freeze import freeze
+from ..interval_extent import IntervalExtent
+from ..parse_dump import SendStreamItems
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+si = SendStreamItems
+
+
+def _frozen_reprs(subvol_set):
+    return {
+        repr(id): repr(ino)
+            for sv in freeze(subvol_set).uuid_to_subvolume.values()
+                for id, ino in sv.id_to_inode.items()
+    }
+
+
+class CloneIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+        unittest.util._MAX_LENGTH = 12345
+
+    def test_queries(self):
+        index = CloneIndex()
+        subvols = SubvolumeSet.new(clone_index=index)
+        mut = SubvolumeSetMutator.new(subvols, si.subvol(
+            path=b'cat', uuid=b'abe', transid=3,
+        ))
+        for path in [b'a', b'b', b'c']:
+            mut.apply_item(si.mkfile(path=path))
+        mut.apply_item(si.write(path=b'a', offset=0, data=b'x' * 5))
+        mut.apply_item(si.write(path=b'c', offset=0, data=b'y' * 5))
+        mut.apply_item(si.clone(
+            path=b'b', offset=0, len=3, from_uuid=b'abe', from_transid=3,
+            from_path=b'a', clone_offset=2,
+        ))
+        ids = {p: mut.subvolume.id_map.get_id(p) for p in [b'a', b'b', b'c']}
+
+        self.assertEqual({ids[b'b']}, index.clone_peers(ids[b'a']))
+        self.assertEqual({ids[b'a']}, index.clone_peers(ids[b'b']))
+        self.assertEqual(set(), index.clone_peers(ids[b'c']))
+        self.assertEqual(
+            ['cat@b:0+3@2', 'cat@a:2+3@0'],
+            [
+                repr(cc) for i in (b'a', b'b')
+                    for c in index.id_to_chunks([ids[i]])[ids[i]]
+                        for cc in c.chunk_clones
+            ],
+        )
+
+        # Only the files affected by a change get recomputed.
+        a_chunks, c_chunks = \
+            index.id_to_chunks([ids[b'a'], ids[b'c']]).values()
+        mut.apply_item(si.write(path=b'b', offset=0, data=b'z'))
+        new_a_chunks, new_c_chunks = \
+            index.id_to_chunks([ids[b'a'], ids[b'c']]).values()
+        self.assertIsNot(a_chunks, new_a_chunks)
+        self.assertIs(c_chunks, new_c_chunks)
+        self.assertEqual(
+            ['cat@b:1+2@3'],
+            [repr(cc) for c in new_a_chunks for cc in c.chunk_clones],
+        )
+
+        # Breaking the clone also clears the peers of the former peer.
+        mut.apply_item(si.truncate(path=b'b', size=0))
+        self.assertEqual(set(), index.clone_peers(ids[b'a']))
+        self.assertEqual(
+            [], [cc for c in index.id_to_chunks([ids[b'a']])[ids[b'a']]
+                for cc in c.chunk_clones],
+        )
+
+        # Deleted files leave the index.
+        mut.apply_item(si.unlink(path=b'a'))
+        self.assertEqual(set(), index.clone_peers(ids[b'a']))
+        with self.assertRaises(KeyError):
+            index.id_to_chunks([ids[b'a']])
+
+    def test_matches_batch_freeze(self):
+        # Apply the same random items to two `SubvolumeSet`s, one with a
+        # `CloneIndex`, and freeze both every few items.
+        for seed in range(40):
+            rnd = random.Random(seed)
+            index = CloneIndex()
+            subvol_sets = [SubvolumeSet.new(clone_index=index)]
+            subvol_sets.append(SubvolumeSet.new())
+            uuids = [b'abe']
+            muts = [[SubvolumeSetMutator.new(ss, si.subvol(
+                path=b'cat', uuid=b'abe', transid=3,
+            ), extent_class=rnd.choice([None, IntervalExtent]))]
+                for ss in subvol_sets]
+            paths = [b'f0', b'f1', b'f2']
+            for ms in muts:
+                for path in paths:
+                    ms[0].apply_item(si.mkfile(path=path))
+
+            for step in range(rnd.randint(5, 40)):
+                op = rnd.choice('wwtccus')
+                path = rnd.choice(paths)
+                if op == 's':
+                    uuid = f'uu{step}'.encode()
+                    items = [si.snapshot(
+                        path=b'dog', uuid=uuid, transid=5,
+                        parent_uuid=rnd.choice(uuids), parent_transid=3,
+                    )]
+                    for ms, ss in zip(muts, subvol_sets):
+                        ms.append(SubvolumeSetMutator.new(ss, items[0]))
+                    uuids.append(uuid)
+                    continue
+                mut_idx = rnd.randrange(len(uuids))
+                if op == 'w':
+                    items = [si.write(
+                        path=path, offset=rnd.randint(0, 9),
+                        data=b'x' * rnd.randint(1, 6),
+                    )]
+                elif op == 't':
+                    items = [si.truncate(path=path, size=rnd.randint(0, 9))]
+                elif op == 'u':
+                    items = [
+                        si.unlink(path=path), si.mkfile(path=path),
+                    ]
+                else:
+                    from_idx = rnd.randrange(len(uuids))
+                    from_path = rnd.choice(paths)
+                    from_ino = muts[0][from_idx].subvolume.inode_at_path(
+                        from_path
+                    )
+                    if not from_ino.extent.length:
+                        continue
+                    clone_offset = rnd.randrange(from_ino.extent.length)
+                    items = [si.clone(
+                        path=path, offset=rnd.randint(0, 9),
+                        len=rnd.randint(
+                            1, from_ino.extent.length - clone_offset,
+                        ),
+                        from_uuid=uuids[from_idx], from_transid=3,
+                        from_path=from_path, clone_offset=clone_offset,
+                    )]
+                for ms in muts:
+                    for item in items:
+                        ms[mut_idx].apply_item(item)
+                if rnd.random() < 0.3:
+                    self.assertEqual(
+                        *[_frozen_reprs(ss) for ss in subvol_sets],
+                        f'seed {seed}, step {step}',
+                    )
+            self.assertEqual(
+                *[_frozen_reprs(ss) for ss in subvol_sets], f'seed {seed}',
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from ..crc32c import _py_crc32c, _TABLES, crc32c
+
+
+def _bytewise_crc32c(data: bytes, crc: int = 0) -> int:
+    for b in data:
+        crc = _TABLES[0][(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+class Crc32cTestCase(unittest.TestCase):
+
+    def test_check_value(self):
+        # The standard CRC32C check value, after undoing the "raw" variant.
+        for fn in [crc32c, _py_crc32c]:
+            self.assertEqual(
+                0xE3069283, fn(b'123456789', 0xFFFFFFFF) ^ 0xFFFFFFFF,
+            )
+            self.assertEqual(0, fn(b''))
+            self.assertEqual(0x1234, fn(b'', 0x1234))
+
+    def test_slice_by_8_matches_bytewise(self):
+        rand = random.Random(37)
+        data = bytes(rand.getrandbits(8) for _ in range(300))
+        # Cover every tail length, and misaligned `memoryview` slices.
+        for start in range(9):
+            for end in range(start, len(data), 13):
+                chunk = data[start:end]
+                expected = _bytewise_crc32c(chunk)
+                self.assertEqual(expected, _py_crc32c(chunk))
+                self.assertEqual(
+                    expected, _py_crc32c(memoryview(data)[start:end]),
+                )
+                self.assertEqual(expected, crc32c(bytearray(chunk)))
+
+    def test_chaining(self):
+        a, b = b'btrfs-stream', b'\0' * 21
+        self.assertEqual(crc32c(a + b), crc32c(b, crc32c(a)))
+        self.assertEqual(_py_crc32c(a + b), _py_crc32c(b, _py_crc32c(a)))
+
+
+if __name__ == '__main__':
+    unittest.main()
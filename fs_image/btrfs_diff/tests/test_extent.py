@@ -449,6 +449,25 @@ class ExtentTestCase(unittest.TestCase):
             .clone(to_offset=10, from_extent=clone, from_offset=1, length=3))
         self.assertIs(clone, result.content[1].content[0])
 
+    def test_clone_from_workalike(self):
+        # E.g. `IntervalExtent` only exposes its trimmed leaves.
+        a, b = (Extent(Extent.Kind.DATA, 0, 5), Extent(Extent.Kind.HOLE, 0, 3))
+
+        def gen_trimmed_leaves(*, offset, length):
+            self.assertEqual((7, 4), (offset, length))
+            return [(2, 3, a), (0, 1, b)]
+
+        result = Extent.empty().write(offset=0, length=2).clone(
+            to_offset=1,
+            from_extent=SimpleNamespace(gen_trimmed_leaves=gen_trimmed_leaves),
+            from_offset=7,
+            length=4,
+        )
+        self.assertEqual('d4h1', repr(result))
+        _, _, (_, ra, rb) = zip(*result.gen_trimmed_leaves())
+        self.assertIs(a, ra)
+        self.assertIs(b, rb)
+
     def test_repr_kind(self):
         self.assertEqual('Extent.Kind.DATA', repr(Extent.Kind.DATA))
 
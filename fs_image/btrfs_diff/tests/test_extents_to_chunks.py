@@ -9,7 +9,10 @@ from typing import Iterable, Tuple
 
 from ..extent import Extent
 from ..inode_id import InodeIDMap
-from ..extents_to_chunks import extents_to_chunks_with_clones
+from ..extents_to_chunks import (
+    extent_ids_to_chunk_clones, extents_to_chunks_with_clones,
+    extents_to_chunks_with_extent_ids,
+)
 
 # `unittest`'s output shortening makes tests much harder to debug.
 unittest.util._MAX_LENGTH = 12345
@@ -171,8 +174,16 @@ class ExtentsToChunksTestCase(unittest.TestCase):
                 file_extent,
             )
 
+    def _extents_to_chunks_with_clones(self, ids_and_extents):
+        'Also checks that the linear representation agrees.'
+        ids_and_chunks = list(extents_to_chunks_with_clones(ids_and_extents))
+        self.assertEqual(ids_and_chunks, list(extent_ids_to_chunk_clones(
+            list(extents_to_chunks_with_extent_ids(ids_and_extents))
+        )))
+        return ids_and_chunks
+
     def _repr_chunks_from_figure(self, s, **kwargs):
-        return _repr_ids_and_chunks(extents_to_chunks_with_clones(list(
+        return _repr_ids_and_chunks(self._extents_to_chunks_with_clones(list(
             self._gen_ids_and_extents_from_figure(s, **kwargs)
         )))
 
@@ -406,6 +417,51 @@ class ExtentsToChunksTestCase(unittest.TestCase):
             01234567890123456789
         '''))
 
+    def test_extent_ids(self):
+        # The docstring example, but linear.
+        self.assertEqual({
+            'A': [('DATA/6', {'#0:0+3@0', '#0:6+3@3'})],
+            'B': [('DATA/5', {'#0:1+5@0'})],
+            'C': [('DATA/5', {'#0:3+5@0'})],
+        }, {
+            repr(ino_id): [
+                (
+                    f'{c.kind.name}/{c.length}',
+                    {repr(r) for r in c.extent_refs},
+                ) for c in chunks
+            ] for ino_id, chunks in extents_to_chunks_with_extent_ids(list(
+                self._gen_ids_and_extents_from_figure('''
+                     BBBBBAAA
+                    AAACCCCC
+                    0123456789
+                ''')
+            ))
+        })
+
+        # `z` is created first, but the extents are numbered in path order.
+        # The last 2 bytes of `z` are not cloned, so they get no ref, even
+        # though the rest of their leaf extent is shared with `a`.
+        z = Extent.empty().write(offset=0, length=6).write(offset=2, length=2)
+        b = Extent.empty().write(offset=0, length=3)
+        a = Extent.empty().clone(
+            to_offset=0, from_extent=b, from_offset=1, length=2,
+        ).clone(to_offset=2, from_extent=z, from_offset=1, length=2)
+        self.assertEqual({
+            'z': [('DATA/6', {'#1:0+2@0', '#2:0+2@2'})],
+            'b': [('DATA/3', {'#0:0+3@0'})],
+            'a': [('DATA/4', {'#0:1+2@0', '#1:1+1@2', '#2:0+1@3'})],
+        }, {
+            repr(ino_id): [
+                (
+                    f'{c.kind.name}/{c.length}',
+                    {repr(r) for r in c.extent_refs},
+                ) for c in chunks
+            ] for ino_id, chunks in extents_to_chunks_with_extent_ids([
+                (self.id_map.add_file(self.id_map.next(), p), e)
+                    for p, e in [(b'z', z), (b'b', b), (b'a', a)]
+            ])
+        })
+
     def test_multi_extent(self):
         # There are 3 `write` commands below, one for each of `a`, `b`, and
         # `c`.  We also create a few HOLE leaf extents along the way.  All
@@ -456,14 +512,14 @@ class ExtentsToChunksTestCase(unittest.TestCase):
         # files, let's make sure the clone detection does the right thing.
         # Also add an empty file to make sure that corner case works.
 
-        ids_and_chunks = list(extents_to_chunks_with_clones([
+        ids_and_chunks = self._extents_to_chunks_with_clones([
             (self.id_map.add_file(self.id_map.next(), p), e) for p, e in [
                 (b'a', a),
                 (b'b', b),
                 (b'c', c),
                 (b'e', Extent.empty()),
             ]
-        ]))
+        ])
 
         # I iteratively built this up from the "trimmed leaves" data above,
         # and checked against the real output, one file at a time.  So, this
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import sys
 import unittest
 
 from types import MappingProxyType
@@ -58,6 +59,42 @@ class FreezeTestCase(unittest.TestCase):
             [type(i) for i in f],
         )
 
+    def test_already_frozen(self):
+        # Immutable containers of frozen items are returned as-is.
+        t = (1, 'a', frozenset([b'b']), (None,))
+        self.assertIs(t, freeze(t))
+
+        class Owner(NamedTuple):
+            uid: int
+            gid: int
+
+        owner = Owner(uid=1, gid=2)
+        self.assertIs(owner, freeze(owner))
+        # A mutable item anywhere inside means we must copy.
+        t2 = (1, ([],))
+        f2 = freeze(t2)
+        self.assertEqual((1, ((),)), f2)
+        self.assertIsNot(t2, f2)
+        self.assertIsNot(t2[1], f2[1])
+
+        # Subclasses of `tuple` become plain `tuple`s, as before.
+        class MyTuple(tuple):
+            pass
+
+        self.assertIs(tuple, type(freeze(MyTuple((1, 2)))))
+        self.assertIsInstance(freeze({}), MappingProxyType)
+
+    def test_deep_nesting(self):
+        # Deeper than the recursion limit
+        l = []
+        for _ in range(sys.getrecursionlimit() + 10):
+            l = [l, {'k': {1}}]
+        f = freeze(l)
+        for _ in range(sys.getrecursionlimit() + 10):
+            self.assertIsInstance(f[1], MappingProxyType)
+            f = f[0]
+        self.assertEqual((), f)
+
     def test_not_implemented(self):
         with self.assertRaises(NotImplementedError):
             freeze(object())
@@ -6,7 +6,7 @@ from ..extent import Extent
 from ..extents_to_chunks import extents_to_chunks_with_clones
 from ..inode import (
     _time_delta, _repr_time, _repr_time_delta,
-    Chunk, ChunkClone, Clone, Inode, InodeOwner, InodeUtimes,
+    Chunk, ChunkClone, Clone, ExtentRef, Inode, InodeOwner, InodeUtimes,
 )
 from ..inode_id import InodeIDMap
 
@@ -142,6 +142,20 @@ class InodeTestCase(unittest.TestCase):
             ('(DATA/12: a:7+2@3, a:5+6@4)', '(DATA/12: a:5+6@4, a:7+2@3)'),
         )
 
+    def test_extent_ref(self):
+        ref = ExtentRef(offset=3, extent_id=5, extent_offset=7, length=2)
+        self.assertEqual('#5:7+2@3', repr(ref))
+        chunk = Chunk(
+            kind=Extent.Kind.HOLE, length=9, chunk_clones=(),
+            extent_refs={ref},
+        )
+        self.assertEqual('(HOLE/9: #5:7+2@3)', repr(chunk))
+        self.assertEqual(
+            '(File h9(#5:7+2@3))',
+            repr(Inode(file_type=stat.S_IFREG, mode=None, owner=None,
+                       utimes=None, xattrs={}, chunks=(chunk,))),
+        )
+
     def test_repr_owner(self):
         self.assertEqual('12:345', repr(InodeOwner(uid=12, gid=345)))
 
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import pickle
 import random
 import unittest
 
@@ -6,7 +7,7 @@ from types import SimpleNamespace
 
 from ..freeze import freeze
 from ..inode_id import (
-    InodeID, InodeIDMap, _PathEntry, _ReversePathEntry, _ROOT_REVERSE_ENTRY,
+    InodeID, InodeIDMap, _ReversePathEntry, _ROOT_REVERSE_ENTRY,
 )
 
 from .deepcopy_test import DeepCopyTestCase
@@ -109,7 +110,8 @@ class InodeIDTestCase(DeepCopyTestCase):
             TypeError, 'mappingproxy.* does not support item deletion',
         ):
             freeze(id_map).remove_path(b'a/c')
-        self.assertIs(mut_ns.ino2, id_map.remove_path(b'a/c'))
+        # `InodeID`s are made on demand, so only equality holds.
+        self.assertEqual(mut_ns.ino2, id_map.remove_path(b'a/c'))
         saved_frozen_map = freeze(id_map)  # We'll check this later
         id_map = yield from maybe_replace_map(id_map, 'removed a/c name')
         for im, ns in unfrozen_and_frozen(id_map, mut_ns):
@@ -120,14 +122,9 @@ class InodeIDTestCase(DeepCopyTestCase):
             self.assertEqual({b'a'}, im.get_children(ns.ino_root))
 
         # Look-up by ID
-        for (im, ns), check_same in zip(
-            unfrozen_and_frozen(id_map, mut_ns),
-            # `is` comparison would be harder to implement for the frozen
-            # variant, and meaningless because we just constructed it.
-            [self.assertIs, self.assertEqual],
-        ):
-            check_same(ns.ino1, im.get_id(b'a'))
-            check_same(ns.ino2, im.get_id(b'a/d'))
+        for im, ns in unfrozen_and_frozen(id_map, mut_ns):
+            self.assertEqual(ns.ino1, im.get_id(b'a'))
+            self.assertEqual(ns.ino2, im.get_id(b'a/d'))
 
         # Cannot remove non-empty directories
         with self.assertRaisesRegex(RuntimeError, "remove b'a'.*has children"):
@@ -141,7 +138,7 @@ class InodeIDTestCase(DeepCopyTestCase):
         # Check that we clean up empty path sets
         for im, ns in unfrozen_and_frozen(id_map, mut_ns):
             self.assertIn(ns.ino2.id, im.inner.id_to_reverse_entries)
-        self.assertIs(mut_ns.ino2, id_map.remove_path(b'a/d'))
+        self.assertEqual(mut_ns.ino2, id_map.remove_path(b'a/d'))
         id_map = yield from maybe_replace_map(id_map, 'removed a/d name')
         for im, _ns in unfrozen_and_frozen(id_map, mut_ns):
             self.assertNotIn(INO2_ID, im.inner.id_to_reverse_entries)
@@ -184,9 +181,7 @@ class InodeIDTestCase(DeepCopyTestCase):
             self.assertEqual(
                 {0: {_ROOT_REVERSE_ENTRY}}, im.inner.id_to_reverse_entries,
             )
-            self.assertEqual(_PathEntry(
-                id=InodeID(id=0, inner_id_map=im.inner), name_to_child={},
-            ), im.root)
+            self.assertEqual({0: {}}, im.id_to_children)
 
         # Test renaming directories
         id_map.add_dir(id_map.next(), b'x')
@@ -213,9 +208,27 @@ class InodeIDTestCase(DeepCopyTestCase):
             )
             # `get_children` promises to return None for files.
             self.assertIsNone(im.get_children(im.get_id(b'x1/y/z')))
+            self.assertEqual(
+                {b'z', b'v'}, set(im.get_child_names(im.get_id(b'x1/y'))),
+            )
+            self.assertIsNone(im.get_child_names(im.get_id(b'x1/y/z')))
+            self.assertEqual(
+                im.get_id(b'x1/y/v'),
+                im.get_child_id(im.get_id(b'x1/y'), b'v'),
+            )
+            self.assertIsNone(im.get_child_id(im.get_id(b'x1/y'), b'no'))
+            self.assertEqual(
+                [(b'v', im.get_id(b'x1/y/v')), (b'z', im.get_id(b'x1/y/z'))],
+                im.get_sorted_children(im.get_id(b'x1/y')),
+            )
+            self.assertIsNone(im.get_sorted_children(im.get_id(b'x1/y/z')))
+            # Non-normalized paths take the slow path.
+            self.assertEqual(
+                im.get_id(b'x1/y/v'), im.get_id(b'./x1/y//z/../v/'),
+            )
 
-        # Tests for `_reverse_entry_matches_path_parts`: Given an InodeID,
-        # look up the `ReversePathEntry` that corresponds to a given path.
+        # Tests for removing hardlinks: Given an InodeID, remove the
+        # `ReversePathEntry` that corresponds to a given path.
         #
         # (1) Let us specifically aims to cover the cases when, of the path
         # and the `ReversePathEntry`, one is a suffix of the other.  For
@@ -256,9 +269,11 @@ class InodeIDTestCase(DeepCopyTestCase):
                 {f'lala{i}'.encode() for i in range(num_diff_paths)},
                 im.get_paths(ns.ino_id),
             )
+            self.assertEqual(num_diff_paths, im.get_num_paths(ns.ino_id))
         for i in range(num_diff_paths):
             id_map.remove_path(f'lala{i}'.encode())
         self.assertEqual(set(), id_map.get_paths(mut_ns.ino_id))
+        self.assertEqual(0, id_map.get_num_paths(mut_ns.ino_id))
 
         # Test some more errors
         with self.assertRaisesRegex(RuntimeError, f"foo''s parent.*is a file"):
@@ -279,18 +294,10 @@ class InodeIDTestCase(DeepCopyTestCase):
         # Even though we changed `id_map` a lot, `saved_frozen` is still
         # in the same state where we took the snapshot.
         self.assertIsNone(saved_frozen_map.inode_id_counter)
-        self.assertEqual(_PathEntry(
-            id=InodeID(id=0, inner_id_map=saved_frozen_map.inner),
-            name_to_child={
-                b'a': _PathEntry(id=InodeID(
-                    id=INO1_ID, inner_id_map=saved_frozen_map.inner,
-                ), name_to_child={
-                    b'd': _PathEntry(id=InodeID(
-                        id=INO2_ID, inner_id_map=saved_frozen_map.inner,
-                    ), name_to_child=None)
-                }),
-            },
-        ), saved_frozen_map.root)
+        self.assertEqual({
+            0: {b'a': INO1_ID},
+            INO1_ID: {b'd': INO2_ID},
+        }, saved_frozen_map.id_to_children)
         self.assertEqual('', saved_frozen_map.inner.description)
         self.assertEqual({
             0: {_ROOT_REVERSE_ENTRY},
@@ -307,6 +314,55 @@ class InodeIDTestCase(DeepCopyTestCase):
             'cat@food', repr(cat_map.add_file(cat_map.next(), b'food')),
         )
 
+    def test_interned_names(self):
+        id_map = InodeIDMap.new()
+        for d in [b'a', b'b']:
+            id_map.add_dir(id_map.next(), d)
+            id_map.add_file(id_map.next(), d + b'/init')
+        names = [
+            next(iter(id_map.get_child_names(id_map.get_id(d))))
+                for d in [b'a', b'b']
+        ]
+        self.assertEqual(b'init', names[0])
+        self.assertIs(names[0], names[1])
+        self.assertIsNone(freeze(id_map).interned_names)
+
+    def test_snapshot(self):
+        cat_map = InodeIDMap.new(description='cat')
+        cat_map.add_dir(cat_map.next(), b'a')
+        cat_map.add_file(cat_map.next(), b'a/b')
+        tiger_map = cat_map.snapshot(description='tiger')
+        self.assertEqual('tiger@a/b', repr(tiger_map.get_id(b'a/b')))
+        self.assertNotEqual(cat_map.get_id(b'a'), tiger_map.get_id(b'a'))
+
+        # The two maps evolve independently, but allocate the same IDs.
+        tiger_map.rename_path(b'a/b', b'c')
+        cat_map.add_file(cat_map.next(), b'a/d')
+        tiger_map.add_file(tiger_map.next(), b'e')
+        self.assertEqual('tiger@c', repr(tiger_map.get_id(b'c')))
+        self.assertIsNone(cat_map.get_id(b'c'))
+        self.assertEqual({b'a/b', b'a/d'}, cat_map.get_children(
+            cat_map.get_id(b'a'),
+        ))
+        self.assertEqual(set(), tiger_map.get_children(
+            tiger_map.get_id(b'a'),
+        ))
+        self.assertEqual(
+            cat_map.get_id(b'a/d').id, tiger_map.get_id(b'e').id,
+        )
+
+    def test_pickle(self):
+        id_map = InodeIDMap.new()
+        id_map.add_file(id_map.next(), b'a')
+        loaded_map = pickle.loads(pickle.dumps(id_map))
+        self.assertEqual(b'a', loaded_map.get_paths(
+            loaded_map.get_id(b'a'),
+        ).pop())
+        # The loaded counter resumes where ours was, but is independent.
+        self.assertEqual(2, loaded_map.next().id)
+        self.assertEqual(2, id_map.next().id)
+        self.assertEqual(3, loaded_map.next().id)
+
     def test_hashing_and_equality(self):
         maps = [InodeIDMap.new() for i in range(100)]
         hashes = {hash(m.get_id(b'.')) for m in maps}
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import copy
+import unittest
+
+from ..freeze import freeze
+from ..incomplete_inode import IncompleteFile, IncompleteSymlink
+from ..inode import InodeOwner, InodeUtimes
+from ..inode_id import InodeIDMap
+from ..inode_store import ColumnarInodeStore, PersistentInodeStore
+from ..parse_dump import SendStreamItems
+from ..rendered_tree import emit_all_traversal_ids
+from ..subvolume import Subvolume
+
+si = SendStreamItems
+
+
+def _new_subvol(store_class, description='cat'):
+    id_map = InodeIDMap.new(description=description)
+    return Subvolume.new(id_map=id_map, id_to_inode=store_class(id_map.inner))
+
+
+def _renders(subvol):
+    return [
+        emit_all_traversal_ids(sv.render()) for sv in (subvol, freeze(subvol))
+    ]
+
+
+class InodeStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def _populate(self, subvol):
+        for item in [
+            si.mkdir(path=b'd'),
+            si.mkfile(path=b'd/f'),
+            si.write(path=b'd/f', offset=0, data=b'abcd'),
+            si.chmod(path=b'd/f', mode=0o640),
+            si.chown(path=b'd/f', uid=0, gid=7),
+            si.utimes(path=b'd/f', ctime=(1, 2), mtime=(3, 4), atime=(5, 6)),
+            si.set_xattr(path=b'd/f', name=b'user.a', data=b'1'),
+            si.set_xattr(path=b'd/f', name=b'user.b', data=b'2'),
+            si.remove_xattr(path=b'd/f', name=b'user.a'),
+            si.link(path=b'd/g', dest=b'd/f'),
+            si.mknod(path=b'blk', mode=0o60600, dev=0x801),
+            si.symlink(path=b'sym', dest=b'd/f'),
+            si.mkfifo(path=b'fifo'),
+            si.mksock(path=b'sock'),
+            si.mkfile(path=b'gone'),
+            si.unlink(path=b'gone'),
+        ]:
+            subvol.apply_item(item)
+        subvol.apply_clone(si.clone(
+            path=b'd/f', offset=4, len=2, from_uuid='', from_transid=0,
+            from_path=b'd/f', clone_offset=1,
+        ), subvol)
+
+    def test_stores_match(self):
+        subvols = [
+            _new_subvol(c) for c in (PersistentInodeStore, ColumnarInodeStore)
+        ]
+        for subvol in subvols:
+            self._populate(subvol)
+        self.assertEqual(*[_renders(sv) for sv in subvols])
+        self.assertEqual(*[len(sv.id_to_inode) for sv in subvols])
+        self.assertEqual(*[
+            [(id.id, repr(ino)) for id, ino in sv.id_to_inode.items()]
+                for sv in subvols
+        ])
+
+        # Snapshots are independent of their parents.
+        snapshots = [sv.snapshot(description='tiger') for sv in subvols]
+        for subvol, snapshot in zip(subvols, snapshots):
+            snapshot.apply_item(si.chown(path=b'd/f', uid=1, gid=1))
+            snapshot.apply_item(si.set_xattr(path=b'sym', name=b'x', data=b''))
+            snapshot.apply_item(si.truncate(path=b'd/f', size=1))
+            snapshot.apply_item(si.unlink(path=b'blk'))
+            subvol.apply_item(si.utimes(
+                path=b'.', ctime=(7, 0), mtime=(7, 0), atime=(7, 0),
+            ))
+        self.assertEqual(*[_renders(sv) for sv in subvols])
+        self.assertEqual(*[_renders(sv) for sv in snapshots])
+        self.assertNotEqual(_renders(subvols[1]), _renders(snapshots[1]))
+
+        # `deepcopy` works as for the default store.
+        copies = [copy.deepcopy(sv) for sv in subvols]
+        self.assertEqual(*[_renders(sv) for sv in copies])
+
+    def test_columnar_views(self):
+        subvol = _new_subvol(ColumnarInodeStore)
+        self._populate(subvol)
+        store = subvol.id_to_inode
+        f_id = subvol.id_map.get_id(b'd/f')
+
+        f = store[f_id]
+        self.assertIsInstance(f, IncompleteFile)
+        self.assertEqual(0o640, f.mode)
+        self.assertEqual(InodeOwner(uid=0, gid=7), f.owner)
+        self.assertEqual(InodeUtimes(
+            ctime=(1, 2), mtime=(3, 4), atime=(5, 6),
+        ), f.utimes)
+        self.assertEqual({b'user.b': b'2'}, f.xattrs)
+        self.assertEqual(6, f.extent.length)
+        self.assertIs(f.extent, store[f_id].extent)
+        # Views of the same inode see each other's writes.
+        store.get_mut(f_id, copy.deepcopy).mode = 0o600
+        self.assertEqual(0o600, f.mode)
+
+        # Unset fields, and the xattrs that are only stored once written.
+        sym = subvol.inode_at_path(b'sym')
+        self.assertIsInstance(sym, IncompleteSymlink)
+        self.assertEqual(
+            (None, None, None, {}, b'd/f'),
+            (sym.mode, sym.owner, sym.utimes, sym.xattrs, sym.dest),
+        )
+        sym_xattrs = sym.xattrs
+        sym_xattrs[b'a'] = b'1'
+        sym_xattrs[b'b'] = b'2'
+        self.assertEqual({b'a': b'1', b'b': b'2'}, sym.xattrs)
+        self.assertEqual(sym_xattrs, sym.xattrs)
+        f.owner = None
+        f.utimes = None
+        f.xattrs = {}
+        self.assertEqual((None, None, {}), (f.owner, f.utimes, f.xattrs))
+
+        # Overwriting an inode replaces all its fields.
+        store[f_id] = subvol.inode_at_path(b'blk')
+        self.assertEqual('(Block m600 801)', repr(store[f_id]))
+
+        # Lookups that fail
+        del store[f_id]
+        for bad_id in [
+            f_id, 'not an ID', subvol.id_map.next(),
+            InodeIDMap.new().get_id(b'.'),
+        ]:
+            with self.assertRaises(KeyError):
+                store[bad_id]
+            self.assertNotIn(bad_id, store)
+            self.assertEqual('d', store.get(bad_id, 'd'))
+        with self.assertRaises(KeyError):
+            del store[f_id]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import copy
+import random
+import unittest
+
+from ..extent import Extent
+from ..interval_extent import IntervalExtent
+
+# `unittest`'s output shortening makes tests much harder to debug.
+unittest.util._MAX_LENGTH = 12345
+
+
+def _canonical_leaves(extents):
+    '''
+    Renders the trimmed leaves of `extents`, numbering leaves in the order
+    of their first occurrence, so that the results from different engines
+    are comparable, while still capturing object identity.
+    '''
+    leaf_ids = {}
+    return [
+        [
+            (offset, length, leaf.content, leaf.length, leaf_ids.setdefault(
+                id(leaf), len(leaf_ids),
+            )) for offset, length, leaf in e.gen_trimmed_leaves()
+        ] for e in extents
+    ]
+
+
+class IntervalExtentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def test_write_truncate_clone(self):
+        ie = IntervalExtent.empty()
+        self.assertEqual('', repr(ie))
+        self.assertEqual(0, ie.length)
+        self.assertEqual([], list(ie.gen_trimmed_leaves()))
+
+        # Mutators work in-place, but return `self` like `Extent` does.
+        self.assertIs(ie, ie.write(offset=3, length=4))
+        self.assertIs(ie, ie.write(offset=12, length=6))
+        self.assertEqual('h3d4h5d6', repr(ie))
+        self.assertEqual(18, ie.length)
+        _, _, (a, b, c, d) = zip(*ie.gen_trimmed_leaves())
+        self.assertEqual([
+            Extent(Extent.Kind.HOLE, 0, 3),
+            Extent(Extent.Kind.DATA, 0, 4),
+            Extent(Extent.Kind.HOLE, 0, 5),
+            Extent(Extent.Kind.DATA, 0, 6),
+        ], [a, b, c, d])
+
+        # Overwrite the middle, splitting two leaves.
+        ie.write(offset=5, length=10)
+        self.assertEqual([
+            (0, 3, a), (0, 2, b), (0, 10, ie._leaves[2]), (3, 3, d),
+        ], list(ie.gen_trimmed_leaves()))
+        self.assertEqual([
+            (1, 1, b), (0, 2, ie._leaves[2]),
+        ], list(ie.gen_trimmed_leaves(offset=4, length=3)))
+
+        # Clone from ourselves, extending the file.
+        self.assertIs(ie, ie.clone(
+            to_offset=16, from_extent=ie, from_offset=1, length=5,
+        ))
+        self.assertEqual('h3d13h2d3', repr(ie))
+        self.assertEqual([
+            (0, 3, a), (0, 2, b), (0, 10, ie._leaves[2]), (3, 1, d),
+            (1, 2, a), (0, 2, b), (0, 1, ie._leaves[2]),
+        ], list(ie.gen_trimmed_leaves()))
+
+        self.assertIs(ie, ie.truncate(length=4))
+        self.assertEqual([(0, 3, a), (0, 1, b)], list(ie.gen_trimmed_leaves()))
+        self.assertIs(ie, ie.truncate(length=4))
+        self.assertEqual('h3d1', repr(ie))
+        ie.truncate(length=6)
+        self.assertEqual('h3d1h2', repr(ie))
+        self.assertEqual(
+            Extent(Extent.Kind.HOLE, 0, 2),
+            list(ie.gen_trimmed_leaves())[-1][2],
+        )
+        ie.truncate(length=0)
+        self.assertEqual([], list(ie.gen_trimmed_leaves()))
+
+    def test_matches_extent(self):
+        # Apply the same random operations to several files via both
+        # engines, with clones between the files.  This would detect
+        # divergent leaf identity, trimming, or ordering.
+        for seed in range(300):
+            rnd = random.Random(seed)
+            ops = [
+                (
+                    rnd.choice('wwtcc'), rnd.randrange(4), rnd.randrange(4),
+                    rnd.randint(0, 30), rnd.randint(0, 30), rnd.randint(1, 15),
+                ) for _ in range(rnd.randint(1, 25))
+            ]
+            results = []
+            for cls in (Extent, IntervalExtent):
+                files = [cls.empty() for _ in range(4)]
+                for op, to_idx, from_idx, offset, from_offset, length in ops:
+                    if op == 'w':
+                        files[to_idx] = files[to_idx].write(
+                            offset=offset, length=length,
+                        )
+                    elif op == 't':
+                        files[to_idx] = files[to_idx].truncate(length=offset)
+                    elif files[from_idx].length:
+                        from_extent = files[from_idx]
+                        from_offset %= from_extent.length
+                        files[to_idx] = files[to_idx].clone(
+                            to_offset=offset,
+                            from_extent=from_extent,
+                            from_offset=from_offset,
+                            length=min(
+                                length, from_extent.length - from_offset,
+                            ),
+                        )
+                results.append((
+                    [repr(f) for f in files], _canonical_leaves(files),
+                ))
+            self.assertEqual(*results, f'seed {seed}: {ops}')
+
+    def test_mixed_engines(self):
+        ext = Extent.empty().write(offset=2, length=3)
+        ie = IntervalExtent.empty().clone(
+            to_offset=1, from_extent=ext, from_offset=1, length=4,
+        )
+        self.assertEqual('h2d3', repr(ie))
+        ext_leaves = [l for _, _, l in ext.gen_trimmed_leaves()]
+        self.assertEqual([
+            (0, 1, ie._leaves[0]),
+            (1, 1, ext_leaves[0]),
+            (0, 3, ext_leaves[1]),
+        ], list(ie.gen_trimmed_leaves()))
+
+        back = Extent.empty().clone(
+            to_offset=0, from_extent=ie, from_offset=2, length=2,
+        )
+        self.assertEqual(
+            [(0, 2, ext_leaves[1])], list(back.gen_trimmed_leaves()),
+        )
+
+    def test_deep_history(self):
+        # With `Extent`, this would recurse too deeply to flatten.
+        ie = IntervalExtent.empty()
+        for i in range(10000):
+            ie.write(offset=i * 2, length=2)
+        ie.write(offset=5, length=4)
+        leaves = list(ie.gen_trimmed_leaves())
+        self.assertEqual(10000, len(leaves))
+        self.assertEqual([2, 2, 1, 4, 1, 2], [l for _, l, _ in leaves[:6]])
+        self.assertEqual('d20000', repr(ie))
+
+    def test_copy(self):
+        ie = IntervalExtent.empty().write(offset=0, length=5)
+        ie.write(offset=8, length=2)
+        for ie_copy in (copy.copy(ie), copy.deepcopy(ie)):
+            self.assertIsNot(ie, ie_copy)
+            self.assertEqual(repr(ie), repr(ie_copy))
+            # The leaves are shared, so clones remain detectable.
+            self.assertEqual(
+                [id(l) for _, _, l in ie.gen_trimmed_leaves()],
+                [id(l) for _, _, l in ie_copy.gen_trimmed_leaves()],
+            )
+            # But the copies are independent.
+            ie_copy.truncate(length=3)
+            self.assertEqual('d5h3d2', repr(ie))
+            self.assertEqual('d3', repr(ie_copy))
+
+    def test_errors(self):
+        ie = IntervalExtent.empty().write(offset=0, length=5)
+        with self.assertRaisesRegex(AssertionError, 'not sure how to hangle'):
+            ie.write(offset=2, length=0)
+        with self.assertRaisesRegex(AssertionError, 'len 5, offset 1'):
+            list(ie.gen_trimmed_leaves(offset=1, length=5))
+        with self.assertRaisesRegex(AssertionError, 'offset -1, length 0'):
+            list(ie.gen_trimmed_leaves(offset=-1, length=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -133,6 +133,19 @@ class ParseBtrfsDumpTestCase(unittest.TestCase):
                 [subvol_line, ok_line.replace(b'/s/', b'/x/')]
             )
 
+        with self.assertRaisesRegex(RuntimeError, 'did not start with'):
+            _parse_lines_to_list(
+                [subvol_line, ok_line.replace(b'/s/', b'/s/../')]
+            )
+
+        # Paths are normalized, and the subvolume root becomes `.`
+        self.assertEqual(
+            [b's', b'.', b'a/b'],
+            [i.path for i in _parse_lines_to_list([
+                subvol_line, b'mkdir ./s/', b'mkdir ./s/a/./b/',
+            ])],
+        )
+
         with self.assertRaisesRegex(RuntimeError, "s/t' contains /"):
             _parse_lines_to_list([subvol_line.replace(b'./s', b'./s/t')])
 
@@ -4,23 +4,58 @@ This test only validates the binary send-stream parser. We rely on the fact
 that `test_parse_dump.py` already sanity-checks the gold data.
 '''
 import io
+import itertools
+import os
 import struct
+import tempfile
 import unittest
 
 from .demo_sendstreams import gold_demo_sendstreams
 from .demo_sendstreams_expected import get_filtered_and_expected_items
 
+from ..send_stream import (
+    FusedItemFilters, get_frequency_of_selinux_xattrs, ItemBatch,
+    ItemFilters, SendStreamItems,
+)
 from ..parse_send_stream import (
     AttributeKind, check_magic, check_version, CommandKind, file_unpack,
-    parse_send_stream, read_attribute, read_command,
+    index_send_stream, parse_send_stream, parse_send_stream_batches,
+    parse_send_stream_parallel, read_attribute, read_command,
 )
 
 # `unittest`'s output shortening makes tests much harder to debug.
 unittest.util._MAX_LENGTH = 12345
 
 
-def _parse_stream_bytes(s: bytes) -> io.BytesIO:
-    return parse_send_stream(io.BytesIO(s))
+def _parse_stream_bytes(s: bytes, **kwargs) -> io.BytesIO:
+    return parse_send_stream(io.BytesIO(s), **kwargs)
+
+
+def _parse_stream_via_file(s: bytes, **kwargs):
+    'Exercises the `mmap` code path of `zero_copy=True`.'
+    with tempfile.TemporaryFile() as f:
+        f.write(s)
+        f.seek(0)
+        return list(parse_send_stream(f, **kwargs))
+
+
+class _UnseekableBytesIO(io.BytesIO):
+    'Stands in for a pipe.'
+
+    def seekable(self):
+        return False
+
+
+def _stream_with_commands(*cmds: bytes) -> bytes:
+    return b'btrfs-stream\0' + struct.pack('<I', 1) + b''.join(cmds)
+
+
+def _command(kind: CommandKind, attrs: bytes) -> bytes:
+    return struct.pack('<IHI', len(attrs), kind.value, 0) + attrs
+
+
+def _attribute(kind: int, data: bytes) -> bytes:
+    return struct.pack('<HH', kind, len(data)) + data
 
 
 class ParseSendStreamTestCase(unittest.TestCase):
@@ -28,12 +63,12 @@ class ParseSendStreamTestCase(unittest.TestCase):
     def setUp(self):
         self.maxDiff = 12345
 
-    def test_verify_gold_parse(self):
+    def _check_gold_parse(self, parse_fn):
         stream_dict = gold_demo_sendstreams()
         filtered_items, expected_items = get_filtered_and_expected_items(
             items=[
-                *_parse_stream_bytes(stream_dict['create_ops']['sendstream']),
-                *_parse_stream_bytes(stream_dict['mutate_ops']['sendstream']),
+                *parse_fn(stream_dict['create_ops']['sendstream']),
+                *parse_fn(stream_dict['mutate_ops']['sendstream']),
             ],
             build_start_time=stream_dict['create_ops']['build_start_time'],
             build_end_time=stream_dict['mutate_ops']['build_end_time'],
@@ -41,6 +76,169 @@ class ParseSendStreamTestCase(unittest.TestCase):
         )
         self.assertEqual(filtered_items, expected_items)
 
+    def test_verify_gold_parse(self):
+        self._check_gold_parse(_parse_stream_bytes)
+
+    def test_verify_gold_parse_zero_copy(self):
+        # A tiny block size makes most commands straddle a block boundary.
+        for block_size in [1, 7, 2 ** 20]:
+            self._check_gold_parse(lambda s: _parse_stream_bytes(
+                s, zero_copy=True, block_size=block_size,
+            ))
+        self._check_gold_parse(
+            lambda s: _parse_stream_via_file(s, zero_copy=True),
+        )
+
+    def test_fused_item_filters(self):
+        stream_dict = gold_demo_sendstreams()
+        items = [
+            *_parse_stream_bytes(stream_dict['create_ops']['sendstream']),
+            *_parse_stream_bytes(stream_dict['mutate_ops']['sendstream']),
+        ]
+        start_time = stream_dict['create_ops']['build_start_time']
+        end_time = stream_dict['mutate_ops']['build_end_time']
+        freqs = get_frequency_of_selinux_xattrs(items)
+        max_ctx, _count = max(freqs.items(), key=lambda p: p[1])
+
+        def discard_fn(path, ctx):
+            return ctx == max_ctx
+
+        def expected_items(discard_fn, utimes):
+            filtered_items = ItemFilters.selinux_xattr(items, discard_fn)
+            if utimes:
+                filtered_items = ItemFilters.normalize_utimes(
+                    filtered_items, start_time=start_time, end_time=end_time,
+                )
+            return list(filtered_items)
+
+        def make_discard_fn(final_freqs):
+            self.assertEqual(freqs, final_freqs)
+            return discard_fn
+
+        for kwargs in [
+            {'selinux_discard_fn': discard_fn},
+            {'make_selinux_discard_fn': make_discard_fn},
+        ]:
+            for utimes in [False, True]:
+                filters = FusedItemFilters(
+                    utimes_range=(start_time, end_time) if utimes else None,
+                    **kwargs,
+                )
+                filtered_items = list(filters(items))
+                self.assertEqual(
+                    expected_items(discard_fn, utimes), filtered_items,
+                )
+                self.assertLess(len(filtered_items), len(items))
+                self.assertEqual(freqs, filters.selinux_freqs)
+
+        filters = FusedItemFilters()
+        self.assertEqual(items, list(filters(items)))
+        self.assertEqual(freqs, filters.selinux_freqs)
+
+        # An empty time range leaves every `utimes` as it was.
+        filters = FusedItemFilters(utimes_range=(end_time, start_time))
+        self.assertEqual(items, list(filters(items)))
+
+        # Items before the first deferred decision are not buffered.
+        def gen_items():
+            yield items[0]
+            raise AssertionError('Read too far')
+
+        filters = FusedItemFilters(make_selinux_discard_fn=make_discard_fn)
+        self.assertEqual(items[0], next(filters(gen_items())))
+
+    def test_batches(self):
+        si = SendStreamItems
+        metadata_types = (si.chmod, si.chown, si.utimes)
+
+        def runs(items):
+            # Batches only reorder the items within a run of metadata
+            # commands, so we compare such runs as multisets.
+            return [
+                sorted(map(repr, run)) if is_metadata else list(run)
+                    for is_metadata, run in itertools.groupby(
+                        items, lambda i: isinstance(i, metadata_types),
+                    )
+            ]
+
+        def unbatch(parsed):
+            return [
+                i for b in parsed
+                    for i in (b if isinstance(b, ItemBatch) else [b])
+            ]
+
+        for d in gold_demo_sendstreams().values():
+            s = d['sendstream']
+            items = list(_parse_stream_bytes(s, zero_copy=True))
+
+            def parse_batches(**kwargs):
+                return list(parse_send_stream_batches(io.BytesIO(s), **kwargs))
+
+            # No run is this long, so nothing gets batched.
+            self.assertEqual(items, parse_batches(min_batch_size=2 ** 16))
+
+            for kwargs in [
+                {'min_batch_size': 1},
+                {'min_batch_size': 1, 'max_batch_size': 1},
+                {'min_batch_size': 2, 'max_batch_size': 2},
+                {'min_batch_size': 3, 'check_crc': True},
+            ]:
+                parsed = parse_batches(**kwargs)
+                batches = [b for b in parsed if isinstance(b, ItemBatch)]
+                self.assertLess(0, len(batches))
+                for batch in batches:
+                    self.assertLessEqual(
+                        len(batch), kwargs.get('max_batch_size', 2 ** 16),
+                    )
+                self.assertEqual(runs(items), runs(unbatch(parsed)))
+                if kwargs['min_batch_size'] == 3:
+                    # A lone `utimes` remains an item.
+                    self.assertIn(si.utimes, {type(i) for i in parsed})
+
+            with tempfile.TemporaryFile() as f:
+                f.write(s)
+                f.seek(0)
+                self.assertEqual(runs(items), runs(unbatch(
+                    parse_send_stream_batches(f, min_batch_size=1),
+                )))
+
+        # Paths are stored as sent, but the items' paths are normalized.
+        batch = ItemBatch(si.chown)
+        batch.append(b'a//b/', (1, 2))
+        batch.append(memoryview(b'c'), (3, 4))
+        self.assertEqual(2, len(batch))
+        self.assertEqual(b'a//b/', batch.path(0))
+        self.assertEqual([
+            si.chown(path=b'a/b', uid=1, gid=2),
+            si.chown(path=b'c', uid=3, gid=4),
+        ], list(batch))
+
+    def test_zero_copy_data_and_position(self):
+        s = gold_demo_sendstreams()['create_ops']['sendstream']
+        for parse_fn in [_parse_stream_bytes, _parse_stream_via_file]:
+            items = list(parse_fn(s))
+            zc_items = list(parse_fn(s, zero_copy=True))
+            self.assertEqual(items, zc_items)
+            zc_writes = [
+                i for i in zc_items if isinstance(i, SendStreamItems.write)
+            ]
+            self.assertNotEqual([], zc_writes)
+            for i in zc_writes:
+                self.assertIsInstance(i.data, memoryview)
+            for i in items:
+                if isinstance(i, SendStreamItems.write):
+                    self.assertIsInstance(i.data, bytes)
+
+        # Both code paths stop right after the `END` command.
+        with tempfile.TemporaryFile() as f:
+            f.write(s + b'next')
+            f.seek(0)
+            list(parse_send_stream(f, zero_copy=True))
+            self.assertEqual(b'next', f.read())
+        infile = io.BytesIO(s + b'next')
+        list(parse_send_stream(infile, zero_copy=True))
+        self.assertEqual(b'next', infile.read())
+
     def test_errors(self):
         with self.assertRaisesRegex(RuntimeError, "Magic b'xxx', not "):
             check_magic(io.BytesIO(b'xxx'))
@@ -79,6 +277,182 @@ class ParseSendStreamTestCase(unittest.TestCase):
                 b'dog',
             )))
 
+    def test_check_crc(self):
+        s = gold_demo_sendstreams()['create_ops']['sendstream']
+        for zero_copy in [False, True]:
+            self._check_gold_parse(lambda s: _parse_stream_bytes(
+                s, zero_copy=zero_copy, check_crc=True,
+            ))
+
+            # Corrupt the last byte of the first `write`'s data.
+            write_idx = s.index(b'\0\0\0\0\0\0\0\0', 4096)
+            bad_s = s[:write_idx] + b'\1' + s[write_idx + 1:]
+            with self.assertRaisesRegex(RuntimeError, 'WRITE.* bad CRC'):
+                list(_parse_stream_bytes(
+                    bad_s, zero_copy=zero_copy, check_crc=True,
+                ))
+            # The corruption is not detected if we skip `WRITE`, or if we
+            # do not check CRCs at all.
+            for kwargs in [
+                {'check_crc': True, 'crc_skip_kinds': {CommandKind.WRITE}},
+                {'check_crc': False},
+            ]:
+                self.assertEqual(
+                    len(list(_parse_stream_bytes(s))),
+                    len(list(_parse_stream_bytes(
+                        bad_s, zero_copy=zero_copy, **kwargs,
+                    ))),
+                )
+
+    def test_keep_data(self):
+        s = gold_demo_sendstreams()['create_ops']['sendstream']
+        expected_items = [
+            SendStreamItems.update_extent(
+                path=i.path, offset=i.offset, len=len(i.data),
+            ) if isinstance(i, SendStreamItems.write) else i
+                for i in _parse_stream_bytes(s)
+        ]
+        self.assertNotEqual(expected_items, list(_parse_stream_bytes(s)))
+        for parse_fn in [
+            _parse_stream_bytes,
+            _parse_stream_via_file,
+            lambda s, **kwargs: parse_send_stream(
+                _UnseekableBytesIO(s), **kwargs,
+            ),
+        ]:
+            for kwargs in [{}, {'zero_copy': True}, {'check_crc': True}]:
+                self.assertEqual(expected_items, list(parse_fn(
+                    s, keep_data=False, **kwargs,
+                )))
+
+    def test_keep_data_errors(self):
+        path = _attribute(AttributeKind.PATH.value, b'cat')
+        offset = _attribute(AttributeKind.FILE_OFFSET.value, bytes(8))
+        data = _attribute(AttributeKind.DATA.value, b'meow')
+
+        def parse(*attrs, **kwargs):
+            return list(parse_send_stream(io.BytesIO(_stream_with_commands(
+                _command(CommandKind.WRITE, b''.join(attrs)),
+            )), keep_data=False, **kwargs))
+
+        with self.assertRaisesRegex(RuntimeError, 'truncated attribute'):
+            parse(path, b'\0')
+        with self.assertRaisesRegex(RuntimeError, 'PATH occurred twice'):
+            parse(path, path)
+        with self.assertRaisesRegex(RuntimeError, 'bad CRC'):
+            parse(path, offset, data, check_crc=True)
+        # Make the command claim to be shorter than its attributes.
+        with self.assertRaisesRegex(RuntimeError, 'DATA overruns the end'):
+            list(parse_send_stream(io.BytesIO(_stream_with_commands(
+                struct.pack('<IHI', 4, CommandKind.WRITE.value, 0) + data,
+            )), keep_data=False))
+        # Make the stream end before the command does.
+        with self.assertRaisesRegex(RuntimeError, 'PATH in .* got 1'):
+            list(parse_send_stream(io.BytesIO(_stream_with_commands(
+                _command(CommandKind.WRITE, path)[:-2],
+            )), keep_data=False))
+        with self.assertRaisesRegex(RuntimeError, 'with 2 bytes to skip'):
+            list(parse_send_stream(_UnseekableBytesIO(_stream_with_commands(
+                _command(CommandKind.WRITE, data)[:-2],
+            )), keep_data=False))
+        with self.assertRaisesRegex(RuntimeError, 'Not enough bytes'):
+            list(parse_send_stream(io.BytesIO(_stream_with_commands(
+                _command(CommandKind.WRITE, path + offset + data)[:-2],
+            )), keep_data=False))
+
+    def test_index_send_stream(self):
+        mkfile = _command(CommandKind.MKFILE, _attribute(
+            AttributeKind.PATH.value, b'cat',
+        ))
+        end = _command(CommandKind.END, b'')
+        self.assertEqual(
+            [17, 17 + len(mkfile), 17 + 2 * len(mkfile)],
+            index_send_stream(io.BytesIO(
+                _stream_with_commands(mkfile, mkfile, end) + b'junk',
+            )),
+        )
+        with self.assertRaisesRegex(RuntimeError, 'Not enough bytes'):
+            index_send_stream(io.BytesIO(_stream_with_commands(mkfile)))
+
+    def test_parallel(self):
+        stream_dict = gold_demo_sendstreams()
+        with tempfile.TemporaryDirectory() as td:
+
+            def parse_parallel(s, **kwargs):
+                path = os.path.join(td, 'sendstream')
+                with open(path, 'wb') as f:
+                    f.write(s)
+                return list(parse_send_stream_parallel(
+                    path, max_workers=2, **kwargs,
+                ))
+
+            for chunk_size in [1, 2 ** 23]:
+                self._check_gold_parse(lambda s: parse_parallel(
+                    s, chunk_size=chunk_size, check_crc=True,
+                ))
+            s = stream_dict['create_ops']['sendstream']
+            for kwargs in [{}, {'keep_data': False}]:
+                self.assertEqual(
+                    list(_parse_stream_bytes(s, **kwargs)),
+                    parse_parallel(s, chunk_size=1000, **kwargs),
+                )
+
+            # Corrupt the last byte of the first `write`'s data.
+            write_idx = s.index(b'\0\0\0\0\0\0\0\0', 4096)
+            bad_s = s[:write_idx] + b'\1' + s[write_idx + 1:]
+            with self.assertRaisesRegex(RuntimeError, 'WRITE.* bad CRC'):
+                parse_parallel(bad_s, check_crc=True)
+
+            # Nothing but `subvol` and `END`
+            s = _stream_with_commands(
+                s[17:17 + 10 + struct.unpack('<I', s[17:21])[0]],
+                _command(CommandKind.END, b''),
+            )
+            self.assertEqual(list(_parse_stream_bytes(s)), parse_parallel(s))
+
+            # Consumers may stop early without waiting for the whole parse.
+            path = os.path.join(td, 'sendstream')
+            with open(path, 'wb') as f:
+                f.write(stream_dict['create_ops']['sendstream'])
+            items = parse_send_stream_parallel(
+                path, max_workers=1, chunk_size=1,
+            )
+            self.assertIsInstance(next(items), SendStreamItems.subvol)
+            items.close()
+
+    def test_zero_copy_errors(self):
+        mkfile = _command(CommandKind.MKFILE, _attribute(
+            AttributeKind.PATH.value, b'cat',
+        ))
+        for parse_fn in [_parse_stream_bytes, _parse_stream_via_file]:
+
+            def parse(s):
+                return list(parse_fn(s, zero_copy=True))
+
+            with self.assertRaisesRegex(RuntimeError, 'for command header'):
+                parse(_stream_with_commands(mkfile, b'\0\0'))
+            with self.assertRaisesRegex(RuntimeError, 'CommandH.* got 4 b'):
+                parse(_stream_with_commands(mkfile[:-3]))
+            with self.assertRaisesRegex(RuntimeError, 'truncated attribute'):
+                parse(_stream_with_commands(
+                    _command(CommandKind.MKFILE, b'\0\0'),
+                ))
+            with self.assertRaisesRegex(RuntimeError, 'length 5 .* got 3 b'):
+                parse(_stream_with_commands(_command(
+                    CommandKind.MKFILE,
+                    struct.pack('<HH', AttributeKind.PATH.value, 5) + b'cat',
+                )))
+            with self.assertRaisesRegex(RuntimeError, 'Unknown attribute 99'):
+                parse(_stream_with_commands(
+                    _command(CommandKind.MKFILE, _attribute(99, b'')),
+                ))
+            with self.assertRaisesRegex(RuntimeError, '\\.PATH occurred tw'):
+                parse(_stream_with_commands(_command(
+                    CommandKind.MKFILE,
+                    _attribute(AttributeKind.PATH.value, b'cat') +
+                        _attribute(AttributeKind.PATH.value, b'dog'),
+                )))
+
 
 if __name__ == '__main__':
     unittest.main()
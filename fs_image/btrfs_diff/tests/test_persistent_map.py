@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import copy
+import pickle
+import random
+import unittest
+
+from types import MappingProxyType
+
+from ..freeze import freeze
+from ..persistent_map import PersistentIntMap, get_mut
+
+
+class PersistentIntMapTestCase(unittest.TestCase):
+
+    def test_mapping(self):
+        m = PersistentIntMap({3: 'c', 1: 'a'})
+        self.assertEqual(2, len(m))
+        self.assertEqual('a', m[1])
+        self.assertEqual('d', m.get(4, 'd'))
+        for bad_key in [-1, 'a', 2, 1 << 40]:
+            with self.assertRaises(KeyError):
+                m[bad_key]
+        self.assertNotIn(-1, m)
+
+        # Grow the tree by a few levels, check that the order is by key.
+        m[100000] = 'big'
+        m[32] = 'x'
+        self.assertNotIn(5000, m)  # Its leaf does not exist
+        self.assertEqual([1, 3, 32, 100000], list(m))
+        self.assertEqual(['a', 'c', 'x', 'big'], list(m.values()))
+        self.assertEqual(
+            "PersistentIntMap({1: 'a', 3: 'c', 32: 'x', 100000: 'big'})",
+            repr(m),
+        )
+
+        m[3] = 'C'  # Overwriting does not change the length
+        del m[100000]
+        with self.assertRaises(KeyError):
+            del m[100000]
+        self.assertEqual({1: 'a', 3: 'C', 32: 'x'}, dict(m.items()))
+        self.assertEqual(3, len(m))
+
+    def test_snapshot(self):
+        m = PersistentIntMap((i, [i]) for i in range(100))
+        s = m.snapshot()
+        self.assertIs(m[5], s[5])
+
+        # Writes to either side do not affect the other.
+        m[5] = ['m']
+        del s[6]
+        s[200] = ['s']
+        self.assertEqual((['m'], [5]), (m[5], s[5]))
+        self.assertEqual(([6], None), (m[6], s.get(6)))
+        self.assertEqual((None, ['s']), (m.get(200), s[200]))
+        self.assertEqual((100, 100), (len(m), len(s)))
+
+        # `get_mut` copies shared values once, but not owned ones.
+        self.assertIs(m[5], m.get_mut(5, list))
+        v = s.get_mut(7, list)
+        self.assertEqual([7], v)
+        self.assertIsNot(m[7], v)
+        self.assertIs(v, s.get_mut(7, list))
+        v.append('s')
+        self.assertEqual(([7], [7, 's']), (m[7], s[7]))
+        for missing in [6, 1 << 20]:  # In an existing leaf, or not
+            with self.assertRaises(KeyError):
+                s.get_mut(missing, list)
+
+        # The untouched values are still shared.
+        self.assertIs(m[50], s[50])
+
+    def test_snapshots_match_dicts(self):
+        rnd = random.Random(0)
+        maps = [PersistentIntMap()]
+        dicts = [{}]
+        for _ in range(3000):
+            idx = rnd.randrange(len(maps))
+            m, d = maps[idx], dicts[idx]
+            key = rnd.randrange(2000)
+            op = rnd.choice('ssddsm')
+            if op == 's':
+                value = rnd.random()
+                m[key], d[key] = [value], [value]
+            elif op == 'd':
+                if key in d:
+                    del m[key], d[key]
+            elif key in d:
+                m.get_mut(key, list).append(1)
+                d[key] = d[key] + [1]
+            if rnd.random() < 0.02:
+                maps.append(m.snapshot())
+                dicts.append(copy.deepcopy(d))
+        for m, d in zip(maps, dicts):
+            self.assertEqual(d, dict(m.items()))
+            self.assertEqual(sorted(d), list(m))
+            self.assertEqual(len(d), len(m))
+
+    def test_deepcopy_and_freeze(self):
+        m = PersistentIntMap({1: [1], 40: [40]})
+        m_copy = copy.deepcopy(m)
+        self.assertIsInstance(m_copy, PersistentIntMap)
+        self.assertEqual({1: [1], 40: [40]}, dict(m_copy.items()))
+        self.assertIsNot(m[1], m_copy[1])
+
+        frozen = m.freeze(_memo={})
+        self.assertIsInstance(frozen, MappingProxyType)
+        self.assertEqual({1: (1,), 40: (40,)}, frozen)
+
+    def test_get_mut(self):
+        d = {1: [1]}
+        self.assertIs(d[1], get_mut(d, 1, list))
+        m = PersistentIntMap(d).snapshot()
+        self.assertIsNot(d[1], get_mut(m, 1, list))
+
+    def test_diff_keys(self):
+        rnd = random.Random(0)
+        m = PersistentIntMap({i: [i] for i in range(0, 3000, 3)})
+        for _ in range(30):
+            m1 = m.snapshot()
+            m2 = m.snapshot()
+            d1 = dict(m1.items())
+            d2 = dict(m2.items())
+            for mx, dx in [(m1, d1), (m2, d2)]:
+                for _ in range(rnd.randrange(10)):
+                    # Sometimes grows the tree by a level or two.
+                    key = rnd.randrange(rnd.choice([3000, 40000, 2000000]))
+                    op = rnd.choice(['set', 'del', 'mut'])
+                    if op == 'set':
+                        mx[key] = dx[key] = [key]
+                    elif op == 'del' and key in dx:
+                        del mx[key], dx[key]
+                    elif op == 'mut' and key in dx:
+                        mx.get_mut(key, list).append(1)
+                        dx[key] = mx[key]
+            expected = sorted(
+                k for k in d1.keys() | d2.keys()
+                    if d1.get(k) is not d2.get(k)
+            )
+            self.assertEqual(expected, list(m1.diff_keys(m2)))
+            self.assertEqual(expected, list(m2.diff_keys(m1)))
+            self.assertEqual([], list(m1.diff_keys(m1)))
+        self.assertEqual(
+            list(range(0, 3000, 3)), list(m.diff_keys(PersistentIntMap())),
+        )
+
+    def test_pickle(self):
+        m = PersistentIntMap({i: [i] for i in range(100)})
+        snap = m.snapshot()
+        m.get_mut(5, list).append(6)
+        m_copy, snap_copy = pickle.loads(pickle.dumps((m, snap)))
+        self.assertEqual(dict(m.items()), dict(m_copy.items()))
+        self.assertEqual(dict(snap.items()), dict(snap_copy.items()))
+        # The copies still share their unchanged values, and copy them
+        # before changing them.
+        self.assertIs(m_copy[7], snap_copy[7])
+        m_copy.get_mut(7, list).append(8)
+        snap_copy.get_mut(9, list).append(10)
+        self.assertEqual([7, 8], m_copy[7])
+        self.assertEqual([7], snap_copy[7])
+        self.assertEqual([9], m_copy[9])
+        self.assertEqual([9, 10], snap_copy[9])
+        self.assertEqual({i: (i,) for i in range(100)}, freeze(snap))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import io
+import json
+import unittest
+
+from ..freeze import freeze
+from ..rendered_tree import emit_non_unique_traversal_ids
+from ..rendered_tree_json import write_subvolume_json, write_subvolumes_json
+
+from .subvolume_utils import make_hardlinked_subvol
+
+
+def _make_subvol(description):
+    return freeze(make_hardlinked_subvol(description=description))
+
+
+class RenderedTreeJsonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def test_write_subvolume_json(self):
+        subvol = _make_subvol('cat')
+        for top_path in [b'.', b'd', b'd/./e/', b'd/empty', b'top', b'd/f']:
+            for indent in [0, 2, 4]:
+                out = io.StringIO()
+                write_subvolume_json(
+                    out, subvol, top_path=top_path, indent=indent,
+                )
+                self.assertEqual(json.dumps(
+                    emit_non_unique_traversal_ids(subvol.render(top_path)),
+                    sort_keys=True, indent=indent,
+                ), out.getvalue())
+
+    def test_write_subvolumes_json(self):
+        for name_to_subvol in [
+            {}, {'cat': _make_subvol('cat'), 'bat': _make_subvol('bat')},
+        ]:
+            out = io.StringIO()
+            write_subvolumes_json(out, name_to_subvol, indent=3)
+            self.assertEqual(json.dumps({
+                name: emit_non_unique_traversal_ids(subvol.render())
+                    for name, subvol in name_to_subvol.items()
+            }, sort_keys=True, indent=3), out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
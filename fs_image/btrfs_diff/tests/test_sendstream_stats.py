@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import collections
+import io
+import json
+import tracemalloc
+import unittest
+
+from ..parse_send_stream import parse_send_stream
+from ..sendstream_stats import apply_sendstreams_with_stats, item_bytes
+from ..subvolume_set import SubvolumeSet
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+
+class SendStreamStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sendstreams = [
+            gold_demo_sendstreams()[name]['sendstream']
+                for name in ['create_ops', 'mutate_ops']
+        ]
+
+    def _check_stats(self, stats):
+        kind_to_count = collections.Counter()
+        kind_to_bytes = collections.Counter()
+        for sendstream in self.sendstreams:
+            for item in parse_send_stream(io.BytesIO(sendstream)):
+                kind_to_count[type(item).__name__] += 1
+                kind_to_bytes[type(item).__name__] += item_bytes(item)
+        self.assertEqual(kind_to_count, {
+            kind: ks.count for kind, ks in stats.kind_to_stats.items()
+        })
+        self.assertEqual(+kind_to_bytes, +collections.Counter({
+            kind: ks.bytes for kind, ks in stats.kind_to_stats.items()
+        }))
+        self.assertGreater(kind_to_bytes['write'], 0)
+        self.assertGreater(kind_to_bytes['clone'], 0)
+        self.assertGreater(kind_to_bytes['set_xattr'], 0)
+        for ks in stats.kind_to_stats.values():
+            self.assertGreater(ks.parse_sec, 0)
+            self.assertGreater(ks.apply_sec, 0)
+
+        self.assertEqual(
+            ['apply #0', 'apply #1', 'freeze'],
+            [s.name for s in stats.stages],
+        )
+        for kind in ['write', 'snapshot']:
+            self.assertIn(kind, stats.format())
+        self.assertEqual(
+            json.loads(json.dumps(stats.to_json_dict())),
+            stats.to_json_dict(),
+        )
+
+    def test_stats(self):
+        frozen, stats = apply_sendstreams_with_stats(
+            [io.BytesIO(s) for s in self.sendstreams],
+        )
+        self.assertIsInstance(frozen, SubvolumeSet)
+        self.assertEqual(2, len(frozen.uuid_to_subvolume))
+        self._check_stats(stats)
+        self.assertEqual(
+            [None] * 3, [s.peak_bytes for s in stats.stages],
+        )
+
+    def test_trace_memory(self):
+        for already_tracing in [False, True]:
+            if already_tracing:
+                tracemalloc.start()
+                self.addCleanup(tracemalloc.stop)
+            _, stats = apply_sendstreams_with_stats(
+                [io.BytesIO(s) for s in self.sendstreams],
+                trace_memory=True,
+            )
+            self._check_stats(stats)
+            for stage in stats.stages:
+                self.assertGreater(stage.peak_bytes, 0)
+            self.assertIn('peak_MiB', stats.format())
+            self.assertEqual(already_tracing, tracemalloc.is_tracing())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 import copy
+import sys
 import unittest
 
+from ..clone_index import CloneIndex
 from ..coroutine_utils import while_not_exited
 from ..extent import Extent
 from ..freeze import freeze
 from ..inode_id import InodeIDMap
 from ..parse_dump import SendStreamItems
+from ..send_stream import ItemBatch
 from ..rendered_tree import (
     emit_all_traversal_ids, emit_non_unique_traversal_ids, map_bottom_up,
     TraversalID,
@@ -14,7 +17,9 @@ from ..rendered_tree import (
 from ..subvolume import Subvolume
 
 from .deepcopy_test import DeepCopyTestCase
-from .subvolume_utils import InodeRepr, expected_subvol_add_traversal_ids
+from .subvolume_utils import (
+    InodeRepr, expected_subvol_add_traversal_ids, make_hardlinked_subvol,
+)
 
 # `unittest`'s output shortening makes tests much harder to debug.
 unittest.util._MAX_LENGTH = 12345
@@ -228,6 +233,12 @@ class SubvolumeTestCase(DeepCopyTestCase):
                 '(File h5(tiger@tamaskan:5+5@0)d5(tiger@tamaskan:10+5@0))'
             ],
         }], freeze(tiger))
+        # The same clones, as linear-size `extent_refs`
+        self._check_render(['(Dir o123:456)', {
+            'wolf': ['(Char m444 4321)'],
+            'tamaskan': ['(File m700 d3h7(#0:0+7@0)d10(#1:0+10@0))'],
+            'dolly': ['(File h5(#0:2+5@0)d5(#1:0+5@0))'],
+        }], freeze(tiger, extent_ids=True))
         # We're about to clone from `cat`, so allow it do be `deepcopy`d here.
         cat = yield 'tiger clones from cat', cat
         self._check_both_renders(cat_final_repr, cat)
@@ -339,6 +350,174 @@ class SubvolumeTestCase(DeepCopyTestCase):
     def test_subvolume(self):
         self.check_deepcopy_at_each_step(self._check_subvolume)
 
+    def test_snapshot(self):
+        si = SendStreamItems
+        cat = Subvolume.new(id_map=InodeIDMap.new(description='cat'))
+        cat.apply_item(si.mkdir(path=b'd'))
+        cat.apply_item(si.mkfile(path=b'd/a'))
+        cat.apply_item(si.write(path=b'd/a', offset=0, data=b'abc'))
+        cat.apply_item(si.mkfile(path=b'b'))
+        tiger = cat.snapshot(description='tiger')
+        self.assertEqual(4, len(tiger.id_to_inode))
+
+        # The snapshot shares the inodes until they are modified.
+        self.assertIs(cat.inode_at_path(b'b'), tiger.inode_at_path(b'b'))
+        self.assertNotEqual(cat.id_map.get_id(b'b'), tiger.id_map.get_id(b'b'))
+        with self.assertRaises(KeyError):
+            tiger.id_to_inode[cat.id_map.get_id(b'b')]
+        with self.assertRaises(KeyError):
+            tiger.id_to_inode[3]
+
+        tiger.apply_item(si.chmod(path=b'b', mode=0o600))
+        tiger.apply_item(si.rename(path=b'd/a', dest=b'c'))
+        tiger.apply_item(si.rmdir(path=b'd'))
+        cat.apply_item(si.truncate(path=b'd/a', size=1))
+        self.assertIsNot(cat.inode_at_path(b'b'), tiger.inode_at_path(b'b'))
+
+        self._check_render(['(Dir)', {
+            'b': ['(File)'],
+            'd': ['(Dir)', {'a': ['(File d1)']}],
+        }], freeze(cat))
+        self._check_render(['(Dir)', {
+            'b': ['(File m600)'],
+            'c': ['(File d3)'],
+        }], freeze(tiger))
+        self.assertEqual(
+            ['(File d3)', '(File m600)'],
+            [repr(ino) for ino in tiger.id_to_inode.values()][1:],
+        )
+
+    def test_apply_batch(self):
+        si = SendStreamItems
+        cat = Subvolume.new(id_map=InodeIDMap.new(description='cat'))
+        cat.apply_item(si.mkdir(path=b'd'))
+        cat.apply_item(si.mkfile(path=b'd/a'))
+        cat.apply_item(si.symlink(path=b's', dest=b'd/a'))
+        tiger = cat.snapshot(description='tiger')
+
+        batches = [ItemBatch(t) for t in (si.chmod, si.chown, si.utimes)]
+        batches[0].append(b'd/a', (0o640,))
+        batches[0].append(b'd/', (0o750,))
+        batches[1].append(b'd/a', (1, 2))
+        batches[1].append(b's', (3, 4))
+        batches[2].append(b'd', (5, 6, 7, 8, 9, 10))
+        # Applying the equivalent items to `lion` gives the same result.
+        lion = cat.snapshot(description='lion')
+        for batch in batches:
+            tiger.apply_batch(batch)
+            for item in batch:
+                lion.apply_item(item)
+        for subvol in [tiger, lion]:
+            self._check_render(['(Dir)', {
+                'd': ['(Dir m750 t70/01/01.00:00:05+2+2)', {
+                    'a': ['(File m640 o1:2)'],
+                }],
+                's': ['(Symlink o3:4 d/a)'],
+            }], subvol)
+        # The inodes of the parent are unchanged.
+        self._check_render(['(Dir)', {
+            'd': ['(Dir)', {'a': ['(File)']}],
+            's': ['(Symlink d/a)'],
+        }], cat)
+
+        for path, values, error in [
+            (b'x', (0o644,), 'path does not exist'),
+            (b'd/a', (0o100644,), 'cannot change file type bits'),
+            (b's', (0o644,), 'cannot chmod symlink'),
+        ]:
+            batch = ItemBatch(si.chmod)
+            batch.append(path, values)
+            with self.assertRaisesRegex(RuntimeError, error):
+                tiger.apply_batch(batch)
+
+    def test_clone_index(self):
+        si = SendStreamItems
+        index = CloneIndex()
+        cat = Subvolume.new(
+            id_map=InodeIDMap.new(description='cat'), clone_index=index,
+        )
+        cat.apply_item(si.mkfile(path=b'a'))
+        cat.apply_item(si.write(path=b'a', offset=0, data=b'abc'))
+        cat.apply_item(si.mkfile(path=b'b'))
+        cat.apply_item(si.mkdir(path=b'd'))
+        cat.apply_item(si.chmod(path=b'd', mode=0o755))
+        cat.apply_clone(si.clone(
+            path=b'b', offset=0, len=2, from_uuid='', from_transid=0,
+            from_path=b'a', clone_offset=1,
+        ), cat)
+        a_id, b_id = (cat.id_map.get_id(p) for p in (b'a', b'b'))
+        self.assertEqual({b_id}, index.clone_peers(a_id))
+        self._check_render(['(Dir)', {
+            'a': ['(File d3(cat@b:0+2@1))'],
+            'b': ['(File d2(cat@a:1+2@0))'],
+            'd': ['(Dir m755)', {}],
+        }], freeze(cat, id_to_chunks=index.id_to_chunks([a_id, b_id])))
+
+        cat.apply_item(si.rmdir(path=b'd'))
+        cat.apply_item(si.unlink(path=b'b'))
+        self.assertEqual(set(), index.clone_peers(a_id))
+
+    def test_map_bottom_up_parallel(self):
+        # How its names sort as `bytes` vs `str`s must not affect the IDs.
+        subvol = make_hardlinked_subvol()
+
+        with self.assertRaisesRegex(RuntimeError, 'requires a frozen Subv'):
+            subvol.map_bottom_up_parallel(repr)
+        subvol = freeze(subvol)
+        # Hardlinks share a nonce, which is what `render` numbers.
+        self.assertEqual(
+            subvol.inode_nonce(b'd/f'), subvol.inode_nonce(b'\xff/h'),
+        )
+        self.assertNotEqual(
+            subvol.inode_nonce(b'd/f'), subvol.inode_nonce(b'top'),
+        )
+        with self.assertRaisesRegex(RuntimeError, 'does not exist'):
+            subvol.inode_nonce(b'nope')
+        for path in [b'.', b'd', b'd/./', b'top']:
+            self.assertEqual(
+                subvol.map_bottom_up(repr, top_path=path),
+                subvol.map_bottom_up_parallel(
+                    repr, top_path=path, max_workers=2,
+                ),
+            )
+            for emit_fn in [
+                emit_all_traversal_ids, emit_non_unique_traversal_ids,
+            ]:
+                self.assertEqual(
+                    emit_fn(subvol.render(top_path=path)),
+                    emit_fn(subvol.render_parallel(
+                        top_path=path, max_workers=2,
+                    )),
+                )
+
+    def test_deep_tree(self):
+        # Deeper than the recursion limit, which used to be an error.
+        depth = sys.getrecursionlimit() + 10
+        si = SendStreamItems
+        subvol = Subvolume.new(id_map=InodeIDMap.new())
+        for i in range(depth):
+            subvol.apply_item(si.mkdir(path=b'/'.join([b'd'] * (i + 1))))
+        subvol.apply_item(si.mkfile(path=b'/'.join([b'd'] * depth + [b'f'])))
+
+        with while_not_exited(subvol.gather_bottom_up(b'd/.')) as ctx:
+            paths = []
+            result = None
+            while True:
+                path, ino, child_results = ctx.send(result)
+                paths.append(path)
+                result = 1 + sum((child_results or {}).values())
+        self.assertEqual(depth + 1, ctx.result)
+        self.assertEqual(b'/'.join([b'd'] * depth + [b'f']), paths[0])
+        self.assertEqual(b'/'.join([b'd'] * depth), paths[1])
+        self.assertEqual(b'd/.', paths[-1])
+
+        ser = emit_all_traversal_ids(subvol.render())
+        ino = ser
+        for i in range(depth):
+            ino = ino[1]['d']
+        self.assertEqual([['(File)', 0]], ino[1]['f'])
+        self.assertEqual(['(Dir)', depth + 1], ser[0])
+
     def test_rendered_tree(self):
         'Miscellaneous coverage over `rendered_tree.py`.'
         with self.assertRaisesRegex(RuntimeError, 'Unknown type in rendered'):
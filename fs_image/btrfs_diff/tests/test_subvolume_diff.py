@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import unittest
+
+from ..freeze import freeze
+from ..parse_dump import SendStreamItems
+from ..subvolume_diff import _changed_int_ids, diff_subvolumes, DiffKind
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+si = SendStreamItems
+
+
+def _make_subvols():
+    subvols = SubvolumeSet.new()
+    mutator = SubvolumeSetMutator.new(
+        subvols, si.subvol(path=b'cat', uuid=b'u0', transid=1),
+    )
+    for item in [
+        si.mkdir(path=b'a'),
+        si.mkdir(path=b'a/b'),
+        si.mkfile(path=b'a/b/f'),
+        si.write(path=b'a/b/f', offset=0, data=b'abcde'),
+        si.mkfile(path=b'a/g'),
+        si.mkdir(path=b'c'),
+        si.mkfile(path=b'c/h'),
+        si.mkfile(path=b'same'),
+        si.write(path=b'same', offset=0, data=b'0123456789'),
+        si.mkfile(path=b'rw'),
+        si.write(path=b'rw', offset=0, data=b'abc'),
+        si.mkfile(path=b'top'),
+        si.link(path=b'a/hl', dest=b'top'),
+    ]:
+        mutator.apply_item(item)
+    mutator = SubvolumeSetMutator.new(subvols, si.snapshot(
+        path=b'tiger', uuid=b'u1', transid=1, parent_uuid=b'u0',
+        parent_transid=1,
+    ))
+    for item in [
+        si.write(path=b'a/b/f', offset=5, data=b'xyz'),
+        si.chmod(path=b'a', mode=0o700),
+        si.mkfile(path=b'a/new'),
+        si.rename(path=b'a/g', dest=b'a/z'),
+        si.unlink(path=b'c/h'),
+        si.rmdir(path=b'c'),
+        # Only detected before freezing, see the module docblock.
+        si.write(path=b'rw', offset=0, data=b'xyz'),
+        si.unlink(path=b'top'),
+        si.mkdir(path=b'top'),
+        si.mkfile(path=b'top/x'),
+        # These copy the inodes of `a/hl` and `same`, but leave them be.
+        si.set_xattr(path=b'a/hl', name=b'user.x', data=b'x'),
+        si.remove_xattr(path=b'a/hl', name=b'user.x'),
+        si.truncate(path=b'same', size=12),
+        si.truncate(path=b'same', size=10),
+        # Splits the chunks of `same` in both subvolumes when frozen.
+        si.mkfile(path=b'clone_dst'),
+        si.clone(
+            path=b'clone_dst', offset=0, len=3, from_uuid=b'u0',
+            from_transid=1, from_path=b'same', clone_offset=4,
+        ),
+    ]:
+        mutator.apply_item(item)
+    return subvols
+
+
+def _diff(old, new, top_path=b'.'):
+    return [
+        (d.kind, d.path) for d in diff_subvolumes(old, new, top_path)
+    ]
+
+
+ADDED, REMOVED, CHANGED = DiffKind.ADDED, DiffKind.REMOVED, DiffKind.CHANGED
+
+
+class SubvolumeDiffTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+        self.subvols = _make_subvols()
+        self.cat = self.subvols.get_by_rendered_id('cat')
+        self.tiger = self.subvols.get_by_rendered_id('tiger')
+        self.expected = [
+            (CHANGED, b'a'),
+            (CHANGED, b'a/b/f'),
+            (REMOVED, b'a/g'),
+            (ADDED, b'a/new'),
+            (ADDED, b'a/z'),
+            (REMOVED, b'c'),
+            (REMOVED, b'c/h'),
+            (ADDED, b'clone_dst'),
+            (CHANGED, b'rw'),
+            (CHANGED, b'top'),
+            (ADDED, b'top/x'),
+        ]
+
+    def test_diff(self):
+        self.assertEqual(self.expected, _diff(self.cat, self.tiger))
+        self.assertEqual([
+            ({ADDED: REMOVED, REMOVED: ADDED}.get(kind, kind), path)
+                for kind, path in self.expected
+        ], _diff(self.tiger, self.cat))
+        self.assertEqual([], _diff(self.cat, self.cat))
+
+        d = next(diff_subvolumes(self.cat, self.tiger, b'a/b/f'))
+        self.assertEqual(CHANGED, d.kind)
+        self.assertEqual(self.cat.inode_at_path(b'a/b/f'), d.old)
+        self.assertEqual(self.tiger.inode_at_path(b'a/b/f'), d.new)
+
+    def test_skips_unchanged_subtrees(self):
+        changed = _changed_int_ids(self.cat, self.tiger)
+        for path in [b'.', b'a', b'a/b', b'a/b/f', b'c/h']:
+            self.assertIn(self.cat.id_map.get_id(path).id, changed, path)
+        # A rename only changes the parent directories.
+        self.assertNotIn(self.cat.id_map.get_id(b'a/g').id, changed)
+
+    def test_frozen(self):
+        frozen = freeze(self.subvols)
+        frozen_cat = frozen.get_by_rendered_id('cat')
+        frozen_tiger = frozen.get_by_rendered_id('tiger')
+        self.assertIsNone(_changed_int_ids(frozen_cat, frozen_tiger))
+        # The clone annotations of `same` differ, but its content does not.
+        self.assertNotEqual(
+            repr(frozen_cat.inode_at_path(b'same')),
+            repr(frozen_tiger.inode_at_path(b'same')),
+        )
+        expected = [d for d in self.expected if d != (CHANGED, b'rw')]
+        self.assertEqual(expected, _diff(frozen_cat, frozen_tiger))
+        self.assertEqual(expected, _diff(self.cat, frozen_tiger))
+        self.assertEqual(expected, _diff(frozen_cat, self.tiger))
+
+    def test_unrelated_subvolumes(self):
+        other = _make_subvols()
+        other_cat = other.get_by_rendered_id('cat')
+        # Without shared extents, we cannot tell if the data is the same.
+        self.assertEqual(
+            [(CHANGED, b'a/b/f'), (CHANGED, b'rw'), (CHANGED, b'same')],
+            _diff(self.cat, other_cat),
+        )
+        self.assertEqual([], _diff(freeze(self.cat), freeze(other_cat)))
+
+    def test_top_path(self):
+        self.assertEqual([
+            (CHANGED, b'a'),
+            (CHANGED, b'a/b/f'),
+            (REMOVED, b'a/g'),
+            (ADDED, b'a/new'),
+            (ADDED, b'a/z'),
+        ], _diff(self.cat, self.tiger, b'a/'))
+        self.assertEqual(
+            [(REMOVED, b'c'), (REMOVED, b'c/h')],
+            _diff(self.cat, self.tiger, b'./c'),
+        )
+        self.assertEqual([], _diff(self.cat, self.tiger, b'nonexistent'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 import unittest
 
+from ..clone_index import CloneIndex
+from ..extent import Extent
+from ..extents_to_chunks import extent_ids_to_chunk_clones
 from ..freeze import freeze
+from ..interval_extent import IntervalExtent
 from ..parse_dump import SendStreamItems
 from ..rendered_tree import emit_all_traversal_ids
+from ..send_stream import ItemBatch
 from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
 
 from .subvolume_utils import expected_subvol_add_traversal_ids
@@ -33,6 +38,31 @@ class SubvolumeSetTestCase(unittest.TestCase):
                 )
         ])
 
+    def _check_extent_ids(self, subvol_set: SubvolumeSet):
+        'The linear clone representation converts to the quadratic one.'
+
+        def ids_and_inodes(frozen):
+            return [
+                (id, ino) for sv in frozen.uuid_to_subvolume.values()
+                    for id, ino in sv.id_to_inode.items()
+            ]
+
+        linear = ids_and_inodes(freeze(subvol_set, extent_ids=True))
+        id_to_chunks = dict(extent_ids_to_chunk_clones([
+            (id, ino.chunks) for id, ino in linear if ino.chunks is not None
+        ]))
+        self.assertEqual(
+            {
+                repr(id): repr(ino)
+                    for id, ino in ids_and_inodes(freeze(subvol_set))
+            },
+            {
+                repr(id): repr(ino._replace(
+                    chunks=id_to_chunks.get(id, ino.chunks),
+                )) for id, ino in linear
+            },
+        )
+
     def test_subvolume_set(self):
         si = SendStreamItems
         subvols = SubvolumeSet.new()
@@ -68,6 +98,7 @@ class SubvolumeSetTestCase(unittest.TestCase):
             }],
         }, freeze(subvols)))
         self._check_repr(*reprs_and_frozens[-1])
+        self._check_extent_ids(subvols)
 
         # `tiger` is a snapshot of `cat`
         tiger_mutator = SubvolumeSetMutator.new(subvols, si.snapshot(
@@ -97,6 +128,7 @@ class SubvolumeSetTestCase(unittest.TestCase):
             }],
         }, freeze(subvols)))
         self._check_repr(*reprs_and_frozens[-1])
+        self._check_extent_ids(subvols)
 
         # Check our accessors
         self.assertEqual(
@@ -137,6 +169,7 @@ class SubvolumeSetTestCase(unittest.TestCase):
             }],
         }, freeze(subvols)))
         self._check_repr(*reprs_and_frozens[-1])
+        self._check_extent_ids(subvols)
 
         # Get `repr` to show some disambiguation
         cat2 = SubvolumeSetMutator.new(subvols, si.subvol(
@@ -183,6 +216,115 @@ class SubvolumeSetTestCase(unittest.TestCase):
         for expected, frozen in reprs_and_frozens:
             self._check_repr(expected, frozen)
 
+    def test_extent_class(self):
+        si = SendStreamItems
+        subvols = SubvolumeSet.new()
+        cat_mutator = SubvolumeSetMutator.new(subvols, si.subvol(
+            path=b'cat', uuid=b'abe', transid=3,
+        ), extent_class=IntervalExtent)
+        cat_mutator.apply_item(si.mkfile(path=b'from'))
+        cat_mutator.apply_item(si.write(path=b'from', offset=0, data='hi'))
+        cat_mutator.apply_item(si.mkfile(path=b'to'))
+        cat_mutator.apply_item(si.clone(
+            path=b'to', offset=0, from_uuid=b'abe', from_transid=3,
+            from_path=b'from', clone_offset=0, len=2,
+        ))
+        cat = cat_mutator.subvolume
+        self.assertIs(IntervalExtent, cat.extent_class)
+        self.assertIsInstance(cat.inode_at_path(b'to').extent, IntervalExtent)
+
+        # Snapshots inherit `extent_class`, unless it is specified.
+        tiger = SubvolumeSetMutator.new(subvols, si.snapshot(
+            path=b'tiger', uuid=b'ee', transid=7,
+            parent_uuid=b'abe', parent_transid=3,
+        )).subvolume
+        self.assertIs(IntervalExtent, tiger.extent_class)
+        lion_mutator = SubvolumeSetMutator.new(subvols, si.snapshot(
+            path=b'lion', uuid=b'ff', transid=7,
+            parent_uuid=b'abe', parent_transid=3,
+        ), extent_class=Extent)
+        self.assertIs(Extent, lion_mutator.subvolume.extent_class)
+        lion_mutator.apply_item(si.unlink(path=b'from'))
+        lion_mutator.apply_item(si.mkfile(path=b'new'))
+        self.assertIsInstance(
+            lion_mutator.subvolume.inode_at_path(b'new').extent, Extent,
+        )
+
+        # Clones are tracked across subvolumes & engines.
+        self._check_repr({
+            'cat': ['(Dir)', {
+                'from': ['(File d2(cat@to:0+2@0/lion@to:0+2@0/'
+                         'tiger@from:0+2@0/tiger@to:0+2@0))'],
+                'to': ['(File d2(cat@from:0+2@0/lion@to:0+2@0/'
+                       'tiger@from:0+2@0/tiger@to:0+2@0))'],
+            }],
+            'tiger': ['(Dir)', {
+                'from': ['(File d2(cat@from:0+2@0/cat@to:0+2@0/'
+                         'lion@to:0+2@0/tiger@to:0+2@0))'],
+                'to': ['(File d2(cat@from:0+2@0/cat@to:0+2@0/'
+                       'lion@to:0+2@0/tiger@from:0+2@0))'],
+            }],
+            'lion': ['(Dir)', {
+                'to': ['(File d2(cat@from:0+2@0/cat@to:0+2@0/'
+                       'tiger@from:0+2@0/tiger@to:0+2@0))'],
+                'new': ['(File)'],
+            }],
+        }, freeze(subvols))
+
+    def test_clone_index(self):
+        si = SendStreamItems
+        index = CloneIndex()
+        subvols = SubvolumeSet.new(clone_index=index)
+        cat_mutator = SubvolumeSetMutator.new(subvols, si.subvol(
+            path=b'cat', uuid=b'abe', transid=3,
+        ))
+        self.assertIs(index, cat_mutator.subvolume.clone_index)
+        cat_mutator.apply_item(si.mkfile(path=b'from'))
+        cat_mutator.apply_item(si.write(path=b'from', offset=0, data='hi'))
+        tiger_mutator = SubvolumeSetMutator.new(subvols, si.snapshot(
+            path=b'tiger', uuid=b'ee', transid=7,
+            parent_uuid=b'abe', parent_transid=3,
+        ))
+        # The snapshot shares the index, and its files are in it.
+        self.assertIs(index, tiger_mutator.subvolume.clone_index)
+        from_id, tiger_from_id = (
+            mut.subvolume.id_map.get_id(b'from')
+                for mut in (cat_mutator, tiger_mutator)
+        )
+        self.assertEqual({tiger_from_id}, index.clone_peers(from_id))
+        tiger_mutator.apply_item(si.mkfile(path=b'to'))
+        tiger_mutator.apply_item(si.clone(
+            path=b'to', offset=0, from_uuid=b'abe', from_transid=3,
+            from_path=b'from', clone_offset=1, len=1,
+        ))
+        # Copies the inode of `from`, which the index has to track.
+        batch = ItemBatch(si.chmod)
+        batch.append(b'from', (0o600,))
+        tiger_mutator.apply_batch(batch)
+
+        expected = {
+            'cat': ['(Dir)', {
+                'from': ['(File d2(tiger@from:0+2@0/tiger@to:0+1@1))'],
+            }],
+            'tiger': ['(Dir)', {
+                'from': ['(File m600 d2(cat@from:0+2@0/tiger@to:0+1@1))'],
+                'to': ['(File d1(cat@from:1+1@0/tiger@from:1+1@0))'],
+            }],
+        }
+        self._check_repr(expected, freeze(subvols))
+        # The `extent_ids` variant does not use the index.
+        self._check_extent_ids(subvols)
+        # Freezing again reuses the cached `Chunk`s.
+        self._check_repr(expected, freeze(subvols))
+
+        # A rejected snapshot must not leave its files in the index.
+        with self.assertRaisesRegex(RuntimeError, ' is already in use: '):
+            SubvolumeSetMutator.new(subvols, si.snapshot(
+                path=b'lion', uuid=b'ee', transid=9,
+                parent_uuid=b'abe', parent_transid=3,
+            ))
+        self._check_repr(expected, freeze(subvols))
+
     def test_errors(self):
         si = SendStreamItems
         subvols = SubvolumeSet.new()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import io
+import os
+import tempfile
+import unittest
+
+from ..freeze import freeze
+from ..parse_send_stream import parse_send_stream
+from ..rendered_tree import emit_all_traversal_ids
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+from ..subvolume_set_cache import SubvolumeSetCache
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+
+class _Unseekable(io.BytesIO):
+
+    def seekable(self):
+        return False
+
+
+def _render(subvols: SubvolumeSet):
+    return freeze(subvols).map(lambda sv: emit_all_traversal_ids(sv.render()))
+
+
+class SubvolumeSetCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.cache_dir = os.path.join(td.name, 'cache')
+        self.sendstreams = []
+        for name in ['create_ops', 'mutate_ops']:
+            path = os.path.join(td.name, name)
+            with open(path, 'wb') as f:
+                f.write(gold_demo_sendstreams()[name]['sendstream'])
+            self.sendstreams.append(path)
+        self.parsed = []
+
+    def _parse(self, infile):
+        self.parsed.append(os.path.basename(getattr(infile, 'name', '-')))
+        return parse_send_stream(infile)
+
+    def _apply(self, cache, paths, parse_key='full'):
+        infiles = [open(p, 'rb') for p in paths]
+        try:
+            return cache.apply_sendstreams(
+                infiles, self._parse, parse_key=parse_key,
+            )
+        finally:
+            for f in infiles:
+                f.close()
+
+    def _entries(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_apply_sendstreams(self):
+        expected = SubvolumeSet.new()
+        for path in self.sendstreams:
+            with open(path, 'rb') as infile:
+                parsed = parse_send_stream(infile)
+                mutator = SubvolumeSetMutator.new(expected, next(parsed))
+                for item in parsed:
+                    mutator.apply_item(item)
+        expected = _render(expected)
+
+        cache = SubvolumeSetCache(self.cache_dir, max_bytes=2 ** 30)
+        self._apply(cache, self.sendstreams[:1])
+        self.assertEqual(['create_ops'], self.parsed)
+        self.assertEqual(1, len(self._entries()))
+
+        # The child snapshot resumes from the cached parent.
+        self.assertEqual(
+            expected, _render(self._apply(cache, self.sendstreams)),
+        )
+        self.assertEqual(['create_ops', 'mutate_ops'], self.parsed)
+        self.assertEqual(2, len(self._entries()))
+
+        # Fully cached, also for a new cache object, and for pipes.
+        cache = SubvolumeSetCache(self.cache_dir, max_bytes=2 ** 30)
+        self.assertEqual(
+            expected, _render(self._apply(cache, self.sendstreams)),
+        )
+        pipes = []
+        for path in self.sendstreams:
+            with open(path, 'rb') as f:
+                pipes.append(_Unseekable(f.read()))
+        self.assertEqual(
+            expected, _render(cache.apply_sendstreams(
+                pipes, self._parse, parse_key='full',
+            )),
+        )
+        self.assertEqual(['create_ops', 'mutate_ops'], self.parsed)
+
+        # Parsing the same send-streams differently does not hit the cache.
+        self._apply(cache, self.sendstreams, parse_key='other')
+        self.assertEqual(
+            ['create_ops', 'mutate_ops', 'create_ops', 'mutate_ops'],
+            self.parsed,
+        )
+        self.assertEqual(4, len(self._entries()))
+
+    def test_unsafe_cache_dir(self):
+        os.mkdir(self.cache_dir)
+        os.chmod(self.cache_dir, 0o777)
+        with self.assertRaisesRegex(RuntimeError, 'not writable by others'):
+            SubvolumeSetCache(self.cache_dir, max_bytes=2 ** 30)
+
+    def test_get_and_put(self):
+        cache = SubvolumeSetCache(self.cache_dir, max_bytes=2 ** 30)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', SubvolumeSet.new())
+        self.assertIsInstance(cache.get('a'), SubvolumeSet)
+
+        # Corrupt entries are misses, and get deleted.
+        for content in [b'', b'garbage']:
+            with open(cache._path('a'), 'wb') as f:
+                f.write(content)
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual([], self._entries())
+
+        # Failed writes leave nothing behind.
+        with self.assertRaises(Exception):
+            cache.put('a', lambda: None)
+        self.assertEqual([], self._entries())
+
+        cache._remove(cache._path('a'))  # Already removed
+
+    def test_lru_eviction(self):
+        cache = SubvolumeSetCache(self.cache_dir, max_bytes=2 ** 30)
+        cache.put('a', SubvolumeSet.new())
+        entry_size = os.path.getsize(cache._path('a'))
+        # A dangling entry, e.g. being removed by another process.
+        os.symlink(cache._path('missing'), cache._path('dangling'))
+        # Eviction ignores files that are not entries.
+        with open(os.path.join(self.cache_dir, 'other'), 'wb') as f:
+            f.write(b'x' * 2 * entry_size)
+
+        cache.max_bytes = 3 * entry_size
+        for mtime, key in enumerate('abc'):
+            cache.put(key, SubvolumeSet.new())
+            os.utime(cache._path(key), (mtime, mtime))
+        cache.get('a')  # Now the most recently used
+        cache.put('d', SubvolumeSet.new())
+        self.assertIsNone(cache.get('b'))
+        for key in 'acd':
+            self.assertIsNotNone(cache.get(key))
+
+        cache.max_bytes = 0
+        cache.put('e', SubvolumeSet.new())
+        self.assertEqual(
+            ['dangling.subvolume_set', 'other'], self._entries(),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
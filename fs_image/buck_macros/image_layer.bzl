@@ -131,6 +131,12 @@ def image_layer(
         #   yum_from_repo_snapshot --install-root PATH -- SOME YUM ARGS
         # Required if any dependent `image_feature` specifies `rpms`.
         yum_from_repo_snapshot = None,
+        # If set, `yum_from_repo_snapshot` is passed
+        # `--shared-repo-server-idle-timeout` with this many seconds, so
+        # that the RPM phases of consecutive layer builds on a host share
+        # one `repo-server-daemon`, instead of each starting a
+        # `repo-server`.  The binary must accept this option.
+        yum_shared_repo_server_idle_timeout = None,
         # Path to a target outputting a btrfs send-stream of a subvolume;
         # mutually exclusive with using any of the image_feature fields.
         from_sendstream = None,
@@ -141,11 +147,13 @@ def image_layer(
     # btrfs subvolume.  They live in a single target type for
     # memorability, and because much of the implementation is shared.
     if from_sendstream != None and (
-        image_feature_kwargs or yum_from_repo_snapshot
+        image_feature_kwargs or yum_from_repo_snapshot or
+        yum_shared_repo_server_idle_timeout != None
     ):
         fail(
             "cannot use `from_sendstream` with `image_feature` args or " +
-            "with `yum_from_repo_snapshot`",
+            "with `yum_from_repo_snapshot` or " +
+            "`yum_shared_repo_server_idle_timeout`",
         )
     elif image_feature_kwargs:
         make_subvol_cmd = _compile_image_features(
@@ -154,6 +162,8 @@ def image_layer(
             parent_layer = parent_layer,
             image_feature_kwargs = image_feature_kwargs,
             yum_from_repo_snapshot = yum_from_repo_snapshot,
+            yum_shared_repo_server_idle_timeout =
+                yum_shared_repo_server_idle_timeout,
         )
     else:
         if parent_layer != None:
@@ -256,7 +266,8 @@ def _compile_image_features(
         rule_name,
         parent_layer,
         image_feature_kwargs,
-        yum_from_repo_snapshot):
+        yum_from_repo_snapshot,
+        yum_shared_repo_server_idle_timeout):
     # For ease of use, a layer takes all the arguments of a feature, so
     # just make an implicit feature target to implement this.
     feature_name = rule_name + "-feature"
@@ -295,6 +306,7 @@ def _compile_image_features(
             "$subvolume_wrapper_dir/"{rule_name_quoted} \
           --parent-layer-json {parent_layer_json_quoted} \
           {maybe_quoted_yum_from_repo_snapshot_args} \
+          {maybe_yum_shared_repo_server_args} \
           --child-layer-target {current_target_quoted} \
           --child-feature-json $(location {my_feature_target}) \
           --child-dependencies \
@@ -320,6 +332,9 @@ def _compile_image_features(
         "--yum-from-repo-snapshot $(location {})".format(
             yum_from_repo_snapshot,
         ),
+        maybe_yum_shared_repo_server_args = "" if yum_shared_repo_server_idle_timeout == None else "--yum-shared-repo-server-idle-timeout {}".format(
+            yum_shared_repo_server_idle_timeout,
+        ),
         maybe_yum_from_repo_snapshot_dep = "" if not yum_from_repo_snapshot else "echo $(exe {}) > /dev/null".format(
             yum_from_repo_snapshot,
         ),
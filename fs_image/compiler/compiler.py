@@ -69,6 +69,12 @@ def parse_args(args):
         '--yum-from-repo-snapshot',
         help='Path to a binary taking `--install-root PATH -- SOME YUM ARGS`.',
     )
+    parser.add_argument(
+        '--yum-shared-repo-server-idle-timeout', type=float,
+        help='Passed to `--yum-from-repo-snapshot` as '
+            '`--shared-repo-server-idle-timeout`, so that the RPM phases of '
+            'consecutive layer builds share one `repo-server-daemon`.',
+    )
     parser.add_argument(
         '--child-layer-target', required=True,
         help='The name of the Buck target describing the layer being built',
@@ -103,6 +109,9 @@ def build_image(args):
             feature_paths=[args.child_feature_json],
             target_to_path=make_target_path_map(args.child_dependencies),
             yum_from_repo_snapshot=args.yum_from_repo_snapshot,
+            yum_shared_repo_server_idle_timeout=(
+                args.yum_shared_repo_server_idle_timeout
+            ),
         ),
     ))
     for phase in dep_graph.ordered_phases():
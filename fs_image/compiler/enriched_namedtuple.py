@@ -225,6 +225,12 @@ def metaclass_new_enriched_namedtuple(
                 ),
             )
 
+        def __reduce__(self):
+            # The default `namedtuple` pickling passes positional arguments
+            # to `__new__`, which we forbid.  Instead, rebuild the tuple
+            # directly -- the fields were already validated and customized.
+            return (tuple.__new__, (self.__class__, tuple(self)))
+
         def __repr__(self):
             return class_name + '(' + ', '.join(
                 f'{f}={repr(getattr(self, f))}'
@@ -365,14 +365,21 @@ class MultiRpmAction(NamedTuple):
     action: RpmActionType
     yum_from_snapshot: Optional[str]  # Can be None if there are no rpms.
     phase_order: PhaseOrder  # Derived from `action`
+    # If set, `yum_from_snapshot` shares a `repo-server-daemon` with other
+    # builds, which exits after being idle for this many seconds.
+    shared_repo_server_idle_timeout: Optional[float] = None
 
     @classmethod
-    def new(cls, rpms, action, yum_from_snapshot):
+    def new(
+        cls, rpms, action, yum_from_snapshot,
+        shared_repo_server_idle_timeout=None,
+    ):
         return cls(
             rpms=rpms,
             action=action,
             yum_from_snapshot=yum_from_snapshot,
             phase_order=RPM_ACTION_TYPE_TO_PHASE_ORDER[action],
+            shared_repo_server_idle_timeout=shared_repo_server_idle_timeout,
         )
 
     def union(self, other):
@@ -399,7 +406,12 @@ class MultiRpmAction(NamedTuple):
             # subvolume in `buck-image-out` with the "received UUID" that
             # was committed to VCS as part of the test sendstream.
             'env', 'PYTHONDONTWRITEBYTECODE=1',
-            self.yum_from_snapshot, '--install-root', subvol.path(), '--',
+            self.yum_from_snapshot, '--install-root', subvol.path(),
+            *([] if self.shared_repo_server_idle_timeout is None else [
+                '--shared-repo-server-idle-timeout',
+                str(self.shared_repo_server_idle_timeout),
+            ]),
+            '--',
             RPM_ACTION_TYPE_TO_YUM_CMD[self.action],
             # Sort in case `yum` behavior depends on order (for determinism).
             '--assumeyes', '--', *sorted(self.rpms),
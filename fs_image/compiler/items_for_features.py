@@ -42,6 +42,7 @@ def gen_items_for_features(
     feature_paths: Iterable[str],
     target_to_path: Mapping[str, str],
     yum_from_repo_snapshot: Optional[str],
+    yum_shared_repo_server_idle_timeout: Optional[float] = None,
 ):
     key_to_item_class = {
         'make_dirs': MakeDirsItem,
@@ -57,6 +58,9 @@ def gen_items_for_features(
                 feature_paths=items.pop('features', []),
                 target_to_path=target_to_path,
                 yum_from_repo_snapshot=yum_from_repo_snapshot,
+                yum_shared_repo_server_idle_timeout=(
+                    yum_shared_repo_server_idle_timeout
+                ),
             )
 
             target = items.pop('target')
@@ -82,4 +86,7 @@ def gen_items_for_features(
                 action=action,
                 rpms=frozenset(rpms),
                 yum_from_snapshot=yum_from_repo_snapshot,
+                shared_repo_server_idle_timeout=(
+                    yum_shared_repo_server_idle_timeout
+                ),
             )
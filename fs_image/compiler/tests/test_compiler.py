@@ -133,7 +133,9 @@ class CompilerTestCase(unittest.TestCase):
         return run_as_root_calls
 
     @_subvol_mock_is_btrfs_and_run_as_root  # Mocks from _compile()
-    def _expected_run_as_root_calls(self, is_btrfs, run_as_root):
+    def _expected_run_as_root_calls(
+        self, is_btrfs, run_as_root, *, shared_repo_server_idle_timeout=None,
+    ):
         'Get the commands that each of the *expected* sample items would run'
         is_btrfs.return_value = True
         subvol = subvol_utils.Subvol(
@@ -143,7 +145,12 @@ class CompilerTestCase(unittest.TestCase):
         for item in si.ID_TO_ITEM.values():
             if hasattr(item, 'yum_from_snapshot'):
                 # sample_items has `/fake/yum` here, but we need the real one
-                item._replace(yum_from_snapshot=self.yum_path).build(subvol)
+                item._replace(
+                    yum_from_snapshot=self.yum_path,
+                    shared_repo_server_idle_timeout=(
+                        shared_repo_server_idle_timeout
+                    ),
+                ).build(subvol)
             else:
                 item.build(subvol)
         return run_as_root.call_args_list + [
@@ -212,6 +219,21 @@ class CompilerTestCase(unittest.TestCase):
                 ]),
             )
 
+    def test_compile_with_shared_repo_server(self):
+        expected_calls = self._expected_run_as_root_calls(
+            shared_repo_server_idle_timeout=30.0,  # `parse_args` gives a float
+        )
+        # Sanity check: both `yum` commands get the option.
+        self.assertEqual(2, sum(
+            '--shared-repo-server-idle-timeout' in c[0][0]
+                for c in expected_calls
+        ))
+        self._assert_equal_call_sets(
+            expected_calls, self._compiler_run_as_root_calls(parent_args=[
+                '--yum-shared-repo-server-idle-timeout', '30',
+            ]),
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import copy
+import pickle
 import unittest
 
 from ..enriched_namedtuple import (
@@ -181,6 +183,15 @@ class EnrichedNamedtupleTestCase(unittest.TestCase):
         with self.assertRaises(AttributeError):
             g.boof = 3
 
+    def test_pickle_and_copy(self):
+        g = Grain(
+            has_roots=True, grain_size_mm=3, is_edible=True, flower_color='red'
+        )
+        for g2 in [pickle.loads(pickle.dumps(g)), copy.deepcopy(g)]:
+            self.assertIsNot(g, g2)
+            self.assertIs(Grain, type(g2))
+            self.assertEqual(g, g2)
+
     def test_repr(self):
         self.assertEqual(
             "Algae(color='green', has_roots=True, is_saltwater=False)",
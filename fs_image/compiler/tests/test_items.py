@@ -357,7 +357,8 @@ class ItemsTestCase(unittest.TestCase):
                     frozenset(['rpm-test-mice-2']), RpmActionType.install, yum,
                 ).build(subvol)
 
-            action.build(subvol)
+            # Installing via a shared `repo-server-daemon` works the same.
+            action._replace(shared_repo_server_idle_timeout=1).build(subvol)
             # Clean up the `yum` & `rpm` litter before checking the packages.
             subvol.run_as_root([
                 'rm', '-rf',
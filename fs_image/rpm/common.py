@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 'Utilities to make Python systems programming more palatable.'
+import array
 import hashlib
 import os
+import socket
 import stat
 
-from typing import AnyStr, NamedTuple
+from typing import AnyStr, List, NamedTuple
 
 # Hide the fact that some of our dependencies aren't in `rpm` any more, the
 # `rpm` library still imports them from `rpm.common`.
@@ -61,6 +63,36 @@ def set_new_key(d, k, v):
     d[k] = v
 
 
+def send_fds(sock: socket.socket, msg: bytes, fds: List[int]):
+    'Sends `msg`, and `fds` as ancillary data, via a Unix domain socket.'
+    num_sent = sock.sendmsg([msg], [(
+        socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds).tobytes(),
+    )])
+    assert len(msg) == num_sent, (msg, num_sent)
+
+
+def recv_fds(sock, msglen, maxfds, inheritable=False):
+    '''
+    Receives via a Unix domain socket a message of at most `msglen` bytes,
+    with at most `maxfds` file descriptors in the ancillary data.  The file
+    descriptors will be marked O_CLOEXEC unless inheritable is set to True.
+    '''
+    fds = array.array('i')
+    msg, ancdata, msg_flags, _addr = sock.recvmsg(
+        msglen, maxfds * socket.CMSG_SPACE(fds.itemsize),
+        0 if inheritable else socket.MSG_CMSG_CLOEXEC,
+    )
+    assert not (msg_flags & socket.MSG_TRUNC), msg_flags
+    assert not (msg_flags & socket.MSG_CTRUNC), msg_flags
+    assert not (msg_flags & socket.MSG_ERRQUEUE), msg_flags
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        assert cmsg_level == socket.SOL_SOCKET, cmsg_level
+        assert cmsg_type == socket.SCM_RIGHTS, cmsg_type
+        assert len(cmsg_data) % fds.itemsize == 0, cmsg_data
+        fds.frombytes(cmsg_data)
+    return msg, list(fds)
+
+
 class Checksum(NamedTuple):
     algorithm: str
     hexdigest: str
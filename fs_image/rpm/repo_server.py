@@ -22,20 +22,35 @@ os.execlp(sys.argv[1], *sys.argv[1:], str(s.fileno()))
     '{"key": "test", "kind": "filesystem", "base_dir": "YOUR_PATH"}' \\
   --snapshot-dir YOUR_SNAPSHOT/ --socket-fd
 
+By default, each connection is served by its own thread, with HTTP/1.1
+keep-alive, so that `yum` can download many RPMs in parallel without
+reconnecting for each one.
+
+Hot blobs, like the RPMs that every image installs, are hashed only the
+first time they are served, cf. `VerifiedBlobCache`.  That also lets us
+serve byte ranges, e.g. for resumed downloads, and conditional GETs of
+unchanged objects get a "304 Not Modified".
 '''
+import datetime
+import email.utils
 import json
 import os
+import re
 import socket
+import stat
+import threading
 import time
 import urllib.parse
 
-from socketserver import BaseServer
+from collections import ChainMap, OrderedDict
+from socketserver import BaseServer, ThreadingMixIn
 from http.server import BaseHTTPRequestHandler, HTTPStatus
-from typing import Mapping, Tuple
+from typing import Mapping, Optional, Tuple
 
 from .common import Checksum, get_file_logger, Path, set_new_key
 from .repo_objects import RepoMetadata
 from .repo_snapshot import FileIntegrityError, ReportableError
+from .snapshot_index import SNAPSHOT_INDEX_FILENAME, SnapshotIndex
 from .storage import Storage
 
 log = get_file_logger(__file__)
@@ -43,36 +58,33 @@ log = get_file_logger(__file__)
 
 # How big are our reads against Storage? Exposed for the unit test.
 _CHUNK_SIZE = 2 ** 21
+# We only serve single ranges, cf. `_requested_range`.
+_RANGE_RE = re.compile(r'^bytes=([0-9]*)-([0-9]*)$')
 
 
-def read_snapshot_dir(path: str):
+def read_snapshot_dir(path: str) -> Mapping[str, dict]:
+    '''
+    Repos with a `SNAPSHOT_INDEX_FILENAME` are looked up lazily from the
+    memory-mapped index.  Older snapshots lack it, so we load their JSON.
+    '''
     location_to_obj = {}
+    indexes = []
     for repo in os.listdir(path):
         if repo == 'yum.conf':
             continue
         repo_path = Path(path) / repo
 
-        for filename in ['rpm.json', 'repodata.json']:
-            with open(repo_path / filename) as infile:
-                for location, obj in json.load(infile).items():
-                    set_new_key(
-                        location_to_obj, os.path.join(repo, location), obj
-                    )
-
-        # Re-parse and serialize the metadata to a format that ALMOST
-        # matches the other blobs (imitating `RepoSnapshot.to_directory()`).
-        # If useful, it would not be offensive to make such a `repomd.json`
-        # be emitted by RepoSnapshot, instead of `repomd.xml`.  Caveat: JSON
-        # isn't suitable for bytes, and the XML is currently bytes.
-        with open(repo_path / 'repomd.xml', 'rb') as infile:
-            repomd = RepoMetadata.new(xml=infile.read())
-        location_to_obj[os.path.join(repo, 'repodata/repomd.xml')] = {
-            'size': repomd.size,
-            'build_timestamp': repomd.build_timestamp,
-            'content_bytes': repomd.xml,  # Instead of `storage_id`
-        }
-
-        # Similarly, make JSON metadata for the repo's GPG keys.
+        if os.path.exists(repo_path / SNAPSHOT_INDEX_FILENAME):
+            # The index also has `repomd.xml`, as `_load_snapshot_json`
+            # would make it.
+            indexes.append(SnapshotIndex(
+                repo_path / SNAPSHOT_INDEX_FILENAME, prefix=repo + '/',
+            ))
+        else:
+            _load_snapshot_json(location_to_obj, repo, repo_path)
+
+        # Make JSON metadata for the repo's GPG keys, like the `repomd.xml`
+        # metadata of `_load_snapshot_json`.
         key_dir = repo_path / 'gpg_keys'
         for key_filename in os.listdir(key_dir.decode()):
             with open(key_dir / key_filename, 'rb') as infile:
@@ -85,7 +97,92 @@ def read_snapshot_dir(path: str):
                 'content_bytes': key_content,  # Instead of `storage_id`
             }
 
-    return location_to_obj
+    # Lookups try `location_to_obj` first, then each index.
+    return ChainMap(location_to_obj, *indexes)
+
+
+def _load_snapshot_json(location_to_obj: dict, repo: str, repo_path: Path):
+    for filename in ['rpm.json', 'repodata.json']:
+        with open(repo_path / filename) as infile:
+            for location, obj in json.load(infile).items():
+                set_new_key(
+                    location_to_obj, os.path.join(repo, location), obj
+                )
+
+    # Re-parse and serialize the metadata to a format that ALMOST
+    # matches the other blobs (imitating `RepoSnapshot.to_directory()`).
+    # If useful, it would not be offensive to make such a `repomd.json`
+    # be emitted by RepoSnapshot, instead of `repomd.xml`.  Caveat: JSON
+    # isn't suitable for bytes, and the XML is currently bytes.
+    with open(repo_path / 'repomd.xml', 'rb') as infile:
+        repomd = RepoMetadata.new(xml=infile.read())
+    location_to_obj[os.path.join(repo, 'repodata/repomd.xml')] = {
+        'size': repomd.size,
+        'build_timestamp': repomd.build_timestamp,
+        'content_bytes': repomd.xml,  # Instead of `storage_id`
+    }
+
+
+def _sendable_fd(input, size: int) -> Optional[int]:
+    'The file descriptor of `input`, if it is a regular file of `size` bytes.'
+    try:
+        fd = input.fileno()
+    except OSError:  # E.g. `io.UnsupportedOperation`, not backed by a file
+        return None
+    st = os.fstat(fd)
+    return fd if stat.S_ISREG(st.st_mode) and st.st_size == size else None
+
+
+class VerifiedBlobCache:
+    '''
+    Remembers which blobs `do_GET` already checked against their expected
+    size & checksum, so that repeat requests for hot RPMs can skip
+    re-reading and re-hashing them.  Such blobs are served straight from
+    their files via `sendfile`, or, for `Storage`s whose blobs are not
+    files, from an LRU of up to `max_bytes` of verified content.
+
+    Blobs are keyed by `(storage_id, checksum)`, since a snapshot may
+    expect different checksums for the same `storage_id`.  This is
+    thread-safe.
+    '''
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._verified = set()
+        self._key_to_content = OrderedDict()
+        self._content_bytes = 0
+
+    def is_verified(self, key: Tuple[str, str]) -> bool:
+        with self._lock:
+            return key in self._verified
+
+    def get_content(self, key: Tuple[str, str]) -> Optional[bytes]:
+        with self._lock:
+            content = self._key_to_content.get(key)
+            if content is not None:
+                self._key_to_content.move_to_end(key)
+            return content
+
+    def add(self, key: Tuple[str, str], content: Optional[bytes] = None):
+        'Call once the blob passed its checks. Evicts old content as needed.'
+        with self._lock:
+            self._verified.add(key)
+            if content is None or len(content) > self.max_bytes \
+                    or key in self._key_to_content:
+                return
+            self._key_to_content[key] = content
+            self._content_bytes += len(content)
+            while self._content_bytes > self.max_bytes:
+                _, evicted = self._key_to_content.popitem(last=False)
+                self._content_bytes -= len(evicted)
+
+    def invalidate(self, key: Tuple[str, str]):
+        with self._lock:
+            self._verified.discard(key)
+            content = self._key_to_content.pop(key, None)
+            if content is not None:
+                self._content_bytes -= len(content)
 
 
 class RepoSnapshotHTTPRequestHandler(BaseHTTPRequestHandler):
@@ -97,94 +194,212 @@ class RepoSnapshotHTTPRequestHandler(BaseHTTPRequestHandler):
         # BEWARE: Mutated if we discover checksum errors to prevent client
         # retries from succeeding.
         location_to_obj: Mapping[str, dict],
+        # Guards the above mutation, since requests may run concurrently.
+        location_to_obj_lock: threading.Lock,
         storage: Storage,
+        verified_blobs: VerifiedBlobCache,
+        keep_alive: bool = False,
         **kwargs,
     ):
         self.location_to_obj = location_to_obj
+        self.location_to_obj_lock = location_to_obj_lock
         self.storage = storage
+        self.verified_blobs = verified_blobs
+        if keep_alive:
+            self.protocol_version = 'HTTP/1.1'
         super().__init__(*args, **kwargs)
 
-    def _memoize_error(self, obj, error: ReportableError):
+    def _memoize_error(self, location: str, error: ReportableError):
         '''
         Any size or checksum errors we see are likely to be permanent, so we
-        MUTATE `obj` with the error, hiding the old `storage_id` inside.
+        MUTATE the object at `location` with the error, hiding the old
+        `storage_id` inside.  If concurrent requests for the object both
+        find an error, only the first is recorded.  The blob is no longer
+        considered verified.
         '''
-        error_dict = {
-            **error.to_dict(),
-            # Since `storage_id` is hidden, `send_head` will show the error.
-            'storage_id': obj.pop('storage_id'),
-        }
-        set_new_key(obj, 'error', error_dict)
+        # The client sees the error as a truncated body.  With keep-alive,
+        # it would instead wait for the rest of the body, so hang up.
+        self.close_connection = True
+        with self.location_to_obj_lock:
+            obj = self.location_to_obj[location]
+            if 'storage_id' not in obj:
+                return  # Another request already recorded an error.
+            error_dict = {
+                **error.to_dict(),
+                # Since `storage_id` is hidden, `send_head` will show the
+                # error.
+                'storage_id': obj.pop('storage_id'),
+            }
+            set_new_key(obj, 'error', error_dict)
+            self.verified_blobs.invalidate(
+                (error_dict['storage_id'], obj['checksum']),
+            )
 
     def do_GET(self) -> None:
-        location, obj = self.send_head()
+        location, obj, byte_range = self.send_head(verify_ranges=True)
         if not obj:
-            return  # Object not found, we already sent an error.
+            return  # We already sent an error, or "304 Not Modified".
+        start, end = (0, obj['size']) if byte_range is None else byte_range
         if 'content_bytes' in obj:
-            self.wfile.write(obj['content_bytes'])
+            self.wfile.write(obj['content_bytes'][start:end])
             return
 
-        # This binary blob must be fetched from `self.storage`. We don't
-        # trust our storage, so we have to verify the checksum before
-        # sending the entire blob back to the client.
+        key = (obj['storage_id'], obj['checksum'])
+        content = self.verified_blobs.get_content(key)
+        if content is not None:
+            self.wfile.write(content[start:end])
+            return
+
+        with self.storage.reader(obj['storage_id']) as input:
+            fd = _sendable_fd(input, obj['size'])
+            if byte_range is None and (
+                fd is None or not self.verified_blobs.is_verified(key)
+            ):
+                # Files are `sendfile`d once verified, so only other blobs
+                # need their content cached.
+                self._send_and_verify(
+                    location, obj, input, self.wfile.write,
+                    keep_content=fd is None,
+                )
+                return
+            # Verified blobs, including the ranges `send_head` verified.
+            if fd is not None:
+                sent = self.connection.sendfile(input, start, end - start)
+            else:
+                sent = self._copy_range(input, start, end)
+            # Only if the blob shrank since it was verified.
+            if sent != end - start:
+                self._memoize_error(location, FileIntegrityError(
+                    location=location,
+                    failed_check='size',
+                    expected=obj['size'],
+                    actual=start + sent,
+                ))
+
+    def _copy_range(self, input, start: int, end: int) -> int:
+        'Sends bytes `start:end` of an already-verified blob, returns a count'
+        pos = 0
+        sent = 0
+        while pos < end:
+            chunk = input.read(min(_CHUNK_SIZE, end - pos))
+            if not chunk:
+                break
+            skip = max(start - pos, 0)
+            pos += len(chunk)
+            if skip < len(chunk):
+                self.wfile.write(chunk[skip:])
+                sent += len(chunk) - skip
+        return sent
+
+    def _send_and_verify(
+        self, location: str, obj: dict, input, write, *, keep_content: bool,
+    ) -> None:
+        '''
+        This binary blob must be fetched from `self.storage`. We don't
+        trust our storage, so we have to verify the checksum before
+        sending the entire blob to `write`.  Once verified, the blob is
+        added to `self.verified_blobs`, with its content if `keep_content`
+        and it fits.
+        '''
+        chunks = [] if keep_content \
+            and obj['size'] <= self.verified_blobs.max_bytes else None
         bytes_left = obj['size']
         checksum = Checksum.from_string(obj['checksum'])
-        with self.storage.reader(obj['storage_id']) as input:
-            hash = checksum.hasher()
-            while True:
-                chunk = input.read(_CHUNK_SIZE)
-                bytes_left -= len(chunk)
-                if not chunk:
-                    if bytes_left != 0:  # The client will see an error.
-                        self._memoize_error(obj, FileIntegrityError(
-                            location=location,
-                            failed_check='size',
-                            expected=obj['size'],
-                            actual=obj['size'] - bytes_left,
-                        ))
-                    break
-
-                #
-                # Check for errors **before** sending out more data -- this
-                # might be the last chunk, and so we signal errors by
-                # refusing to send the last bit of data.
-                #
-
-                # It's possible that we have a chunk after the last chunk,
-                # but we don't want to send that last chunk since the client
-                # might conclude all is well upon receiving enough data.
-                if bytes_left == 0:
-                    # The next `if` will error if we get a non-empty chunk.
-                    # The error's `actual=` might be an underestimate.
-                    bytes_left -= len(input.read())
-
-                if bytes_left < 0:
-                    self._memoize_error(obj, FileIntegrityError(
+        hash = checksum.hasher()
+        while True:
+            chunk = input.read(_CHUNK_SIZE)
+            bytes_left -= len(chunk)
+            if not chunk:
+                if bytes_left != 0:  # The client will see an error.
+                    self._memoize_error(location, FileIntegrityError(
                         location=location,
                         failed_check='size',
                         expected=obj['size'],
                         actual=obj['size'] - bytes_left,
                     ))
-                    break  # Incomplete content, client will see an error.
-
-                hash.update(chunk)
-                if bytes_left == 0 and hash.hexdigest() != checksum.hexdigest:
-                    self._memoize_error(obj, FileIntegrityError(
-                        location=location,
-                        failed_check=checksum.algorithm,
-                        expected=checksum.hexdigest,
-                        actual=hash.hexdigest(),
-                    ))
-                    break  # Incomplete content, client will see an error.
-
-                # If this is the last chunk, the stream was error-free.
-                self.wfile.write(chunk)
+                break
+
+            #
+            # Check for errors **before** sending out more data -- this
+            # might be the last chunk, and so we signal errors by
+            # refusing to send the last bit of data.
+            #
+
+            # It's possible that we have a chunk after the last chunk,
+            # but we don't want to send that last chunk since the client
+            # might conclude all is well upon receiving enough data.
+            if bytes_left == 0:
+                # The next `if` will error if we get a non-empty chunk.
+                # The error's `actual=` might be an underestimate.
+                bytes_left -= len(input.read())
+
+            if bytes_left < 0:
+                self._memoize_error(location, FileIntegrityError(
+                    location=location,
+                    failed_check='size',
+                    expected=obj['size'],
+                    actual=obj['size'] - bytes_left,
+                ))
+                break  # Incomplete content, client will see an error.
+
+            hash.update(chunk)
+            if bytes_left == 0 and hash.hexdigest() != checksum.hexdigest:
+                self._memoize_error(location, FileIntegrityError(
+                    location=location,
+                    failed_check=checksum.algorithm,
+                    expected=checksum.hexdigest,
+                    actual=hash.hexdigest(),
+                ))
+                break  # Incomplete content, client will see an error.
+
+            # If this is the last chunk, the stream was error-free.
+            write(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+            if bytes_left == 0:
+                self.verified_blobs.add(
+                    (obj['storage_id'], obj['checksum']),
+                    None if chunks is None else b''.join(chunks),
+                )
 
     def do_HEAD(self):
         self.send_head()
 
-    def send_head(self) -> Tuple[str, dict]:
-        'Returns (location, obj) from the repo JSON snapshot.'
+    def _get_obj(self, location: str) -> Optional[dict]:
+        '''
+        Returns a copy of the object, since other requests may
+        `_memoize_error` concurrently.
+        '''
+        with self.location_to_obj_lock:
+            obj = self.location_to_obj.get(location)
+            return None if obj is None else dict(obj)
+
+    def _send_obj_error(self, obj: dict) -> bool:
+        'Returns True if `obj` is not servable, and we sent an error.'
+        if 'storage_id' in obj or 'content_bytes' in obj:
+            return False
+        self.send_error(
+            HTTPStatus.INTERNAL_SERVER_ERROR,
+            f'Repo snapshot error: {obj.get("error")}',
+        )
+        # Future: we may add an option to grab the `storage_id` out of
+        # 'mutable_rpm' errors, if appropriate.  Note that
+        # `_memoize_error` hacks other errors to include a `storage_id`
+        # in our in-memory representation -- do check the error type!
+        return True
+
+    def send_head(
+        self, *, verify_ranges: bool = False,
+    ) -> Tuple[str, dict, Optional[Tuple[int, int]]]:
+        '''
+        Returns (location, obj, byte_range) from the repo JSON snapshot,
+        or `None`s if there is no body to send.  `byte_range` is `None`
+        for the whole object, or a `(start, end)` slice.
+
+        Ranges are only sent from verified blobs, so with `verify_ranges`,
+        this first reads & checks the whole blob, if needed.  `HEAD` skips
+        this, just as it does not detect errors in full blobs.
+        '''
         # Ignore query parameters & fragment, remove leading / if present.
         # Promoting to unicode since we get our repo snapshot from JSON, and
         # though ideally we'd use `unquote_to_bytes`.
@@ -193,29 +408,113 @@ class RepoSnapshotHTTPRequestHandler(BaseHTTPRequestHandler):
             'utf-8', 'surrogateescape',  # paper over invalid unicode :D
         )
         # Future: consider adding directory listing support.
-        obj = self.location_to_obj.get(location)
+        obj = self._get_obj(location)
         if obj is None:
             self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
-            return None, None
-        if 'storage_id' not in obj and 'content_bytes' not in obj:
-            self.send_error(
-                HTTPStatus.INTERNAL_SERVER_ERROR,
-                f'Repo snapshot error: {obj.get("error")}',
+            return None, None, None
+        if self._send_obj_error(obj):
+            return None, None, None
+
+        # Blobs have a strong ETag, since we check them against their
+        # checksum.  In-memory objects only have a `build_timestamp`.
+        etag = f'"{obj["checksum"]}"' if 'checksum' in obj else None
+        last_modified = self.date_time_string(obj['build_timestamp'])
+        if self._is_not_modified(obj, etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_validators(etag, last_modified)
+            self.end_headers()
+            return None, None, None
+
+        byte_range = self._requested_range(obj['size'], etag, last_modified)
+        if byte_range is not None and byte_range[0] >= obj['size']:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{obj["size"]}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None, None, None
+        if byte_range is not None and verify_ranges and 'storage_id' in obj:
+            obj = self._verify_blob(location, obj)
+            if self._send_obj_error(obj):
+                return None, None, None
+
+        if byte_range is None:
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Length', str(obj['size']))
+        else:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header(
+                'Content-Range', f'bytes {start}-{end - 1}/{obj["size"]}',
             )
-            # Future: we may add an option to grab the `storage_id` out of
-            # 'mutable_rpm' errors, if appropriate.  Note that
-            # `_memoize_error` hacks other errors to include a `storage_id`
-            # in our in-memory representation -- do check the error type!
-            return None, None
-        self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Length', str(end - start))
         self.send_header('Content-type', self.type_for_path(location))
-        self.send_header('Content-Length', str(obj['size']))
-        self.send_header('Last-Modified', self.date_time_string(
-            obj['build_timestamp'],
-        ))
-        # Future: if useful, could send_header('ETag', obj['checksum'])
+        self.send_header('Accept-Ranges', 'bytes')
+        self._send_validators(etag, last_modified)
         self.end_headers()
-        return location, obj
+        return location, obj, byte_range
+
+    def _verify_blob(self, location: str, obj: dict) -> dict:
+        'Returns the new `obj`, with any error that we found in the blob.'
+        if self.verified_blobs.is_verified(
+            (obj['storage_id'], obj['checksum']),
+        ):
+            return obj
+        with self.storage.reader(obj['storage_id']) as input:
+            self._send_and_verify(
+                location, obj, input, lambda chunk: None,
+                keep_content=_sendable_fd(input, obj['size']) is None,
+            )
+        return self._get_obj(location)
+
+    def _send_validators(self, etag: Optional[str], last_modified: str):
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+
+    def _is_not_modified(self, obj: dict, etag: Optional[str]) -> bool:
+        '''
+        As per RFC 7232, `If-None-Match` takes precedence over
+        `If-Modified-Since`, and uses the weak comparison.
+        '''
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = {t.strip() for t in if_none_match.split(',')}
+            return '*' in tags or etag is not None and (
+                etag in tags or f'W/{etag}' in tags
+            )
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        # Like `SimpleHTTPRequestHandler`, ignore malformed dates.
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        return obj['build_timestamp'] <= since.timestamp()
+
+    def _requested_range(
+        self, size: int, etag: Optional[str], last_modified: str,
+    ) -> Optional[Tuple[int, int]]:
+        '''
+        Parses a single-range `Range: bytes=...` into `(start, end)`.  If
+        `start >= size`, the range is not satisfiable.  Returns `None` to
+        send the whole object, which RFC 7233 allows for any `Range` that
+        we do not support, e.g. multiple ranges, or for a stale `If-Range`.
+        '''
+        match = _RANGE_RE.match(self.headers.get('Range', ''))
+        if not match or match.groups() == ('', ''):
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range not in (etag, last_modified):
+            return None
+        first, last = match.groups()
+        if first == '':  # The suffix of length `last`
+            return max(size - int(last), 0), size
+        if last != '' and int(last) < int(first):
+            return None  # Invalid, so ignored
+        return int(first), size if last == '' else min(int(last) + 1, size)
 
     # There is also the more expensive & comprehensive `mimetypes` module,
     # but we don't need too many extensions.
@@ -285,17 +584,46 @@ class HTTPSocketServer(BaseServer):
         request.close()
 
 
-def repo_server(sock, location_to_obj: Mapping[str, dict], storage: Storage):
+class ThreadingHTTPSocketServer(ThreadingMixIn, HTTPSocketServer):
+    '''
+    Serves each connection in a new thread, like the built-in
+    `ThreadingHTTPServer`.  Unlike a bounded pool, this cannot be starved
+    by clients that keep idle connections alive.
+    '''
+    daemon_threads = True
+
+
+def repo_server(
+    sock, location_to_obj: Mapping[str, dict], storage: Storage,
+    *, threaded: bool = True,
+    verified_blobs: Optional[VerifiedBlobCache] = None,
+    location_to_obj_lock: Optional[threading.Lock] = None,
+):
     '''
     BEWARE: `location_to_obj` is mutated if we discover checksum errors to
     prevent client retries from succeeding.
+
+    With `threaded=False`, requests are served one at a time, and each
+    connection serves a single request.
+
+    By default, only the fact that a blob was verified is cached, pass
+    `verified_blobs` to also cache some blob content.  Servers that share
+    `location_to_obj` must also share `verified_blobs`, and the lock.
     '''
-    return HTTPSocketServer(
+    if location_to_obj_lock is None:
+        location_to_obj_lock = threading.Lock()
+    if verified_blobs is None:
+        verified_blobs = VerifiedBlobCache()
+    return (ThreadingHTTPSocketServer if threaded else HTTPSocketServer)(
         sock,
         lambda *args, **kwargs: RepoSnapshotHTTPRequestHandler(
             *args,
             location_to_obj=location_to_obj,
+            location_to_obj_lock=location_to_obj_lock,
             storage=storage,
+            verified_blobs=verified_blobs,
+            # Without threads, an idle connection would block the others.
+            keep_alive=threaded,
             **kwargs,
         )
     )
@@ -325,6 +653,11 @@ if __name__ == '__main__':  # pragma: no cover
         parser, '--storage', required=True,
         help='What Storage do the storage IDs of the snapshots refer to? ',
     )
+    parser.add_argument(
+        '--cache-max-bytes', type=int, default=0,
+        help='Keep up to this many bytes of verified blobs in RAM. Only '
+            'useful if the blobs of `--storage` are not local files.',
+    )
     opts = parser.parse_args()
 
     init_logging()
@@ -333,6 +666,7 @@ if __name__ == '__main__':  # pragma: no cover
         socket.socket(fileno=opts.socket_fd),
         read_snapshot_dir(opts.snapshot_dir),
         opts.storage,
+        verified_blobs=VerifiedBlobCache(max_bytes=opts.cache_max_bytes),
     ) as httpd:
         httpd.server_activate()
         log.info(f'HTTP repo server is listening')
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+'''
+A long-lived `repo-server`, shared by all the `yum-from-snapshot` runs on a
+host that use the same `--snapshot-dir` and `--storage`.  Compared to
+starting a `repo-server` for each run, this reads the snapshot just once,
+and keeps the `VerifiedBlobCache` warm across image builds.
+
+`yum-from-snapshot --shared-repo-server-idle-timeout` starts the daemon as
+needed -- `image_layer`s opt into this via
+`yum_shared_repo_server_idle_timeout`.  Each run attaches to the daemon as
+follows:
+
+  - It connects to the daemon's `--daemon-socket`, a Unix domain socket
+    whose path is keyed by the snapshot & storage.
+  - It sends a TCP socket, already bound in the network namespace of its
+    `yum`, via `send_fds`.
+  - The daemon listens on that TCP socket, and replies `ready`.
+  - Once the client disconnects, the daemon stops serving its TCP socket.
+
+After `--idle-timeout` seconds without any clients, the daemon exits.  At
+most one daemon runs per `--daemon-socket`, since each holds an `flock` on
+the `.lock` file next to the socket.  A daemon logs to the `.log` file next
+to the socket, which it truncates once it holds the lock.
+'''
+import fcntl
+import os
+import socket
+import threading
+import time
+
+from typing import Callable, Mapping, Optional
+
+from .common import get_file_logger, recv_fds
+from .repo_server import read_snapshot_dir, repo_server, VerifiedBlobCache
+from .storage import Storage
+
+log = get_file_logger(__file__)
+
+
+class RepoServerDaemon:
+    '''
+    Serves HTTP on each TCP socket that a client sends, for as long as the
+    client remains connected.  All the sockets share the same objects,
+    and the same `VerifiedBlobCache`.
+    '''
+
+    def __init__(
+        self, location_to_obj: Mapping[str, dict], storage: Storage,
+        *, verified_blobs: Optional[VerifiedBlobCache] = None,
+    ):
+        self.location_to_obj = location_to_obj
+        self.storage = storage
+        self.verified_blobs = verified_blobs or VerifiedBlobCache()
+        self._location_to_obj_lock = threading.Lock()
+        self._clients_lock = threading.Lock()
+        self._num_clients = 0
+        self._last_detached = time.monotonic()
+
+    def _serve_client(self, conn: socket.socket):
+        try:
+            with conn:
+                _msg, (sock_fd,) = recv_fds(conn, 128, 1)
+                with repo_server(
+                    socket.socket(fileno=sock_fd),
+                    self.location_to_obj,
+                    self.storage,
+                    verified_blobs=self.verified_blobs,
+                    location_to_obj_lock=self._location_to_obj_lock,
+                ) as httpd:
+                    httpd.server_activate()
+                    thread = threading.Thread(target=httpd.serve_forever)
+                    thread.start()
+                    try:
+                        conn.sendall(b'ready')
+                        # Serve until the client hangs up.
+                        while conn.recv(4096):
+                            pass
+                    finally:
+                        httpd.shutdown()
+                        thread.join()
+        finally:
+            with self._clients_lock:
+                self._num_clients -= 1
+                self._last_detached = time.monotonic()
+
+    def serve(self, lsock: socket.socket, idle_timeout: float):
+        'Returns once no client was attached for `idle_timeout` seconds.'
+        while True:
+            with self._clients_lock:
+                idle_for = 0 if self._num_clients \
+                    else time.monotonic() - self._last_detached
+            if idle_for >= idle_timeout:
+                return
+            lsock.settimeout(idle_timeout - idle_for)
+            try:
+                conn, _ = lsock.accept()
+            except socket.timeout:
+                continue
+            with self._clients_lock:
+                self._num_clients += 1
+            threading.Thread(
+                target=self._serve_client, args=(conn,), daemon=True,
+            ).start()
+
+
+def run_daemon(
+    socket_path: str, snapshot_dir: str, storage: Storage,
+    *, idle_timeout: float,
+    on_locked: Callable[[], None] = lambda: None,
+    on_listening: Callable[[], None] = lambda: None,
+):
+    '''
+    Calls `on_locked` if this daemon will serve `socket_path`.  Calls
+    `on_listening` once clients can connect to `socket_path`, or once it is
+    clear that another daemon is serving it.
+    '''
+    with open(socket_path + '.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.info(f'Another repo-server daemon owns {socket_path}')
+            on_listening()
+            return
+        on_locked()
+        # A daemon that was killed may have left its socket behind.
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as lsock:
+            lsock.bind(socket_path)
+            try:
+                lsock.listen()
+                on_listening()
+                log.info(f'repo-server daemon is listening on {socket_path}')
+                RepoServerDaemon(
+                    read_snapshot_dir(snapshot_dir), storage,
+                ).serve(lsock, idle_timeout)
+            finally:
+                # Unlink while we hold the lock, so that the next daemon
+                # cannot bind the path before we are done with it.
+                os.unlink(socket_path)
+    log.info(f'repo-server daemon was idle for {idle_timeout}s, exiting')
+
+
+# Tested manually, and via the `yum-from-snapshot` integration test.
+if __name__ == '__main__':  # pragma: no cover
+    import argparse
+
+    from .common import init_logging
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--daemon-socket', required=True,
+        help='Listen for clients on this Unix domain socket path.',
+    )
+    parser.add_argument(
+        '--snapshot-dir', required=True,
+        help='Multi-repo snapshot directory, as for `repo-server`.',
+    )
+    Storage.add_argparse_arg(
+        parser, '--storage', required=True,
+        help='What Storage do the storage IDs of the snapshots refer to? ',
+    )
+    parser.add_argument(
+        '--idle-timeout', type=float, required=True,
+        help='Exit after this many seconds without any clients.',
+    )
+    opts = parser.parse_args()
+
+    init_logging()
+
+    # We `chdir('/')` below, so as not to keep the build's working directory
+    # busy.  NB: Relative paths in the `--storage` config would break.
+    opts.daemon_socket = os.path.abspath(opts.daemon_socket)
+    opts.snapshot_dir = os.path.abspath(opts.snapshot_dir)
+
+    # Detach from the client that started us, but only let it continue
+    # once it can connect -- i.e. once the pipe is closed.
+    ready_r, ready_w = os.pipe()
+    if os.fork() != 0:
+        os.close(ready_w)
+        os.read(ready_r, 1)
+        os._exit(0)
+    os.close(ready_r)
+    os.setsid()
+    os.chdir('/')
+
+    def start_log():
+        # Each new daemon truncates the log, so that it does not grow
+        # without bound.  Until then, errors go to the client's stderr.
+        log_fd = os.open(
+            opts.daemon_socket + '.log',
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600,
+        )
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(log_fd)
+
+    run_daemon(
+        opts.daemon_socket, opts.snapshot_dir, opts.storage,
+        idle_timeout=opts.idle_timeout,
+        on_locked=start_log,
+        on_listening=lambda: os.close(ready_w),
+    )
@@ -10,6 +10,7 @@ import json
 from typing import Mapping, NamedTuple, Union
 
 from .common import get_file_logger, create_ro, Path
+from .snapshot_index import SNAPSHOT_INDEX_FILENAME, write_snapshot_index
 
 log = get_file_logger(__file__)
 
@@ -89,6 +90,12 @@ class RepoSnapshot(NamedTuple):
         with create_ro(path / 'repomd.xml', 'wb') as out:
             out.write(self.repomd.xml)
 
+        # `repo-server` serves from this index, instead of parsing the rest.
+        location_to_obj = {'repodata/repomd.xml': {
+            'size': self.repomd.size,
+            'build_timestamp': self.repomd.build_timestamp,
+            'content_bytes': self.repomd.xml,  # Instead of `storage_id`
+        }}
         for filename, sid_to_obj in (
             ('repodata.json', self.storage_id_to_repodata),
             ('rpm.json', self.storage_id_to_rpm),
@@ -109,6 +116,9 @@ class RepoSnapshot(NamedTuple):
                 assert len(obj_map) == len(sid_to_obj), \
                     f'location collided {filename}'
                 json.dump(obj_map, out, sort_keys=True, indent=4)
+            location_to_obj.update(obj_map)
+
+        write_snapshot_index(path / SNAPSHOT_INDEX_FILENAME, location_to_obj)
         return self
 
     def visit(self, visitor):
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+'''
+`RepoSnapshot.to_directory` writes the JSON objects of a repo snapshot,
+and its `repomd.xml`, to a compact binary index as well.  This lets
+`repo-server` start without parsing the whole snapshot: it memory-maps
+the index, and binary-searches it for each requested location, so only
+the pages of the objects actually served become resident.
+
+File format, all integers are little-endian:
+  - `_HEADER`: the magic & version, then the number of objects,
+  - a u64 file offset per object, sorted by the object's location,
+  - the objects, each being a `_RECORD_HEADER` followed by the location as
+    UTF-8, the object as JSON, and its `content_bytes` (if any).
+'''
+import json
+import mmap
+import struct
+
+from collections.abc import Mapping
+from typing import Iterator, Mapping as MappingType
+
+from .common import create_ro
+
+SNAPSHOT_INDEX_FILENAME = 'snapshot.index'
+
+_MAGIC = b'RPMSNAP\x01'  # The last byte is the format version.
+_HEADER = struct.Struct('<8sQ')
+_OFFSET = struct.Struct('<Q')
+# The byte counts of the location, JSON, and `content_bytes`.
+_RECORD_HEADER = struct.Struct('<III')
+
+
+def _encode_location(location: str) -> bytes:
+    # Locations come from JSON, and may paper over invalid UTF-8, cf.
+    # `RepoSnapshotHTTPRequestHandler.send_head`.
+    return location.encode('utf-8', 'surrogateescape')
+
+
+def write_snapshot_index(path: bytes, location_to_obj: MappingType[str, dict]):
+    '''
+    The objects are as in the JSON written by `RepoSnapshot.to_directory`,
+    but may also have `content_bytes`, which are stored as raw bytes.
+    '''
+    records = []
+    for location, obj in location_to_obj.items():
+        obj = dict(obj)
+        content = obj.pop('content_bytes', b'')
+        records.append((
+            _encode_location(location),
+            json.dumps(obj, sort_keys=True).encode(),
+            content,
+        ))
+    records.sort()
+
+    offset = _HEADER.size + _OFFSET.size * len(records)
+    with create_ro(path, 'wb') as out:
+        out.write(_HEADER.pack(_MAGIC, len(records)))
+        for record in records:
+            out.write(_OFFSET.pack(offset))
+            offset += _RECORD_HEADER.size + sum(len(b) for b in record)
+        for record in records:
+            out.write(_RECORD_HEADER.pack(*(len(b) for b in record)))
+            for b in record:
+                out.write(b)
+
+
+class SnapshotIndex(Mapping):
+    '''
+    A read-only `Mapping` of `prefix + location` to the objects in a
+    `write_snapshot_index` file.
+
+    Each object is decoded on first access, and then kept, so that -- as
+    with the `dict` from `read_snapshot_dir` -- the caller may mutate it.
+    '''
+
+    def __init__(self, path: bytes, prefix: str = ''):
+        self._prefix = prefix
+        self._key_to_obj = {}
+        with open(path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            raise RuntimeError(f'{path} is not a snapshot index: {magic}')
+
+    def _record_offset(self, idx: int) -> int:
+        return _OFFSET.unpack_from(
+            self._mmap, _HEADER.size + _OFFSET.size * idx,
+        )[0]
+
+    def _location_at(self, offset: int) -> bytes:
+        location_len, _, _ = _RECORD_HEADER.unpack_from(self._mmap, offset)
+        offset += _RECORD_HEADER.size
+        return self._mmap[offset:offset + location_len]
+
+    def _decode(self, offset: int) -> dict:
+        location_len, json_len, content_len = \
+            _RECORD_HEADER.unpack_from(self._mmap, offset)
+        offset += _RECORD_HEADER.size + location_len
+        obj = json.loads(self._mmap[offset:offset + json_len])
+        offset += json_len
+        if content_len:
+            obj['content_bytes'] = self._mmap[offset:offset + content_len]
+        return obj
+
+    def __getitem__(self, key: str) -> dict:
+        obj = self._key_to_obj.get(key)
+        if obj is not None:
+            return obj
+        if not key.startswith(self._prefix):
+            raise KeyError(key)
+        location = _encode_location(key[len(self._prefix):])
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._location_at(self._record_offset(mid)) < location:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self._count or \
+                self._location_at(self._record_offset(lo)) != location:
+            raise KeyError(key)
+        obj = self._decode(self._record_offset(lo))
+        self._key_to_obj[key] = obj
+        return obj
+
+    def __iter__(self) -> Iterator[str]:
+        for idx in range(self._count):
+            yield self._prefix + self._location_at(
+                self._record_offset(idx)
+            ).decode('utf-8', 'surrogateescape')
+
+    def __len__(self) -> int:
+        return self._count
@@ -69,6 +69,13 @@ class StorageInput:
     def read(self, size=None):
         return self._input.read() if size is None else self._input.read(size)
 
+    def fileno(self) -> int:
+        '''
+        Lets callers use e.g. `os.sendfile`.  Like `IOBase.fileno`, this
+        raises `OSError` if the blob is not backed by a file descriptor.
+        '''
+        return self._input.fileno()
+
 
 class Storage(Pluggable):
     '''
@@ -34,6 +34,14 @@ class FilesystemStorageTestCase(StorageBaseTestCase):
             # Did we produce the expected number of each kind of output?
             self.assertEqual(expected_content_count, content_count)
 
+    def test_fileno(self):
+        with self._temp_storage() as storage:
+            with storage.writer() as output:
+                output.write(b'abc')
+                sid = output.commit()
+            with storage.reader(sid) as input:
+                self.assertEqual(3, os.fstat(input.fileno()).st_size)
+
     # This test cannot be in the base since there's no generic way to check
     # if we left a trace on the storage system -- there's no ID to fetch.
     def test_uncommitted(self):
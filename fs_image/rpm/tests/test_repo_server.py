@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import email
 import hashlib
+import http.client
+import io
 import os
 import socket
 import requests
@@ -9,12 +11,17 @@ import threading
 import unittest
 
 from contextlib import contextmanager
+from unittest import mock
 
 from ..common import Checksum, Path
 from ..repo_objects import Repodata, RepoMetadata, Rpm
-from ..repo_server import _CHUNK_SIZE, repo_server, read_snapshot_dir
+from ..repo_server import (
+    _CHUNK_SIZE, read_snapshot_dir, repo_server,
+    RepoSnapshotHTTPRequestHandler, VerifiedBlobCache,
+)
 from ..repo_snapshot import RepoSnapshot, MutableRpmError
-from ..storage import Storage
+from ..snapshot_index import SNAPSHOT_INDEX_FILENAME, SnapshotIndex
+from ..storage import Storage, StorageInput
 
 
 def _checksum(algo: str, data: bytes) -> Checksum:
@@ -47,10 +54,12 @@ class RepoServerTestCase(unittest.TestCase):
         )
 
     @contextmanager
-    def repo_server_thread(self, location_to_obj):
+    def repo_server_thread(self, location_to_obj, **kwargs):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.bind(('127.0.0.1', 0))
-        with repo_server(sock, location_to_obj, self.storage) as httpd:
+        with repo_server(
+            sock, location_to_obj, self.storage, **kwargs,
+        ) as httpd:
             httpd.server_activate()
             thread = threading.Thread(name='RpSrv', target=httpd.serve_forever)
             thread.start()
@@ -162,6 +171,405 @@ class RepoServerTestCase(unittest.TestCase):
         self.assertIn("'sha256'", msg)
         self.assertNotIn("'size'", msg)
 
+    def test_keep_alive(self):
+        content = b'Two requests, one connection'
+        location_to_obj = {'repomd.xml': {
+            'size': len(content),
+            'build_timestamp': 0,
+            'content_bytes': content,
+        }}
+        with self.repo_server_thread(location_to_obj) as (host, port):
+            conn = http.client.HTTPConnection(host, port)
+            idle_conn = http.client.HTTPConnection(host, port)
+            idle_conn.connect()  # Does not block the other connection
+            for _ in range(2):
+                conn.request('GET', '/repomd.xml')
+                resp = conn.getresponse()
+                self.assertEqual(11, resp.version)
+                self.assertEqual(content, resp.read())
+            conn.request('GET', '/DOES_NOT_EXIST')
+            resp = conn.getresponse()
+            self.assertEqual(404, resp.status)
+            resp.read()
+            self.assertEqual('close', resp.getheader('connection'))
+            idle_conn.close()
+            conn.close()
+
+        with self.repo_server_thread(
+            location_to_obj, threaded=False,
+        ) as (host, port):
+            conn = http.client.HTTPConnection(host, port)
+            conn.request('GET', '/repomd.xml')
+            resp = conn.getresponse()
+            self.assertEqual(10, resp.version)
+            self.assertEqual(content, resp.read())
+            self.assertTrue(resp.will_close)
+            conn.close()
+
+    def _check_truncated_get(self, host, port, path, headers=None):
+        conn = http.client.HTTPConnection(host, port)
+        conn.request('GET', path, headers=headers or {})
+        resp = conn.getresponse()
+        self.assertEqual(206 if headers else 200, resp.status)
+        with self.assertRaises(http.client.IncompleteRead):
+            resp.read()
+        conn.close()
+
+    def test_concurrent_integrity_errors(self):
+        bad_blob = self._prep_bad_blob(
+            actual_size=271828, expected_size=314159, checksummed_size=271828,
+        )
+        storage_id = bad_blob['storage_id']
+        orig_reader = self.storage.reader
+        # Both requests start reading before either records the error.
+        barrier = threading.Barrier(2, timeout=10)
+
+        def reader(sid):
+            barrier.wait()
+            return orig_reader(sid)
+
+        location_to_obj = {'bad_blob': bad_blob}
+        with mock.patch.object(self.storage, 'reader', side_effect=reader), \
+                self.repo_server_thread(location_to_obj) as (host, port):
+            threads = [
+                threading.Thread(
+                    target=self._check_truncated_get,
+                    args=(host, port, '/bad_blob'),
+                ) for _ in range(2)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            req = requests.get(f'http://{host}:{port}/bad_blob')
+            self.assertEqual(500, req.status_code)
+            self.assertIn(b'file_integrity', req.content)
+        self.assertEqual({'size', 'build_timestamp', 'checksum', 'error'}, set(
+            location_to_obj['bad_blob'],
+        ))
+        self.assertEqual(
+            storage_id, location_to_obj['bad_blob']['error']['storage_id'],
+        )
+
+    def test_verified_blob_cache(self):
+        cache = VerifiedBlobCache(max_bytes=5)
+        self.assertFalse(cache.is_verified(('a', 'x')))
+        cache.add(('a', 'x'))
+        self.assertTrue(cache.is_verified(('a', 'x')))
+        self.assertFalse(cache.is_verified(('a', 'y')))  # Other checksum
+        self.assertIsNone(cache.get_content(('a', 'x')))
+
+        cache.add(('b', 'x'), b'bb')
+        cache.add(('c', 'x'), b'cc')
+        cache.add(('c', 'x'), b'cc')  # No double-counting
+        cache.add(('big', 'x'), b'123456')  # Verified, but never cached
+        self.assertTrue(cache.is_verified(('big', 'x')))
+        self.assertIsNone(cache.get_content(('big', 'x')))
+        self.assertEqual(b'bb', cache.get_content(('b', 'x')))  # Now newest
+        cache.add(('d', 'x'), b'dd')  # Evicts the least recently used
+        self.assertIsNone(cache.get_content(('c', 'x')))
+        self.assertTrue(cache.is_verified(('c', 'x')))
+        self.assertEqual(b'bb', cache.get_content(('b', 'x')))
+        self.assertEqual(b'dd', cache.get_content(('d', 'x')))
+
+        cache.invalidate(('b', 'x'))
+        cache.invalidate(('c', 'x'))
+        cache.invalidate(('NO', 'x'))  # No-op
+        self.assertFalse(cache.is_verified(('b', 'x')))
+        self.assertFalse(cache.is_verified(('c', 'x')))
+        self.assertIsNone(cache.get_content(('b', 'x')))
+        cache.add(('e', 'x'), b'eee')  # Fits, since 'bb' was freed
+        self.assertEqual(b'dd', cache.get_content(('d', 'x')))
+        self.assertEqual(b'eee', cache.get_content(('e', 'x')))
+
+    def test_sendfile_verified_blob(self):
+        content, sid = self._write(b'glibc' * 12345)
+        location_to_obj = {'hot.rpm': {
+            'size': len(content),
+            'build_timestamp': 0,
+            'storage_id': sid,
+            'checksum': str(_checksum('sha256', content)),
+        }}
+        with mock.patch.object(
+            RepoSnapshotHTTPRequestHandler, '_send_and_verify',
+            side_effect=RepoSnapshotHTTPRequestHandler._send_and_verify,
+            autospec=True,
+        ) as send_and_verify, \
+                self.repo_server_thread(location_to_obj) as (host, port):
+            for _ in range(3):
+                req = requests.get(f'http://{host}:{port}/hot.rpm')
+                req.raise_for_status()
+                self.assertEqual(content, req.content)
+            # Only the first request had to hash the blob.
+            self.assertEqual(1, send_and_verify.call_count)
+
+            # A blob of the wrong size is re-verified, and so caught.
+            path = self.storage._path_for_storage_id(
+                self.storage.strip_key(sid),
+            )
+            os.chmod(path, 0o644)
+            os.truncate(path, len(content) - 1)
+            self._check_truncated_get(host, port, '/hot.rpm')
+            self.assertEqual(2, send_and_verify.call_count)
+            req = requests.get(f'http://{host}:{port}/hot.rpm')
+            self.assertEqual(500, req.status_code)
+            self.assertIn(b'file_integrity', req.content)
+
+    def test_cache_non_file_blob_content(self):
+        small, small_sid = self._write(b'bash')
+        large, large_sid = self._write(b'kernel' * 10)
+        sid_to_content = {small_sid: small, large_sid: large}
+
+        @contextmanager
+        def reader(sid):
+            # Unlike the filesystem storage, these blobs have no `fileno`.
+            yield StorageInput(input=io.BytesIO(sid_to_content[sid]))
+
+        location_to_obj = {
+            location: {
+                'size': len(content),
+                'build_timestamp': 0,
+                'storage_id': sid,
+                'checksum': str(_checksum('sha256', content)),
+            } for location, content, sid in [
+                ('small.rpm', small, small_sid),
+                ('large.rpm', large, large_sid),
+            ]
+        }
+        verified_blobs = VerifiedBlobCache(max_bytes=len(small))
+        with mock.patch.object(
+            self.storage, 'reader', side_effect=reader,
+        ) as mock_reader, self.repo_server_thread(
+            location_to_obj, verified_blobs=verified_blobs,
+        ) as (host, port):
+            for _ in range(2):
+                for location, content in [
+                    ('small.rpm', small), ('large.rpm', large),
+                ]:
+                    req = requests.get(f'http://{host}:{port}/{location}')
+                    req.raise_for_status()
+                    self.assertEqual(content, req.content)
+            # The small blob was served from RAM the second time.
+            self.assertEqual(
+                [small_sid, large_sid, large_sid],
+                [c[0][0] for c in mock_reader.call_args_list],
+            )
+
+            # Memoizing an error invalidates the cache, and the error wins.
+            key = (small_sid, location_to_obj['small.rpm']['checksum'])
+            self.assertEqual(small, verified_blobs.get_content(key))
+            sid_to_content[large_sid] = b'rootkit' * 10
+            self._check_truncated_get(host, port, '/large.rpm')
+            self.assertFalse(verified_blobs.is_verified(
+                (large_sid, location_to_obj['large.rpm']['checksum']),
+            ))
+        self.assertIn('error', location_to_obj['large.rpm'])
+
+    def test_conditional_get(self):
+        content, sid = self._write(b'The same old RPM')
+        checksum = str(_checksum('sha256', content))
+        etag = f'"{checksum}"'
+        timestamp = 1234567890  # Fri, 13 Feb 2009 23:31:30 GMT
+        location_to_obj = {
+            'repomd.xml': {
+                'size': 3,
+                'build_timestamp': timestamp,
+                'content_bytes': b'xml',
+            },
+            'old.rpm': {
+                'size': len(content),
+                'build_timestamp': timestamp,
+                'storage_id': sid,
+                'checksum': checksum,
+            },
+        }
+        with self.repo_server_thread(location_to_obj) as (host, port):
+
+            def get(location, **headers):
+                req = requests.get(
+                    f'http://{host}:{port}/{location}', headers=headers,
+                )
+                req.raise_for_status()
+                return req
+
+            req = get('old.rpm')
+            self.assertEqual(content, req.content)
+            self.assertEqual(etag, req.headers['etag'])
+            self.assertEqual('bytes', req.headers['accept-ranges'])
+            self.assertNotIn('etag', get('repomd.xml').headers)
+
+            for location, headers in [
+                ('repomd.xml', {'If-Modified-Since': req.headers['date']}),
+                ('old.rpm', {
+                    'If-Modified-Since': 'Fri, 13 Feb 2009 23:31:30 GMT',
+                }),
+                ('old.rpm', {  # No time zone
+                    'If-Modified-Since': 'Fri, 13 Feb 2009 23:31:30 -0000',
+                }),
+                ('repomd.xml', {'If-None-Match': '*'}),
+                ('old.rpm', {'If-None-Match': f'"x", {etag}'}),
+                ('old.rpm', {'If-None-Match': f'W/{etag}'}),
+                ('old.rpm', {  # The ETag takes precedence
+                    'If-None-Match': etag,
+                    'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT',
+                }),
+            ]:
+                req = get(location, **headers)
+                self.assertEqual(304, req.status_code, (location, headers))
+                self.assertEqual(b'', req.content)
+                self.assertEqual(
+                    location == 'old.rpm', 'etag' in req.headers,
+                )
+
+            for location, headers in [
+                ('repomd.xml', {
+                    'If-Modified-Since': 'Fri, 13 Feb 2009 23:31:29 GMT',
+                }),
+                ('old.rpm', {'If-Modified-Since': 'not a date'}),
+                ('repomd.xml', {'If-None-Match': '"x"'}),
+                ('old.rpm', {  # The ETag takes precedence
+                    'If-None-Match': '"x"',
+                    'If-Modified-Since': req.headers['date'],
+                }),
+            ]:
+                req = get(location, **headers)
+                self.assertEqual(200, req.status_code, (location, headers))
+
+    def test_ranges(self):
+        content, sid = self._write(b'0123456789')
+        bad_blob = self._prep_bad_blob(
+            actual_size=5, expected_size=5, checksummed_size=4,
+        )
+        timestamp = 1234567890
+        location_to_obj = {
+            'repomd.xml': {
+                'size': len(content),
+                'build_timestamp': timestamp,
+                'content_bytes': content,
+            },
+            'file.rpm': {
+                'size': len(content),
+                'build_timestamp': timestamp,
+                'storage_id': sid,
+                'checksum': str(_checksum('sha256', content)),
+            },
+            'bad.rpm': bad_blob,
+        }
+        etag = f'"{location_to_obj["file.rpm"]["checksum"]}"'
+        last_modified = 'Fri, 13 Feb 2009 23:31:30 GMT'
+        verified_blobs = VerifiedBlobCache()
+        key = (sid, location_to_obj['file.rpm']['checksum'])
+        with self.repo_server_thread(
+            location_to_obj, verified_blobs=verified_blobs,
+        ) as (host, port):
+
+            def get(location, method='GET', **headers):
+                return requests.request(
+                    method, f'http://{host}:{port}/{location}',
+                    headers=headers,
+                )
+
+            # HEAD does not verify the blob.
+            req = get('file.rpm', method='HEAD', Range='bytes=2-5')
+            self.assertEqual(206, req.status_code)
+            self.assertEqual('bytes 2-5/10', req.headers['content-range'])
+            self.assertEqual('4', req.headers['content-length'])
+            self.assertFalse(verified_blobs.is_verified(key))
+
+            for range, content_range, expected in [
+                ('bytes=2-5', 'bytes 2-5/10', b'2345'),
+                ('bytes=4-', 'bytes 4-9/10', b'456789'),
+                ('bytes=7-100', 'bytes 7-9/10', b'789'),
+                ('bytes=-3', 'bytes 7-9/10', b'789'),
+                ('bytes=-30', 'bytes 0-9/10', content),
+            ]:
+                for location in ['file.rpm', 'repomd.xml']:
+                    req = get(location, Range=range)
+                    self.assertEqual(206, req.status_code)
+                    self.assertEqual(
+                        content_range, req.headers['content-range'],
+                    )
+                    self.assertEqual(expected, req.content)
+                # The first GET verified the whole blob.
+                self.assertTrue(verified_blobs.is_verified(key))
+
+            for range in ['bytes=10-', 'bytes=-0']:
+                req = get('file.rpm', Range=range)
+                self.assertEqual(416, req.status_code)
+                self.assertEqual('bytes */10', req.headers['content-range'])
+
+            for headers in [
+                {'Range': 'bytes=1-2,4-5'},  # Unsupported
+                {'Range': 'bytes=5-2'},  # Invalid
+                {'Range': 'bytes=-'},  # Invalid
+                {'Range': 'lines=1-2'},  # Unsupported unit
+                {'Range': 'bytes=1-2', 'If-Range': '"stale"'},
+            ]:
+                req = get('file.rpm', **headers)
+                self.assertEqual(200, req.status_code)
+                self.assertEqual(content, req.content)
+
+            for if_range in [etag, last_modified]:
+                req = get('file.rpm', Range='bytes=1-2', **{
+                    'If-Range': if_range,
+                })
+                self.assertEqual(206, req.status_code)
+                self.assertEqual(b'12', req.content)
+
+            # The range check reads the whole blob, so errors are reported
+            # right away, and not as a truncated body.
+            req = get('bad.rpm', Range='bytes=0-1')
+            self.assertEqual(500, req.status_code)
+            self.assertIn(b'file_integrity', req.content)
+
+            # A verified blob that shrank is served from storage, and its
+            # ranges are truncated.
+            path = self.storage._path_for_storage_id(
+                self.storage.strip_key(sid),
+            )
+            os.chmod(path, 0o644)
+            os.truncate(path, 8)
+            self._check_truncated_get(
+                host, port, '/file.rpm', headers={'Range': 'bytes=6-'},
+            )
+            self.assertFalse(verified_blobs.is_verified(key))
+            req = get('file.rpm', Range='bytes=1-2')
+            self.assertEqual(500, req.status_code)
+
+    def test_ranges_of_non_file_blobs(self):
+        content, sid = self._write(b'0123456789' * 3)
+
+        @contextmanager
+        def reader(sid):
+            yield StorageInput(input=io.BytesIO(content))
+
+        location_to_obj = {'blob.rpm': {
+            'size': len(content),
+            'build_timestamp': 0,
+            'storage_id': sid,
+            'checksum': str(_checksum('sha256', content)),
+        }}
+        for max_bytes in [0, len(content)]:  # Read from storage, or RAM
+            # Small chunks, so that ranges start & end mid-chunk.
+            with mock.patch(f'{repo_server.__module__}._CHUNK_SIZE', 7), \
+                    mock.patch.object(
+                        self.storage, 'reader', side_effect=reader,
+                    ), self.repo_server_thread(
+                        location_to_obj,
+                        verified_blobs=VerifiedBlobCache(max_bytes=max_bytes),
+                    ) as (host, port):
+                for range, expected in [
+                    ('bytes=9-22', content[9:23]),
+                    ('bytes=0-6', content[:7]),
+                    ('bytes=7-', content[7:]),
+                ]:
+                    req = requests.get(
+                        f'http://{host}:{port}/blob.rpm',
+                        headers={'Range': range},
+                    )
+                    self.assertEqual(206, req.status_code)
+                    self.assertEqual(expected, req.content)
+
     # This exercises `read_snapshot_dir` + typical access patterns with a
     # very minimal snapshot.
     def test_normal_snashot_dir_access(self):
@@ -220,26 +628,40 @@ class RepoServerTestCase(unittest.TestCase):
             os.mkdir(repo_dir / 'gpg_keys')
             with open(repo_dir / 'gpg_keys' / 'RPM-GPG-safekey', 'wb') as outf:
                 outf.write(b'public key')
-            with self.repo_server_thread(read_snapshot_dir(td)) as (h, p):
-                # A vanilla 404 doesn't affect the server's operation
-                req = requests.get(f'http://{h}:{p}//DOES_NOT_EXIST')
-                self.assertEqual(404, req.status_code)
+            # First, serve via the index.  Then, like an older snapshot
+            # without an index, via the JSON.
+            for has_index in [True, False]:
+                if not has_index:
+                    os.remove(repo_dir / SNAPSHOT_INDEX_FILENAME)
+                location_to_obj = read_snapshot_dir(td)
+                with self.repo_server_thread(location_to_obj) as (h, p):
+                    # A vanilla 404 doesn't affect the server's operation
+                    req = requests.get(f'http://{h}:{p}//DOES_NOT_EXIST')
+                    self.assertEqual(404, req.status_code)
 
-                req = requests.get(f'http://{h}:{p}/mine/repodata/repomd.xml')
-                req.raise_for_status()
-                self.assertEqual(repomd.xml, req.content)
+                    req = requests.get(
+                        f'http://{h}:{p}/mine/repodata/repomd.xml',
+                    )
+                    req.raise_for_status()
+                    self.assertEqual(repomd.xml, req.content)
 
-                req = requests.get(f'http://{h}:{p}/mine/repodata/the_only')
-                req.raise_for_status()
-                self.assertEqual(repodata_bytes, req.content)
+                    req = requests.get(
+                        f'http://{h}:{p}/mine/repodata/the_only',
+                    )
+                    req.raise_for_status()
+                    self.assertEqual(repodata_bytes, req.content)
 
-                req = requests.get(f'http://{h}:{p}/mine/RPM-GPG-safekey')
-                req.raise_for_status()
-                self.assertEqual(b'public key', req.content)
+                    req = requests.get(f'http://{h}:{p}/mine/RPM-GPG-safekey')
+                    req.raise_for_status()
+                    self.assertEqual(b'public key', req.content)
+
+                    req = requests.get(f'http://{h}:{p}/mine/pkgs/good.rpm')
+                    req.raise_for_status()
+                    self.assertEqual(rpm_bytes, req.content)
+                    req = requests.get(f'http://{h}:{p}/mine/pkgs/mutable.rpm')
+                    self.assertEqual(500, req.status_code)
+                    self.assertIn(b"'mutable_rpm'", req.content)
+                self.assertEqual(has_index, any(
+                    isinstance(m, SnapshotIndex) for m in location_to_obj.maps
+                ))
 
-                req = requests.get(f'http://{h}:{p}/mine/pkgs/good.rpm')
-                req.raise_for_status()
-                self.assertEqual(rpm_bytes, req.content)
-                req = requests.get(f'http://{h}:{p}/mine/pkgs/mutable.rpm')
-                self.assertEqual(500, req.status_code)
-                self.assertIn(b"'mutable_rpm'", req.content)
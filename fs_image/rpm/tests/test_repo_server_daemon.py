@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+import http.client
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from contextlib import contextmanager
+
+from ..common import send_fds
+from ..repo_server_daemon import RepoServerDaemon, run_daemon
+from ..storage import Storage
+
+
+class RepoServerDaemonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.td_ctx = tempfile.TemporaryDirectory()  # noqa: P201
+        self.td = self.td_ctx.__enter__()
+        self.addCleanup(self.td_ctx.__exit__, None, None, None)
+        os.mkdir(os.path.join(self.td, 'storage'))
+        self.storage = Storage.make(
+            key='test', kind='filesystem',
+            base_dir=os.path.join(self.td, 'storage'),
+        )
+        self.socket_path = os.path.join(self.td, 'daemon.sock')
+
+    @contextmanager
+    def _attach(self):
+        'Yields the (host, port) that the daemon serves for us.'
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn, \
+                socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            conn.connect(self.socket_path)
+            send_fds(conn, b'serve', [sock.fileno()])
+            self.assertEqual(b'ready', conn.recv(len(b'ready')))
+            yield sock.getsockname()
+
+    def _get(self, host, port, path):
+        conn = http.client.HTTPConnection(host, port)
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        finally:
+            conn.close()
+
+    def test_serve(self):
+        location_to_obj = {'repomd.xml': {
+            'size': 3, 'build_timestamp': 0, 'content_bytes': b'xml',
+        }}
+        daemon = RepoServerDaemon(location_to_obj, self.storage)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as lsock:
+            lsock.bind(self.socket_path)
+            lsock.listen()
+            # The idle timeout is long enough to let both clients attach.
+            serve_thread = threading.Thread(
+                target=daemon.serve, args=(lsock, 2),
+            )
+            serve_thread.start()
+            with self._attach() as addr1:
+                with self._attach() as addr2:
+                    self.assertNotEqual(addr1, addr2)
+                    for addr in [addr1, addr2]:
+                        self.assertEqual(
+                            (200, b'xml'), self._get(*addr, '/repomd.xml'),
+                        )
+                    self.assertEqual(404, self._get(*addr2, '/NOPE')[0])
+                # Once its client detaches, the socket is no longer served.
+                for _ in range(100):  # Detaching is asynchronous
+                    try:
+                        self._get(*addr2, '/repomd.xml')
+                    except ConnectionError:  # Refused, or reset
+                        break
+                    time.sleep(0.1)  # pragma: no cover
+                else:  # pragma: no cover
+                    self.fail(f'Still serving {addr2}')
+                self.assertEqual(
+                    (200, b'xml'), self._get(*addr1, '/repomd.xml'),
+                )
+            # The daemon exits once idle.
+            serve_thread.join()
+
+    def test_run_daemon(self):
+        snapshot_dir = os.path.join(self.td, 'snapshot')
+        os.mkdir(snapshot_dir)
+        # A daemon that was killed left its socket behind.
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(self.socket_path)
+
+        locked = threading.Event()
+        listening = threading.Event()
+        daemon_thread = threading.Thread(target=run_daemon, kwargs={
+            'socket_path': self.socket_path,
+            'snapshot_dir': snapshot_dir,
+            'storage': self.storage,
+            'idle_timeout': 2,
+            'on_locked': locked.set,
+            'on_listening': listening.set,
+        })
+        daemon_thread.start()
+        self.assertTrue(listening.wait(timeout=10))
+        self.assertTrue(locked.is_set())
+
+        # A second daemon defers to the first.
+        second_locked = threading.Event()
+        second_listening = threading.Event()
+        run_daemon(
+            self.socket_path, snapshot_dir, self.storage,
+            idle_timeout=60, on_locked=second_locked.set,
+            on_listening=second_listening.set,
+        )
+        self.assertTrue(second_listening.is_set())
+        self.assertFalse(second_locked.is_set())
+
+        with self._attach() as addr:
+            self.assertEqual(404, self._get(*addr, '/repomd.xml')[0])
+        daemon_thread.join()
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,7 @@ from ..repo_objects import Repodata, RepoMetadata, Rpm
 from ..repo_snapshot import (
     FileIntegrityError, HTTPError, MutableRpmError, RepoSnapshot,
 )
+from ..snapshot_index import SNAPSHOT_INDEX_FILENAME, SnapshotIndex
 
 
 class RepoSnapshotTestCase(unittest.TestCase):
@@ -74,8 +75,8 @@ class RepoSnapshotTestCase(unittest.TestCase):
         with tempfile.TemporaryDirectory() as td:
             snapshot.to_directory(Path(td))
             self.assertEqual(
-                ['repomd.xml', 'repodata.json', 'rpm.json'],
-                os.listdir(td),
+                ['repodata.json', 'repomd.xml', 'rpm.json', 'snapshot.index'],
+                sorted(os.listdir(td)),
             )
             with open(os.path.join(td, 'repomd.xml'), 'rb') as f:
                 self.assertEqual(b'foo', f.read())
@@ -132,6 +133,20 @@ class RepoSnapshotTestCase(unittest.TestCase):
                     },
                 }, json.loads(f.read()))
 
+            # The index has the objects from the JSON, plus `repomd.xml`.
+            location_to_obj = {}
+            for filename in ['repodata.json', 'rpm.json']:
+                with open(os.path.join(td, filename)) as f:
+                    location_to_obj.update(json.load(f))
+            self.assertEqual({
+                'repodata/repomd.xml': {
+                    'size': repomd.size,
+                    'build_timestamp': repomd.build_timestamp,
+                    'content_bytes': b'foo',
+                },
+                **location_to_obj,
+            }, dict(SnapshotIndex(Path(td) / SNAPSHOT_INDEX_FILENAME)))
+
         # Check the visitor
         mock = unittest.mock.MagicMock()
         snapshot.visit(mock)
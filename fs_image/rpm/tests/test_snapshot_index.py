@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import tempfile
+import unittest
+
+from ..common import Path
+from ..snapshot_index import SnapshotIndex, write_snapshot_index
+
+
+class SnapshotIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.td_ctx = tempfile.TemporaryDirectory()  # noqa: P201
+        self.td = Path(self.td_ctx.__enter__())
+        self.addCleanup(self.td_ctx.__exit__, None, None, None)
+
+    def _write(self, location_to_obj):
+        write_snapshot_index(self.td / 'index', location_to_obj)
+        return self.td / 'index'
+
+    def test_lookup(self):
+        location_to_obj = {
+            f'pkgs/{i}.rpm': {'size': i, 'storage_id': f'sid{i}'}
+                for i in range(0, 100, 3)
+        }
+        location_to_obj['repodata/repomd.xml'] = {
+            'size': 3, 'build_timestamp': 5, 'content_bytes': b'xml',
+        }
+        # Invalid UTF-8, as per `Path.decode`
+        location_to_obj['pkgs/bad\udcc3.rpm'] = {'error': {'error': 'x'}}
+        index = SnapshotIndex(self._write(location_to_obj), prefix='repo/')
+
+        self.assertEqual(len(location_to_obj), len(index))
+        # Iteration is in the order of the index, i.e. by UTF-8 bytes.
+        self.assertEqual(
+            sorted(
+                location_to_obj,
+                key=lambda l: l.encode('utf-8', 'surrogateescape'),
+            ),
+            [l[len('repo/'):] for l in index],
+        )
+        for location, obj in location_to_obj.items():
+            self.assertEqual(obj, index['repo/' + location])
+        for missing in [
+            'repo/pkgs/1.rpm',  # Between two locations
+            'repo/a',  # Before the first
+            'repo/z',  # After the last
+            'repo/',
+            'pkgs/0.rpm',  # No prefix
+        ]:
+            self.assertNotIn(missing, index)
+            self.assertIsNone(index.get(missing))
+
+    def test_mutate(self):
+        index = SnapshotIndex(self._write({'a': {'storage_id': 'sid'}}))
+        # Like `RepoSnapshotHTTPRequestHandler._memoize_error`
+        index['a']['error'] = index['a'].pop('storage_id')
+        self.assertEqual({'error': 'sid'}, index['a'])
+
+    def test_empty(self):
+        index = SnapshotIndex(self._write({}))
+        self.assertEqual({}, dict(index))
+        self.assertNotIn('a', index)
+
+    def test_bad_magic(self):
+        with open(self.td / 'bad', 'wb') as f:
+            f.write(b'0' * 16)
+        with self.assertRaisesRegex(RuntimeError, 'not a snapshot index'):
+            SnapshotIndex(self.td / 'bad')
+
+
+if __name__ == '__main__':
+    unittest.main()
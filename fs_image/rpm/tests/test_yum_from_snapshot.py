@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
+import http.client
+import json
 import os
+import socket
 import tempfile
 import subprocess
+import threading
 import unittest
 
+from contextlib import contextmanager
+from unittest import mock
+
 from ..common import init_logging, Path
+from ..repo_server_daemon import run_daemon
+from ..storage import Storage
+from ..yum_from_snapshot import (
+    _absolute_storage_cfg, _attach_to_repo_server_daemon,
+    _repo_server_daemon_socket_path,
+)
 from .yum_from_test_snapshot import yum_from_test_snapshot
 
 
@@ -13,12 +26,12 @@ init_logging()
 
 class YumFromSnapshotTestCase(unittest.TestCase):
 
-    def test_verify_contents_of_install_from_snapshot(self):
+    def _check_install_from_snapshot(self, shared_repo_server_idle_timeout):
         install_root = Path(tempfile.mkdtemp())
         try:
             yum_from_test_snapshot(install_root, [
                 'install', '--assumeyes', 'rpm-test-carrot', 'rpm-test-mice',
-            ])
+            ], shared_repo_server_idle_timeout=shared_repo_server_idle_timeout)
 
             # Remove known content so we can check there is nothing else.
             remove = []
@@ -55,3 +68,120 @@ class YumFromSnapshotTestCase(unittest.TestCase):
             assert install_root != '/'
             # Courtesy of `yum`, the `install_root` is now owned by root.
             subprocess.run(['sudo', 'rm', '-rf', install_root], check=True)
+
+    def test_verify_contents_of_install_from_snapshot(self):
+        self._check_install_from_snapshot(None)
+
+    def test_install_via_shared_repo_server(self):
+        self._check_install_from_snapshot(1)
+
+    def test_repo_server_daemon_socket_path(self):
+        with tempfile.TemporaryDirectory() as td, \
+                mock.patch.object(tempfile, 'gettempdir', return_value=td):
+            snapshot_dir = Path(td) / 'snapshot'
+            os.mkdir(snapshot_dir)
+            path = _repo_server_daemon_socket_path('{}', snapshot_dir)
+            self.assertEqual(
+                path, _repo_server_daemon_socket_path('{}', snapshot_dir),
+            )
+            self.assertNotEqual(
+                path, _repo_server_daemon_socket_path('[]', snapshot_dir),
+            )
+            with open(snapshot_dir / 'rpm.json', 'w') as f:
+                f.write('{}')
+            self.assertNotEqual(
+                path, _repo_server_daemon_socket_path('{}', snapshot_dir),
+            )
+            # Other users could connect to our daemons
+            os.chmod(os.path.dirname(path), 0o755)
+            with self.assertRaisesRegex(RuntimeError, 'must be private'):
+                _repo_server_daemon_socket_path('{}', snapshot_dir)
+
+    def test_absolute_storage_cfg(self):
+        self.assertEqual(
+            json.dumps({
+                'base_dir': os.path.abspath('storage'),
+                'key': 'test',
+                'kind': 'filesystem',
+            }, sort_keys=True),
+            _absolute_storage_cfg(
+                '{"kind": "filesystem", "key": "test", "base_dir": "storage"}'
+            ),
+        )
+        self.assertEqual(
+            '{"key": "test", "kind": "other"}',
+            _absolute_storage_cfg('{"kind": "other", "key": "test"}'),
+        )
+
+    def test_attach_to_repo_server_daemon(self):
+        td_ctx = tempfile.TemporaryDirectory()  # noqa: P201
+        td = Path(td_ctx.__enter__())
+        self.addCleanup(td_ctx.__exit__, None, None, None)
+        os.mkdir(td / 'snapshot')
+        os.mkdir(td / 'storage')
+        storage_cfg = json.dumps({
+            'key': 'test', 'kind': 'filesystem',
+            'base_dir': (td / 'storage').decode(),
+        })
+        daemon_threads = []
+
+        def start_daemon(cmd, **kwargs):
+            'Like `repo-server-daemon`, returns once it is listening.'
+            opts = dict(zip(cmd[1::2], cmd[2::2]))
+            listening = threading.Event()
+            daemon_threads.append(threading.Thread(target=run_daemon, kwargs={
+                'socket_path': opts['--daemon-socket'],
+                'snapshot_dir': opts['--snapshot-dir'],
+                'storage': Storage.from_json(opts['--storage']),
+                'idle_timeout': float(opts['--idle-timeout']),
+                'on_listening': listening.set,
+            }))
+            daemon_threads[-1].start()
+            listening.wait()
+
+        @contextmanager
+        def attach():
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.bind(('127.0.0.1', 0))
+                host, port = sock.getsockname()
+                with _attach_to_repo_server_daemon(
+                    socket.socket(fileno=os.dup(sock.fileno())),
+                    storage_cfg, td / 'snapshot', 2,
+                ):
+                    conn = http.client.HTTPConnection(host, port)
+                    conn.request('GET', '/repomd.xml')
+                    # The snapshot is empty, but we were served
+                    self.assertEqual(404, conn.getresponse().status)
+                    conn.close()
+                    yield
+
+        with mock.patch.object(
+            tempfile, 'gettempdir', return_value=td.decode(),
+        ), mock.patch.object(
+            subprocess, 'run', side_effect=start_daemon,
+        ) as mock_run:
+            socket_path = _repo_server_daemon_socket_path(
+                _absolute_storage_cfg(storage_cfg), td / 'snapshot',
+            )
+            # A daemon that exits as we connect makes us start a new one.
+            lsock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            lsock.bind(socket_path)
+            lsock.listen()
+
+            def exit_on_connect():
+                with lsock:
+                    lsock.accept()[0].close()
+
+            exiting_thread = threading.Thread(target=exit_on_connect)
+            exiting_thread.start()
+            with attach(), attach():  # Both runs share one daemon
+                pass
+            exiting_thread.join()
+            self.assertEqual(1, mock_run.call_count)
+            daemon_threads[0].join()  # It exits once idle
+
+            mock_run.side_effect = None  # The daemon fails to start
+            with self.assertRaisesRegex(RuntimeError, 'Could not attach'):
+                with attach():
+                    pass  # pragma: no cover
+
@@ -10,7 +10,10 @@ from ..common import init_logging, Path
 from ..yum_from_snapshot import add_common_yum_args, yum_from_snapshot
 
 
-def yum_from_test_snapshot(install_root: 'AnyStr', yum_args: 'List[AnyStr]'):
+def yum_from_test_snapshot(
+    install_root: 'AnyStr', yum_args: 'List[AnyStr]',
+    *, shared_repo_server_idle_timeout: 'Optional[float]' = None,
+):
     # This works in @mode/opt since the snapshot is baked into the XAR
     snapshot_dir = Path(os.path.dirname(__file__)) / 'snapshot'
     yum_from_snapshot(
@@ -22,6 +25,7 @@ def yum_from_test_snapshot(install_root: 'AnyStr', yum_args: 'List[AnyStr]'):
         snapshot_dir=snapshot_dir / 'repos',
         install_root=Path(install_root),
         yum_args=yum_args,
+        shared_repo_server_idle_timeout=shared_repo_server_idle_timeout,
     )
 
 
@@ -38,4 +42,7 @@ if __name__ == '__main__':  # pragma: no cover
 
     init_logging()
 
-    yum_from_test_snapshot(args.install_root, args.yum_args)
+    yum_from_test_snapshot(
+        args.install_root, args.yum_args,
+        shared_repo_server_idle_timeout=args.shared_repo_server_idle_timeout,
+    )
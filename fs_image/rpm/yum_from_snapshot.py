@@ -59,12 +59,12 @@ The current tool works well, with these caveats:
     a vanilla `yum install net-tools` takes about 1:00, while the current
     `yum-from-snapshot` needs 3:40. The two major reasons are:
 
-      * `repo-server` could be faster, specifically it (i) should support
-        serving multiple files in parallel, (ii) the Facebook-production
-        blob store has some notes on how to eliminate the ~1 second-per-blob
-        fetch latency at the expense of 1-2 days of work, (iii) some caching
-        of blobs may help, (iv) we could add a SQLite version of the
-        JSON snapshot data into the blobstore for faster boot.
+      * `repo-server` could be faster, even though it now serves files in
+        parallel, caches verified blobs, starts from a memory-mapped index,
+        and can be shared across runs via
+        `--shared-repo-server-idle-timeout`.  The Facebook-production blob
+        store has some notes on how to eliminate the ~1 second-per-blob
+        fetch latency at the expense of 1-2 days of work.
 
       * Since we typically run `yum` in an empty clean install-root, the
         initial run is extra-slow due to having to download the repodata,
@@ -84,8 +84,7 @@ The current tool works well, with these caveats:
     snapshot-based install?  Fake it?  Add `/etc/*-release` from the
     snapshot host to the snapshot?
 
-Besides the easy fix of parallelizing `repo-server`, the best
-reward-for-effort improvement to `yum-from-snapshot` would come from
+The best reward-for-effort improvement to `yum-from-snapshot` would come from
 building a "yum appliance", along these lines:
 
   - For each new repo snapshot, we eagerly construct an OS image (either via
@@ -108,19 +107,24 @@ building a "yum appliance", along these lines:
         One could `nspawn --bind /install_root --private-network -x` into
         the image to use `yum-from-snapshot` in a truly hermetic way.
 '''
-import array
+import hashlib
+import json
 import os
 import shlex
 import socket
+import stat
 import subprocess
 import tempfile
 import textwrap
 import time
 
 from contextlib import contextmanager
+from typing import Optional
 from urllib.parse import urlparse, urlunparse
 
-from .common import get_file_logger, check_popen_returncode, Path
+from .common import (
+    check_popen_returncode, get_file_logger, Path, recv_fds, send_fds,
+)
 from .yum_conf import YumConfParser
 
 log = get_file_logger(__file__)
@@ -134,28 +138,6 @@ def _listen_unix_socket(path: str) -> 'Iterator[socket.socket]':
         yield lsock
 
 
-def _recv_fds(sock, msglen, maxfds, inheritable=False):
-    '''
-    Receives via a Unix domain socket a message of at most `msglen` bytes,
-    with at most `maxfds` file descriptors in the ancillary data.  The file
-    descriptors will be marked O_CLOEXEC unless inheritable is set to False.
-    '''
-    fds = array.array('i')
-    msg, ancdata, msg_flags, _addr = sock.recvmsg(
-        msglen, maxfds * socket.CMSG_SPACE(fds.itemsize),
-        0 if inheritable else socket.MSG_CMSG_CLOEXEC,
-    )
-    assert not (msg_flags & socket.MSG_TRUNC), msg_flags
-    assert not (msg_flags & socket.MSG_CTRUNC), msg_flags
-    assert not (msg_flags & socket.MSG_ERRQUEUE), msg_flags
-    for cmsg_level, cmsg_type, cmsg_data in ancdata:
-        assert cmsg_level == socket.SOL_SOCKET, cmsg_level
-        assert cmsg_type == socket.SCM_RIGHTS, cmsg_type
-        assert len(cmsg_data) % fds.itemsize == 0, cmsg_data
-        fds.frombytes(cmsg_data)
-    return msg, list(fds)
-
-
 @contextmanager
 def _prepare_isolated_yum_conf(
     inp: 'TextIO', out: tempfile.NamedTemporaryFile,
@@ -206,11 +188,103 @@ def _repo_server(sock: socket.socket, storage_cfg: str, snapshot_dir: Path):
         '--snapshot-dir', snapshot_dir,
     ], pass_fds=[sock.fileno()]) as server_proc:
         try:
-            yield server_proc
+            log.info('Waiting for repo server to listen')
+            while server_proc.poll() is None:
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN):
+                    break
+                time.sleep(0.1)
+            yield
         finally:
             server_proc.kill()  # It's a read-only proxy, abort ASAP
 
 
+def _repo_server_daemon_socket_path(storage_cfg: str, snapshot_dir: Path):
+    '''
+    Runs with the same storage & snapshot share a `repo-server-daemon`.
+    The key includes the sizes & mtimes of the snapshot files, so that a
+    daemon never serves a stale snapshot.
+    '''
+    snapshot_files = []
+    for dirpath, _, filenames in os.walk(os.path.realpath(snapshot_dir)):
+        for filename in filenames:
+            st = os.stat(os.path.join(dirpath, filename))
+            snapshot_files.append((
+                Path(os.path.join(dirpath, filename)).decode(),
+                st.st_size, st.st_mtime_ns,
+            ))
+    key = hashlib.sha256(json.dumps(
+        [storage_cfg, sorted(snapshot_files)],
+    ).encode()).hexdigest()[:32]  # Unix socket paths are short
+    # Only this user may connect to its daemons.
+    sock_dir = os.path.join(
+        tempfile.gettempdir(), f'repo-server-daemons-{os.getuid()}',
+    )
+    os.makedirs(sock_dir, mode=0o700, exist_ok=True)
+    st = os.stat(sock_dir)
+    if st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o700:
+        raise RuntimeError(f'{sock_dir} must be private to uid {os.getuid()}')
+    return os.path.join(sock_dir, key + '.sock')
+
+
+def _absolute_storage_cfg(storage_cfg: str) -> str:
+    '''
+    The daemon outlives our working directory, and serves other runs, so
+    resolve the paths in the storage config.  The result is canonical, so
+    equivalent configs share a daemon.
+    '''
+    cfg = json.loads(storage_cfg)
+    if cfg.get('kind') == 'filesystem':
+        cfg['base_dir'] = os.path.abspath(cfg['base_dir'])
+    return json.dumps(cfg, sort_keys=True)
+
+
+@contextmanager
+def _attach_to_repo_server_daemon(
+    sock: socket.socket, storage_cfg: str, snapshot_dir: Path,
+    idle_timeout: float,
+):
+    '''
+    Like `_repo_server`, but `sock` is served by a `repo-server-daemon`
+    shared with other runs, which we start if needed.  It serves `sock`
+    until we exit the context.
+    '''
+    storage_cfg = _absolute_storage_cfg(storage_cfg)
+    socket_path = _repo_server_daemon_socket_path(storage_cfg, snapshot_dir)
+    with sock:
+        for attempt in range(_REPO_SERVER_DAEMON_ATTEMPTS):
+            if attempt:
+                # No daemon yet, or it was just exiting due to idleness.
+                # This returns once some daemon listens on `socket_path`.
+                # Once it serves `socket_path`, the daemon logs to the
+                # `.log` file next to it.
+                subprocess.run([
+                    os.path.join(
+                        os.path.dirname(__file__), 'repo-server-daemon',
+                    ),
+                    '--daemon-socket', socket_path,
+                    '--storage', storage_cfg,
+                    '--snapshot-dir', snapshot_dir,
+                    '--idle-timeout', str(idle_timeout),
+                ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                    check=True)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                try:
+                    conn.connect(socket_path)
+                    send_fds(conn, b'serve', [sock.fileno()])
+                    if conn.recv(len(b'ready')) != b'ready':
+                        continue  # The daemon exited before serving us.
+                except (FileNotFoundError, ConnectionError):
+                    continue
+                log.info(f'Attached to repo-server daemon {socket_path}')
+                yield
+                return  # Closing `conn` detaches us.
+        raise RuntimeError(f'Could not attach to daemon at {socket_path}')
+
+
+# A fresh daemon only fails to serve us if an idle one was exiting.
+_REPO_SERVER_DAEMON_ATTEMPTS = 4
+
+
 @contextmanager
 def _temp_fifo() -> str:
     with tempfile.TemporaryDirectory() as td:
@@ -364,7 +438,13 @@ def _make_socket_and_send_via(*, unix_sock_fd):
 def yum_from_snapshot(
     *, storage_cfg: str, snapshot_dir: Path, install_root: Path,
     yum_args: 'List[str]',
+    shared_repo_server_idle_timeout: Optional[float] = None,
 ):
+    '''
+    By default, runs a private `repo-server` for this `yum` invocation.
+    With `shared_repo_server_idle_timeout`, attaches to a long-lived
+    `repo-server-daemon` instead, cf. its docblock.
+    '''
     # These user-specified arguments could really mess up hermeticity.
     for bad_arg in ['--installroot', '--config', '--setopt', '--downloaddir']:
         for arg in yum_args:
@@ -418,7 +498,7 @@ def yum_from_snapshot(
             # Future: add timeout to connect & _recv_fds so that if the
             # `send_fds` helper crashes, we don't wait forever.
             unix_sock.connect(unix_sock_path)
-            _msg, (repo_server_sock_fd,) = _recv_fds(unix_sock, 128, 1)
+            _msg, (repo_server_sock_fd,) = recv_fds(unix_sock, 128, 1)
             repo_server_sock = socket.socket(fileno=repo_server_sock_fd)
         check_popen_returncode(sock_proc)
 
@@ -428,22 +508,19 @@ def yum_from_snapshot(
         log.info(f'Bound {netns_path} socket to {host}:{port}')
 
         # The server takes ownership of the socket, so we don't enter it here.
-        with _repo_server(
-            repo_server_sock, storage_cfg, snapshot_dir
-        ) as server_proc, \
+        with (
+            _repo_server(repo_server_sock, storage_cfg, snapshot_dir)
+                if shared_repo_server_idle_timeout is None
+                else _attach_to_repo_server_daemon(
+                    repo_server_sock, storage_cfg, snapshot_dir,
+                    shared_repo_server_idle_timeout,
+                )
+        ), \
                 open(snapshot_dir / 'yum.conf') as in_yum_conf, \
                 _prepare_isolated_yum_conf(
                     in_yum_conf, out_yum_conf, install_root, host, port
                 ):
 
-            log.info('Waiting for repo server to listen')
-            while server_proc.poll() is None:
-                if repo_server_sock.getsockopt(
-                    socket.SOL_SOCKET, socket.SO_ACCEPTCONN,
-                ):
-                    break
-                time.sleep(0.1)
-
             log.info('Ready to run yum')
             ready_out.write('ready')  # `yum` can run now.
             ready_out.close()  # Proceed past the inner `read`.
@@ -462,6 +539,12 @@ def add_common_yum_args(parser: 'argparse.ArgumentParser'):  # pragma: no cover
             'literally `yum --installroot`, but it is required here because '
             'most users of `yum-from-snapshot` should not install to /.',
     )
+    parser.add_argument(
+        '--shared-repo-server-idle-timeout', type=float,
+        help='Serve the snapshot from a `repo-server-daemon` shared with '
+            'other `yum-from-snapshot` runs on this host. It exits after '
+            'being idle for this many seconds.',
+    )
     parser.add_argument(
         'yum_args', nargs='+',
         help='Pass these through to `yum`. You will want to use -- before '
@@ -504,4 +587,5 @@ if __name__ == '__main__':  # pragma: no cover
         snapshot_dir=args.snapshot_dir,
         install_root=args.install_root,
         yum_args=args.yum_args,
+        shared_repo_server_idle_timeout=args.shared_repo_server_idle_timeout,
     )